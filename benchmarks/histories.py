@@ -0,0 +1,13 @@
+"""
+Access to the test fixtures from the benchmarks
+"""
+import json
+import os
+
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'tests', 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_PATH, name)) as fp:
+        return json.load(fp)
@@ -0,0 +1,88 @@
+"""
+Checks that the history passes which prepend events scale linearly with history length
+
+Usage:
+    python -m benchmarks.linear_scaling
+
+Exits with a non-zero status if the time per event at the largest size exceeds the time per event
+at the smallest size by more than the allowed factor.
+"""
+from copy import deepcopy
+from itertools import islice
+import sys
+import timeit
+
+from openapscontrib.mmhistorytools.historytools import AppendDoseToHistory
+from openapscontrib.mmhistorytools.historytools import ReconcileHistory
+from openapscontrib.mmhistorytools.historytools import convert_reservoir_history_to_temp_basal
+from tests.synthetic import SyntheticHistory
+
+from .histories import load_fixture
+
+
+SIZES = (1000, 10000, 100000)
+MAX_GROWTH_FACTOR = 3.0
+
+
+def _best_time(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def time_reconcile(size):
+    history = list(islice(SyntheticHistory().iter_pump_history(), size))
+
+    # Reconciliation modifies the events it trims, so each run needs its own copy
+    copies = [deepcopy(history) for _ in range(3)]
+
+    return _best_time(lambda: ReconcileHistory(copies.pop())), len(history)
+
+
+def time_append_dose(size):
+    doses = [
+        dict(dose, timestamp=event['timestamp'])
+        for dose, event in zip(
+            load_fixture('set_two_doses.json') * (size // 2 + 1),
+            reversed(list(islice(SyntheticHistory().iter_pump_history(), size)))
+        )
+    ][:size]
+
+    return _best_time(lambda: AppendDoseToHistory([], doses)), len(doses)
+
+
+def time_reservoir(size):
+    history = list(islice(SyntheticHistory().iter_reservoir_history(size / 12.0), size))
+
+    return _best_time(lambda: convert_reservoir_history_to_temp_basal(history)), len(history)
+
+
+def main():
+    failures = []
+
+    for name, timer in (
+        ('ReconcileHistory', time_reconcile),
+        ('AppendDoseToHistory', time_append_dose),
+        ('convert_reservoir_history_to_temp_basal', time_reservoir)
+    ):
+        per_event = []
+
+        for size in SIZES:
+            seconds, count = timer(size)
+            per_event.append(seconds / count)
+            print('{:<42}{:>8d} events{:>10.3f}s{:>10.2f}us/event'.format(
+                name, count, seconds, seconds / count * 1e6
+            ))
+
+        growth = per_event[-1] / per_event[0]
+        if growth > MAX_GROWTH_FACTOR:
+            failures.append('{} time per event grew {:.1f}x from {} to {} events'.format(
+                name, growth, SIZES[0], SIZES[-1]
+            ))
+
+    for failure in failures:
+        sys.stderr.write(failure + '\n')
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Compares the iterative and vectorized reservoir-to-temp-basal conversions
+
+Usage:
+    python -m benchmarks.reservoir_conversion
+
+Requires numpy. Exits with a non-zero status if the two conversions disagree.
+"""
+from itertools import islice
+import sys
+import timeit
+
+from openapscontrib.mmhistorytools import historytools
+from openapscontrib.mmhistorytools import tables
+from tests.synthetic import SyntheticHistory
+
+
+# One week and one year of readings every 5 minutes
+SIZES = (2016, 105120)
+
+
+def main():
+    for size in SIZES:
+        history = list(islice(SyntheticHistory().iter_reservoir_history(size / 12.0), size))
+
+        if historytools.convert_reservoir_history_to_temp_basal(history) != \
+                tables.convert_reservoir_history_to_temp_basal(history):
+            sys.stderr.write('Conversions disagree for {} entries\n'.format(size))
+            return 1
+
+        for name, func in (
+            ('iterative', lambda: historytools.convert_reservoir_history_to_temp_basal(history)),
+            ('vectorized', lambda: tables.convert_reservoir_history_to_temp_basal(history)),
+            ('vectorized table', lambda: tables.convert_reservoir_history_to_temp_basal(history, as_table=True))
+        ):
+            seconds = min(timeit.repeat(func, number=1, repeat=3))
+            print('{:<20}{:>8d} entries{:>10.3f}s'.format(name, size, seconds))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Times each history pass and command at realistic history lengths
+
+Usage:
+    python -m benchmarks.suite [--sizes 1h,24h] [--output results.json]
+                               [--baseline baseline.json] [--save-baseline baseline.json]
+
+A table of results is written to stderr, and the results as JSON to `--output` (or stdout).
+
+With `--baseline`, each timing is compared to the same benchmark in a results file saved by an
+earlier run on the same machine, and the command exits with a non-zero status if any benchmark
+is slower by more than the allowed factor. Timings under `--min-seconds` are too noisy to compare
+and are skipped. A missing baseline file is reported and skipped rather than failing the run.
+"""
+import argparse
+from copy import deepcopy
+from datetime import timedelta
+import json
+import os
+import platform
+import sys
+import timeit
+
+from openapscontrib.mmhistorytools.historytools import AppendDoseToHistory
+from openapscontrib.mmhistorytools.historytools import CleanHistory
+from openapscontrib.mmhistorytools.historytools import NormalizeRecords
+from openapscontrib.mmhistorytools.historytools import ReconcileHistory
+from openapscontrib.mmhistorytools.historytools import ResolveHistory
+from openapscontrib.mmhistorytools.historytools import TrimHistory
+from openapscontrib.mmhistorytools.historytools import append_reservoir_entry_to_history
+from openapscontrib.mmhistorytools.historytools import convert_reservoir_history_to_temp_basal
+from openapscontrib.mmhistorytools.reservoir import ReservoirStore
+from openapscontrib.mmhistorytools.timestamps import parse_timestamp
+from tests.synthetic import SyntheticHistory
+
+from .histories import load_fixture
+
+
+SIZES = (
+    ('1h', 1),
+    ('24h', 24),
+    ('7d', 24 * 7),
+    ('90d', 24 * 90)
+)
+
+
+class Inputs(object):
+    """The inputs to each benchmark for one history length, built once and shared"""
+    def __init__(self, hours):
+        self.hours = hours
+        self.basal_schedule = load_fixture('basal.json')
+
+        history = SyntheticHistory()
+        self.pump_history = list(history.iter_pump_history(hours))
+        self.reservoir_history = list(history.iter_reservoir_history(hours))
+        self.end_datetime = history.end_datetime
+
+        self.clean_history = CleanHistory(self.pump_history).clean_history
+        self.reconciled_history = ReconcileHistory(deepcopy(self.clean_history)).reconciled_history
+        self.resolved_records = ResolveHistory(self.reconciled_history).resolved_records
+
+        # One enacted dose per 5-minute loop cycle
+        dose = load_fixture('set_two_doses.json')[1]
+        self.doses = [
+            dict(dose, timestamp=(self.end_datetime + timedelta(minutes=5 * index)).isoformat())
+            for index in range(int(hours * 12))
+        ]
+
+
+def _copies(value, repeat):
+    return [deepcopy(value) for _ in range(repeat)]
+
+
+def benchmarks(inputs, repeat):
+    """Returns the benchmarks for a history length
+
+    :return: A list of (name, event count, callable) tuples. Passes which modify their input are
+    given a fresh copy on each run.
+    :rtype: list(tuple(str, int, callable))
+    """
+    reconcile_inputs = _copies(inputs.clean_history, repeat)
+    normalize_inputs = _copies(inputs.resolved_records, repeat)
+    append_dose_inputs = _copies(inputs.clean_history, repeat)
+    chained_inputs = _copies(inputs.pump_history, repeat)
+    reservoir_inputs = [list(inputs.reservoir_history) for _ in range(repeat)]
+
+    reservoir_datetime = parse_timestamp(inputs.reservoir_history[-1]['date']) + timedelta(minutes=5)
+
+    def prepare_chained():
+        clean_history = CleanHistory(chained_inputs.pop()).clean_history
+        reconciled_history = ReconcileHistory(clean_history).reconciled_history
+        resolved_records = ResolveHistory(reconciled_history, compact_records=True).resolved_records
+
+        return NormalizeRecords(
+            resolved_records,
+            basal_schedule=inputs.basal_schedule,
+            compact_records=True,
+            sweep_line=True
+        ).normalized_records
+
+    def store_append():
+        store = ReservoirStore(lookback_hours=inputs.hours)
+        store.entries.extend(inputs.reservoir_history)
+        store.append(100.0, reservoir_datetime)
+
+    pump_count = len(inputs.pump_history)
+    reservoir_count = len(inputs.reservoir_history)
+
+    return [
+        ('TrimHistory', pump_count, lambda: TrimHistory(
+            inputs.pump_history,
+            end_datetime=inputs.end_datetime,
+            duration_hours=inputs.hours / 2.0
+        )),
+        ('TrimHistory(sorted)', pump_count, lambda: TrimHistory(
+            inputs.pump_history,
+            end_datetime=inputs.end_datetime,
+            duration_hours=inputs.hours / 2.0,
+            sorted_history=True
+        )),
+        ('CleanHistory', pump_count, lambda: CleanHistory(inputs.pump_history)),
+        ('ReconcileHistory', pump_count, lambda: ReconcileHistory(reconcile_inputs.pop())),
+        ('ResolveHistory', pump_count, lambda: ResolveHistory(inputs.reconciled_history)),
+        ('NormalizeRecords', len(inputs.resolved_records), lambda: NormalizeRecords(
+            normalize_inputs.pop(),
+            basal_schedule=inputs.basal_schedule,
+            zero_datetime=inputs.end_datetime
+        )),
+        ('prepare(chained)', pump_count, prepare_chained),
+        ('AppendDoseToHistory', len(inputs.doses), lambda: AppendDoseToHistory(
+            append_dose_inputs.pop(),
+            inputs.doses
+        )),
+        ('append_reservoir_entry_to_history', reservoir_count, lambda: append_reservoir_entry_to_history(
+            reservoir_inputs.pop(),
+            100.0,
+            reservoir_datetime,
+            lookback_hours=inputs.hours
+        )),
+        ('ReservoirStore.append', reservoir_count, store_append),
+        ('convert_reservoir_history_to_temp_basal', reservoir_count, lambda: (
+            convert_reservoir_history_to_temp_basal(inputs.reservoir_history)
+        ))
+    ]
+
+
+def run(sizes, repeat):
+    """Runs the benchmarks at each history length
+
+    :return: Results keyed by benchmark name and then size name, each a dictionary of the
+    event count and best time in seconds
+    :rtype: dict
+    """
+    results = {}
+
+    for size_name, hours in SIZES:
+        if size_name not in sizes:
+            continue
+
+        for name, count, func in benchmarks(Inputs(hours), repeat):
+            seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+            results.setdefault(name, {})[size_name] = dict(events=count, seconds=seconds)
+
+            sys.stderr.write('{:<42}{:>6}{:>9d} events{:>10.4f}s\n'.format(name, size_name, count, seconds))
+
+    return results
+
+
+def compare(results, baseline, max_slowdown, min_seconds):
+    """Returns a description of each benchmark slower than its baseline by more than a factor
+
+    :rtype: list(str)
+    """
+    regressions = []
+
+    for name, sizes in sorted(results.items()):
+        for size_name, result in sorted(sizes.items()):
+            try:
+                baseline_seconds = baseline[name][size_name]['seconds']
+            except KeyError:
+                continue
+
+            if result['seconds'] < min_seconds or baseline_seconds <= 0:
+                continue
+
+            slowdown = result['seconds'] / baseline_seconds
+            if slowdown > max_slowdown:
+                regressions.append('{} at {}: {:.4f}s is {:.1f}x the baseline {:.4f}s'.format(
+                    name, size_name, result['seconds'], slowdown, baseline_seconds
+                ))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--sizes',
+        default=','.join(name for name, _ in SIZES),
+        help='The comma-separated history lengths to run'
+    )
+    parser.add_argument('--repeat', type=int, default=3, help='The number of runs to take the best of')
+    parser.add_argument('--output', help='A file in which to write the results')
+    parser.add_argument('--baseline', help='A results file to compare against')
+    parser.add_argument('--save-baseline', help='A file in which to save the results as a baseline')
+    parser.add_argument(
+        '--max-slowdown',
+        type=float,
+        default=1.5,
+        help='The largest allowed ratio of a timing to its baseline'
+    )
+    parser.add_argument(
+        '--min-seconds',
+        type=float,
+        default=0.01,
+        help='Timings below this are not compared to the baseline'
+    )
+    args = parser.parse_args(argv)
+
+    output = dict(
+        python=platform.python_version(),
+        machine=platform.machine(),
+        repeat=args.repeat,
+        results=run(args.sizes.split(','), args.repeat)
+    )
+    encoded = json.dumps(output, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(encoded + '\n')
+    else:
+        print(encoded)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fp:
+            fp.write(encoded + '\n')
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            sys.stderr.write('No baseline at {}; skipping comparison\n'.format(args.baseline))
+            return 0
+
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)['results']
+
+        regressions = compare(output['results'], baseline, args.max_slowdown, args.min_seconds)
+
+        for regression in regressions:
+            sys.stderr.write(regression + '\n')
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,17 +5,14 @@ mmhistorytools - tools for cleaning, condensing, and reformatting history data
 """
 from .version import __version__
 
+from abc import ABCMeta, abstractmethod
 import argparse
-from dateutil.parser import parse
-import json
 
 from openaps.uses.use import Use
 
-from historytools import TrimHistory, CleanHistory, ReconcileHistory
-from historytools import ResolveHistory, NormalizeRecords
-from historytools import AppendDoseToHistory
-from historytools import append_reservoir_entry_to_history
-from historytools import convert_reservoir_history_to_temp_basal
+
+# The history passes, and their dependencies like dateutil, are imported by each command when it
+# runs. openaps imports this module to list devices and render help, which shouldn't pay for them.
 
 
 # set_config is needed by openaps for all vendors.
@@ -50,7 +47,8 @@ def get_uses(device, config):
         prepare,
         append_dose,
         append_reservoir,
-        resolve_reservoir
+        resolve_reservoir,
+        aggregate
     ]
 
 
@@ -63,7 +61,9 @@ def _opt_date(timestamp):
     :rtype: datetime.datetime|NoneType
     """
     if timestamp:
-        return parse(timestamp)
+        from .timestamps import parse_timestamp
+
+        return parse_timestamp(timestamp)
 
 
 def _opt_json_file(filename):
@@ -75,6 +75,8 @@ def _opt_json_file(filename):
     :rtype: dict|list|NoneType
     """
     if filename:
+        import json
+
         return json.load(argparse.FileType('r')(filename))
 
 
@@ -86,6 +88,17 @@ def _opt_date_or_json_file(value):
 
 
 class BaseUse(Use):
+    __metaclass__ = ABCMeta
+
+    # Whether the command can process its input as it is read, using the `--stream` option
+    streaming = False
+
+    # The parameters which don't change the command output
+    uncached_params = ('profile', 'profile_output', 'stream', 'cache')
+
+    # The parameters which can be timestamp strings, rather than the names of files containing them
+    timestamp_params = ('start', 'end', 'zero_at')
+
     def configure_app(self, app, parser):
         """Define command arguments.
 
@@ -98,9 +111,41 @@ class BaseUse(Use):
             default='-',
             help='JSON-encoded history data'
         )
+        if self.streaming:
+            parser.add_argument(
+                '--stream',
+                action='store_true',
+                help='Decode and process the input one event at a time, instead of reading it all '
+                     'first. This reduces peak memory use for long histories.'
+            )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Write the time taken and events produced by each stage to stderr'
+        )
+        parser.add_argument(
+            '--profile-output',
+            default=None,
+            help='A file in which to write cProfile statistics. Implies --profile.'
+        )
+        parser.add_argument(
+            '--cache',
+            default=None,
+            help='A directory in which to cache the output, which is returned without running the '
+                 'command when it is next called with the same arguments and input files'
+        )
 
     def get_params(self, args):
-        return dict(infile=args.infile)
+        params = dict(infile=args.infile)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('profile', 'profile_output', 'stream', 'cache'):
+            value = args_dict.get(key)
+            if value:
+                params[key] = value
+
+        return params
 
     def get_program(self, params):
         """Parses params into history parser constructor arguments
@@ -110,12 +155,98 @@ class BaseUse(Use):
         :return:
         :rtype: tuple(list, dict)
         """
+        if params.get('stream'):
+            from .jsonstream import iter_json_file
+
+            return [iter_json_file(params['infile'])], dict()
+
+        import json
+
         return [json.load(argparse.FileType('r')(params['infile']))], dict()
 
+    def get_cache_key(self, params):
+        """Returns the key under which to cache the output
+
+        :param params: The command parameters
+        :type params: dict
+        :return: A digest of the command, its parameters and its input files, or None if the output
+        can't be cached
+        :rtype: str|NoneType
+        """
+        from .cache import cache_key
+
+        return cache_key(
+            self.__class__.__name__,
+            params,
+            ignored_params=self.uncached_params,
+            timestamp_params=self.timestamp_params
+        )
+
+    def main(self, args, app):
+        from .cache import OutputCache
+        from .profiling import Profiler
+
+        params = self.get_params(args)
+        cache = OutputCache.from_environment(params.get('cache'))
+
+        with Profiler.from_environment(
+            enabled=bool(params.get('profile')),
+            output_path=params.get('profile_output')
+        ) as profiler:
+            key = None
+
+            if cache is not None:
+                with profiler.stage('cache') as stage:
+                    key = self.get_cache_key(params)
+                    output = cache.get(key) if key is not None else None
+
+                if output is not None:
+                    stage.count = len(output)
+                    return output
+
+            with profiler.stage('load') as stage:
+                args, kwargs = self.get_program(params)
+
+                if len(args) > 0 and isinstance(args[0], list):
+                    stage.count = len(args[0])
+
+            output = self.run(params, args, kwargs, profiler)
+
+            if key is not None:
+                with profiler.stage('cache'):
+                    cache.set(key, output)
+
+            if profiler.enabled:
+                # Approximates the cost of serializing the report, which openaps does after returning
+                import json
+
+                with profiler.stage('output') as stage:
+                    json.dumps(output, default=str)
+                    stage.count = len(output)
+
+        return output
+
+    @abstractmethod
+    def run(self, params, args, kwargs, profiler):
+        """Runs the command on the program arguments
+
+        :param params: The command parameters
+        :type params: dict
+        :param args: The positional arguments returned by `get_program`
+        :type args: list
+        :param kwargs: The keyword arguments returned by `get_program`
+        :type kwargs: dict
+        :param profiler: The profiler in which to measure each stage
+        :type profiler: Profiler
+        :return: The command output
+        :rtype: list
+        """
+
 
 # noinspection PyPep8Naming
 class trim(BaseUse):
     """Trims a sequence of pump history to a specified time window"""
+    streaming = True
 
     def configure_app(self, app, parser):
         super(trim, self).configure_app(app, parser)
@@ -135,13 +266,20 @@ class trim(BaseUse):
             default=None,
             help='The length of the window to return, in hours'
         )
+        parser.add_argument(
+            '--sorted',
+            choices=('assume', 'validate'),
+            default=None,
+            help='Find the window edges by bisection, assuming the history is in reverse-chronological '
+                 'order, or checking it first and reading every event if it is not'
+        )
 
     def get_params(self, args):
         params = super(trim, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('start', 'end', 'duration'):
+        for key in ('start', 'end', 'duration', 'sorted'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -157,14 +295,25 @@ class trim(BaseUse):
             duration_hours=float(params['duration']) if 'duration' in params else None
         )
 
+        if params.get('sorted'):
+            kwargs.update(
+                sorted_history=True,
+                validate_sorted=params['sorted'] == 'validate'
+            )
+
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import TrimHistory, iter_trim
 
-        tool = TrimHistory(*args, **kwargs)
+        if params.get('stream'):
+            # Bisection needs the whole history
+            kwargs.pop('sorted_history', None)
+            kwargs.pop('validate_sorted', None)
 
-        return tool.trimmed_history
+            return profiler.call('trim', lambda: list(iter_trim(*args, **kwargs)))
+
+        return profiler.call('trim', lambda: TrimHistory(*args, **kwargs).trimmed_history)
 
 
 # noinspection PyPep8Naming
@@ -175,6 +324,8 @@ Tasks performed by this pass:
  - De-duplicates BolusWizard records
  - Creates PumpSuspend and PumpResume records to complete missing pairs
     """
+    streaming = True
+
     def configure_app(self, app, parser):
         super(clean, self).configure_app(app, parser)
 
@@ -219,12 +370,13 @@ Tasks performed by this pass:
 
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import CleanHistory, iter_clean
 
-        tool = CleanHistory(*args, **kwargs)
+        if params.get('stream'):
+            return profiler.call('clean', lambda: list(iter_clean(*args, **kwargs)))
 
-        return tool.clean_history
+        return profiler.call('clean', lambda: CleanHistory(*args, **kwargs).clean_history)
 
 
 # noinspection PyPep8Naming
@@ -235,12 +387,15 @@ Tasks performed by this pass:
  - Modifies temporary basal duration to account for cancelled and overlapping basals
  - Duplicates and modifies temporary basal records to account for delivery pauses when suspended
     """
-    def main(self, args, app):
-        args, _ = self.get_program(self.get_params(args))
+    streaming = True
 
-        tool = ReconcileHistory(*args)
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import ReconcileHistory, iter_reconcile
 
-        return tool.reconciled_history
+        if params.get('stream'):
+            return profiler.call('reconcile', lambda: list(iter_reconcile(*args)))
+
+        return profiler.call('reconcile', lambda: ReconcileHistory(*args).reconciled_history)
 
 
 # noinspection PyPep8Naming
@@ -264,12 +419,15 @@ The following history events are parsed:
 _
 Events that are not related to the record types or seem to have no effect are dropped.
 """
-    def main(self, args, app):
-        args, _ = self.get_program(self.get_params(args))
+    streaming = True
 
-        tool = ResolveHistory(*args)
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import ResolveHistory, iter_resolve
 
-        return tool.resolved_records
+        if params.get('stream'):
+            return profiler.call('resolve', lambda: list(iter_resolve(*args)))
+
+        return profiler.call('resolve', lambda: ResolveHistory(*args).resolved_records)
 
 
 # noinspection PyPep8Naming
@@ -283,6 +441,8 @@ _
 If `--zero-at` is provided, the values for the `start_at` and `end_at` keys are replaced with signed
 integers representing the number of minutes from `--zero-at`.
 """
+    streaming = True
+
     def configure_app(self, app, parser):
         super(normalize, self).configure_app(app, parser)
 
@@ -326,12 +486,17 @@ integers representing the number of minutes from `--zero-at`.
 
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import NormalizeRecords, iter_normalize
 
-        tool = NormalizeRecords(*args, **kwargs)
+        if params.get('stream'):
+            return profiler.call('normalize', lambda: list(iter_normalize(*args, **kwargs)))
 
-        return tool.normalized_records
+        return profiler.call('normalize', lambda: NormalizeRecords(
+            *args,
+            sweep_line=True,
+            **kwargs
+        ).normalized_records)
 
 
 # noinspection PyPep8Naming
@@ -378,12 +543,10 @@ If that key isn't present, or its value is false, the record is ignored.
 
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
-
-        tool = AppendDoseToHistory(*args, **kwargs)
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import AppendDoseToHistory
 
-        return tool.appended_history
+        return profiler.call('append_dose', lambda: AppendDoseToHistory(*args, **kwargs).appended_history)
 
 
 # noinspection PyPep8Naming
@@ -395,10 +558,18 @@ This command performs the following commands in sequence:
 _
 Please refer to the --help documentation of each command for more information.
 _
+With `--stream`, history is decoded as it is read. Each event then passes through clean and on to
+the later passes before the next is decoded.
+_
+With `--checkpoint`, the state of the passes is saved to a file, and the next call with the same
+basal profile processes only the history added since, splicing its records onto those already
+prepared. Records of events older than the input history are dropped.
+_
 Warning: This command will not return the same level of diagnostic logging as
 running all four commands separately. If there is reason to believe an issue
 has occurred, output from this command may not be sufficient for debugging.
 """
+    streaming = True
 
     def configure_app(self, app, parser):
         super(prepare, self).configure_app(app, parser)
@@ -425,13 +596,19 @@ has occurred, output from this command may not be sufficient for debugging.
             default=None,
             help='The length of the history window, in hours'
         )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='A file in which to save the state of the passes, so the next call processes only '
+                 'newer history'
+        )
 
     def get_params(self, args):
         params = super(prepare, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('basal_profile', 'start', 'end', 'duration'):
+        for key in ('basal_profile', 'start', 'end', 'duration', 'checkpoint'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -450,14 +627,55 @@ has occurred, output from this command may not be sufficient for debugging.
 
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+    def get_cache_key(self, params):
+        # The checkpoint is updated by each call
+        if params.get('checkpoint'):
+            return None
+
+        return super(prepare, self).get_cache_key(params)
+
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import CleanHistory, ReconcileHistory, ResolveHistory, NormalizeRecords
+        from .historytools import iter_clean, iter_reconcile, iter_resolve, iter_normalize
+
+        if params.get('checkpoint'):
+            from .checkpoint import PrepareCheckpoint
+
+            if params.get('stream'):
+                args[0] = profiler.call('load', list, args[0])
+
+            return profiler.call('prepare', lambda: PrepareCheckpoint(params['checkpoint']).prepare(
+                *args,
+                **kwargs
+            ))
+
         basal_schedule = kwargs.pop('basal_schedule', None)
 
-        clean_history = CleanHistory(*args, **kwargs).clean_history
-        reconciled_history = ReconcileHistory(clean_history).reconciled_history
-        resolved_records = ResolveHistory(reconciled_history).resolved_records
-        normalized_records = NormalizeRecords(resolved_records, **{'basal_schedule': basal_schedule}).normalized_records
+        if params.get('stream'):
+            return profiler.call('prepare', lambda: list(iter_normalize(
+                iter_resolve(
+                    iter_reconcile(iter_clean(*args, **kwargs)),
+                    compact_records=True
+                ),
+                basal_schedule=basal_schedule,
+                compact_records=True
+            )))
+
+        clean_history = profiler.call('clean', lambda: CleanHistory(*args, **kwargs).clean_history)
+        reconciled_history = profiler.call(
+            'reconcile',
+            lambda: ReconcileHistory(clean_history).reconciled_history
+        )
+        resolved_records = profiler.call(
+            'resolve',
+            lambda: ResolveHistory(reconciled_history, compact_records=True).resolved_records
+        )
+        normalized_records = profiler.call('normalize', lambda: NormalizeRecords(
+            resolved_records,
+            basal_schedule=basal_schedule,
+            compact_records=True,
+            sweep_line=True
+        ).normalized_records)
 
         return normalized_records
 
@@ -465,7 +683,11 @@ has occurred, output from this command may not be sufficient for debugging.
 # noinspection PyPep8Naming
 class append_reservoir(BaseUse):
     """Appends a reservoir value and clock time to a sequence of history
-    """
+
+If `--store` is provided, the history is kept in that file instead of being read from the input.
+Each call appends a single line to the file, which is periodically compacted to the entries within
+`--hours`.
+"""
 
     def configure_app(self, app, parser):
         super(append_reservoir, self).configure_app(app, parser)
@@ -487,12 +709,18 @@ class append_reservoir(BaseUse):
             help='The length of history to keep, in hours'
         )
 
+        parser.add_argument(
+            '--store',
+            default=None,
+            help='A file in which to persist the history between calls, replacing the input'
+        )
+
     def get_params(self, args):
         params = super(append_reservoir, self).get_params(args)
 
         args_dict = dict(**args.__dict__)
 
-        for key in ('reservoir', 'clock', 'hours'):
+        for key in ('reservoir', 'clock', 'hours', 'store'):
             value = args_dict.get(key)
             if value is not None:
                 params[key] = value
@@ -500,11 +728,16 @@ class append_reservoir(BaseUse):
         return params
 
     def get_program(self, params):
-        args, kwargs = super(append_reservoir, self).get_program(params)
+        from .timestamps import parse_timestamp
+
+        if params.get('store'):
+            args, kwargs = [], dict(store=params['store'])
+        else:
+            args, kwargs = super(append_reservoir, self).get_program(params)
 
         args += [
             float(_opt_json_file(params.get('reservoir'))),
-            parse(_opt_json_file(params.get('clock')))
+            parse_timestamp(_opt_json_file(params.get('clock')))
         ]
 
         if params.get('hours'):
@@ -514,10 +747,27 @@ class append_reservoir(BaseUse):
 
         return args, kwargs
 
-    def main(self, args, app):
-        args, kwargs = self.get_program(self.get_params(args))
+    def get_cache_key(self, params):
+        # The store is modified by each call
+        if params.get('store'):
+            return None
 
-        return append_reservoir_entry_to_history(*args, **kwargs)
+        return super(append_reservoir, self).get_cache_key(params)
+
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import append_reservoir_entry_to_history
+        from .reservoir import ReservoirStore
+
+        if 'store' in kwargs:
+            store = ReservoirStore(kwargs.pop('store'), **kwargs)
+
+            with profiler.stage('append_reservoir') as stage:
+                store.append(*args)
+                stage.count = len(store)
+
+            return store.history()
+
+        return profiler.call('append_reservoir', append_reservoir_entry_to_history, *args, **kwargs)
 
 
 # noinspection PyPep8Naming
@@ -525,7 +775,90 @@ class resolve_reservoir(BaseUse):
     """Converts a sequence of pump reservoir history to temporary basal records
     """
 
-    def main(self, args, app):
-        args, _ = self.get_program(self.get_params(args))
+    def configure_app(self, app, parser):
+        super(resolve_reservoir, self).configure_app(app, parser)
+
+        parser.add_argument(
+            '--store',
+            default=None,
+            help='A reservoir history file written by `append_reservoir --store`, replacing the input'
+        )
+
+    def get_params(self, args):
+        params = super(resolve_reservoir, self).get_params(args)
+
+        if 'store' in args and args.store:
+            params.update(store=args.store)
+
+        return params
+
+    def get_program(self, params):
+        if params.get('store'):
+            from .reservoir import ReservoirStore
+
+            return [ReservoirStore(params['store']).history()], dict()
+
+        return super(resolve_reservoir, self).get_program(params)
+
+    def run(self, params, args, kwargs, profiler):
+        from .historytools import convert_reservoir_history_to_temp_basal
+
+        return profiler.call('resolve_reservoir', convert_reservoir_history_to_temp_basal, *args)
+
+
+# noinspection PyPep8Naming
+class aggregate(BaseUse):
+    """Sums the insulin and carbohydrates of normalized records into fixed-width time buckets
+
+Boluses and Meal records are counted in the bucket of their start. Square boluses and TempBasal
+records are spread evenly over their duration; TempBasal records are only counted when normalized
+with `--basal-profile`. Buckets are listed in chronological order, each with `start_at`, `end_at`,
+`insulin` (U) and `carbs` (g) keys.
+
+This command requires numpy (`pip install openapscontrib.mmhistorytools[numpy]`).
+"""
+
+    def configure_app(self, app, parser):
+        super(aggregate, self).configure_app(app, parser)
+
+        parser.add_argument(
+            '--minutes',
+            type=float,
+            default=5.0,
+            help='The width of each bucket, in minutes'
+        )
+
+        parser.add_argument(
+            '--hours',
+            type=float,
+            default=None,
+            help='The length of time to aggregate, ending after the latest record. '
+                 'Defaults to the span of all records.'
+        )
+
+    def get_params(self, args):
+        params = super(aggregate, self).get_params(args)
+
+        args_dict = dict(**args.__dict__)
+
+        for key in ('minutes', 'hours'):
+            value = args_dict.get(key)
+            if value is not None:
+                params[key] = value
+
+        return params
+
+    def get_program(self, params):
+        args, kwargs = super(aggregate, self).get_program(params)
+
+        kwargs.update(bucket_minutes=float(params.get('minutes', 5.0)))
+
+        if params.get('hours') is not None:
+            kwargs.update(hours=float(params['hours']))
+
+        return args, kwargs
+
+    def run(self, params, args, kwargs, profiler):
+        from .tables import aggregate as aggregate_records
 
-        return convert_reservoir_history_to_temp_basal(*args)
+        return profiler.call('aggregate', aggregate_records, *args, **kwargs)
@@ -0,0 +1,413 @@
+"""
+Runs the history passes from an asyncio event loop without blocking it
+
+This module requires asyncio, or trollius on Python 2, which can be installed with the `asyncio`
+extra:
+
+    $ pip install openapscontrib.mmhistorytools[asyncio]
+
+Each method returns a Future, so it can be used from coroutines of either library:
+
+    pipeline = HistoryPipeline(loop, timeouts={'normalize': 5})
+
+    history = yield From(pipeline.read_history(reader))
+    records = yield From(pipeline.prepare(history, basal_schedule=basal_schedule))
+
+By default each pass runs on the loop's executor. With `cooperative=True` the passes run on the loop
+itself, returning control to it after every `events_per_step` events. This includes decoding the
+history read by `read_history`, which happens an event at a time.
+
+A pass which exceeds its timeout fails with StageTimeoutError, and cancelling a Future stops its
+passes. A pass already running on an executor can't be interrupted: a timeout or cancellation only
+abandons its Future, so the worker thread runs the pass to completion. Its result is discarded and
+no later pass is started.
+"""
+from functools import partial
+from io import StringIO
+from itertools import islice
+import json
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+if asyncio is not None:
+    # Named `async` before Python 3.4.4, which is a keyword from Python 3.7
+    _ensure_future = getattr(asyncio, 'ensure_future', None) or getattr(asyncio, 'async')
+
+from .historytools import CleanHistory, NormalizeRecords, ReconcileHistory, ResolveHistory
+from .historytools import iter_clean, iter_normalize, iter_resolve
+from .jsonstream import DEFAULT_CHUNK_SIZE, iter_json_array
+
+
+CLEAN = 'clean'
+RECONCILE = 'reconcile'
+RESOLVE = 'resolve'
+NORMALIZE = 'normalize'
+READ = 'read'
+
+
+def _require_asyncio():
+    if asyncio is None:
+        raise ImportError(
+            "asyncio is required for the asynchronous API. "
+            "Install trollius on Python 2, or the package's `asyncio` extra."
+        )
+
+
+class StageTimeoutError(Exception):
+    """A pass didn't finish within its timeout"""
+    def __init__(self, stage, timeout):
+        """
+        :param stage: The name of the pass
+        :type stage: str
+        :param timeout: The timeout, in seconds
+        :type timeout: float
+        """
+        super(StageTimeoutError, self).__init__('{} timed out after {}s'.format(stage, timeout))
+        self.stage = stage
+        self.timeout = timeout
+
+
+# Pass functions for the executor, which take positional arguments and can be pickled
+
+def _clean(history, start_datetime, end_datetime, duration_hours):
+    return CleanHistory(
+        history,
+        start_datetime=start_datetime,
+        end_datetime=end_datetime,
+        duration_hours=duration_hours
+    ).clean_history
+
+
+def _reconcile(clean_history):
+    return ReconcileHistory(clean_history).reconciled_history
+
+
+def _resolve(reconciled_history, compact_records):
+    return ResolveHistory(reconciled_history, compact_records=compact_records).resolved_records
+
+
+def _normalize(resolved_records, basal_schedule, zero_datetime, compact_records):
+    return NormalizeRecords(
+        resolved_records,
+        basal_schedule=basal_schedule,
+        zero_datetime=zero_datetime,
+        compact_records=compact_records
+    ).normalized_records
+
+
+def _iter_reconcile(clean_history):
+    """Yields the reconciled events in chronological order, one history event at a time"""
+    reconciler = ReconcileHistory([])
+
+    for event in reversed(clean_history):
+        for reconciled_event in reconciler._decode_history_event(event):
+            yield reconciled_event
+
+
+def _reversed_list(events):
+    events.reverse()
+
+    return events
+
+
+class HistoryPipeline(object):
+    """Runs the history passes as Futures of an event loop"""
+    def __init__(self, loop=None, executor=None, cooperative=False, timeouts=None, events_per_step=100):
+        """Initializes a new pipeline
+
+        :param loop: The event loop. Defaults to the current event loop.
+        :type loop: asyncio.AbstractEventLoop
+        :param executor: The executor on which to run the passes. Defaults to the loop's executor.
+        :type executor: concurrent.futures.Executor
+        :param cooperative: Whether to run the passes on the loop, a few events at a time
+        :type cooperative: bool
+        :param timeouts: The number of seconds each pass may run, by pass name
+        :type timeouts: dict(str, float)
+        :param events_per_step: The number of events a cooperative pass handles at a time
+        :type events_per_step: int
+        """
+        _require_asyncio()
+
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+        self.cooperative = cooperative
+        self.timeouts = timeouts or {}
+        self.events_per_step = events_per_step
+
+    def _create_future(self):
+        if hasattr(self.loop, 'create_future'):
+            return self.loop.create_future()
+
+        return asyncio.Future(loop=self.loop)
+
+    def _run_cooperatively(self, iterator, finish=list):
+        """Consumes an iterator on the loop, a step at a time
+
+        :param iterator: An iterator whose items are collected
+        :type iterator: iterator
+        :param finish: A function of the collected items which returns the result
+        :type finish: function
+        :rtype: asyncio.Future
+        """
+        future = self._create_future()
+        items = []
+
+        def step():
+            if future.done():
+                return
+
+            try:
+                count = len(items)
+                items.extend(islice(iterator, self.events_per_step))
+
+                if len(items) - count < self.events_per_step:
+                    future.set_result(finish(items))
+                    return
+            except Exception as e:
+                future.set_exception(e)
+                return
+
+            self.loop.call_soon(step)
+
+        self.loop.call_soon(step)
+
+        return future
+
+    def _with_timeout(self, stage, future):
+        """Fails a pass which doesn't finish within its timeout, and cancels it
+
+        :param stage: The name of the pass
+        :type stage: str
+        :param future: The pass
+        :type future: asyncio.Future
+        :rtype: asyncio.Future
+        """
+        timeout = self.timeouts.get(stage)
+
+        if timeout is None:
+            return future
+
+        result = self._create_future()
+
+        def expire():
+            if not result.done():
+                result.set_exception(StageTimeoutError(stage, timeout))
+                future.cancel()
+
+        handle = self.loop.call_later(timeout, expire)
+        future.add_done_callback(lambda _: handle.cancel())
+
+        return self._forward(future, result)
+
+    def _run_stage(self, stage, function, args, iterator=None, finish=list):
+        if self.cooperative:
+            future = self._run_cooperatively(iterator(*args), finish)
+        else:
+            future = self.loop.run_in_executor(self.executor, function, *args)
+
+        return self._with_timeout(stage, future)
+
+    def read_history(self, reader, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Reads and decodes JSON history from a stream
+
+        :param reader: The stream, e.g. from asyncio.open_connection
+        :type reader: asyncio.StreamReader
+        :param chunk_size: The number of bytes to read at a time, and when cooperative, the number of
+                           characters to decode at a time
+        :type chunk_size: int
+        :return: A Future of the decoded history
+        :rtype: asyncio.Future
+        """
+        result = self._create_future()
+        chunks = []
+        state = dict(current=None)
+
+        def read():
+            chunk = _ensure_future(reader.read(chunk_size), loop=self.loop)
+            state['current'] = chunk
+            chunk.add_done_callback(on_chunk)
+
+        def on_chunk(chunk):
+            if result.done():
+                return
+            elif chunk.cancelled():
+                result.cancel()
+            elif chunk.exception() is not None:
+                result.set_exception(chunk.exception())
+            elif chunk.result():
+                chunks.append(chunk.result())
+                read()
+            else:
+                data = b''.join(chunks).decode('utf-8')
+
+                if self.cooperative:
+                    decoded = self._run_cooperatively(
+                        iter_json_array(StringIO(data), chunk_size=chunk_size, use_ijson=False)
+                    )
+                else:
+                    decoded = self.loop.run_in_executor(self.executor, json.loads, data)
+
+                state['current'] = decoded
+                self._forward(self._with_timeout(READ, decoded), result)
+
+        def on_cancel(_):
+            if result.cancelled():
+                state['current'].cancel()
+
+        result.add_done_callback(on_cancel)
+        read()
+
+        return result
+
+    @staticmethod
+    def _forward(future, result):
+        """Completes a Future with the outcome of another, unless it's already done
+
+        :param future: The Future whose outcome to copy
+        :type future: asyncio.Future
+        :param result: The Future to complete. Cancelling it cancels `future`.
+        :type result: asyncio.Future
+        :return: `result`
+        :rtype: asyncio.Future
+        """
+        def on_done(_):
+            if result.done():
+                return
+            elif future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+
+        def on_cancel(_):
+            if result.cancelled():
+                future.cancel()
+
+        future.add_done_callback(on_done)
+        result.add_done_callback(on_cancel)
+
+        return result
+
+    def clean(self, trimmed_history, start_datetime=None, end_datetime=None, duration_hours=None):
+        """Runs the CleanHistory pass
+
+        :return: A Future of the clean history
+        :rtype: asyncio.Future
+        """
+        return self._run_stage(
+            CLEAN,
+            _clean,
+            (trimmed_history, start_datetime, end_datetime, duration_hours),
+            iter_clean
+        )
+
+    def reconcile(self, clean_history):
+        """Runs the ReconcileHistory pass
+
+        :return: A Future of the reconciled history
+        :rtype: asyncio.Future
+        """
+        return self._run_stage(RECONCILE, _reconcile, (clean_history,), _iter_reconcile, _reversed_list)
+
+    def resolve(self, reconciled_history, compact_records=False):
+        """Runs the ResolveHistory pass
+
+        :return: A Future of the resolved records
+        :rtype: asyncio.Future
+        """
+        return self._run_stage(RESOLVE, _resolve, (reconciled_history, compact_records), iter_resolve)
+
+    def normalize(self, resolved_records, basal_schedule=None, zero_datetime=None, compact_records=False):
+        """Runs the NormalizeRecords pass
+
+        :return: A Future of the normalized records
+        :rtype: asyncio.Future
+        """
+        return self._run_stage(
+            NORMALIZE,
+            _normalize,
+            (resolved_records, basal_schedule, zero_datetime, compact_records),
+            iter_normalize
+        )
+
+    def prepare(
+            self,
+            trimmed_history,
+            basal_schedule=None,
+            zero_datetime=None,
+            start_datetime=None,
+            end_datetime=None,
+            duration_hours=None
+    ):
+        """Runs the clean, reconcile, resolve and normalize passes in sequence
+
+        The arguments are the same as PrepareHistory, whose output this returns. Each pass has its
+        own timeout.
+
+        :return: A Future of the prepared records
+        :rtype: asyncio.Future
+        """
+        return self._run_stages([
+            partial(
+                self.clean,
+                start_datetime=start_datetime,
+                end_datetime=end_datetime,
+                duration_hours=duration_hours
+            ),
+            self.reconcile,
+            partial(self.resolve, compact_records=True),
+            partial(
+                self.normalize,
+                basal_schedule=basal_schedule,
+                zero_datetime=zero_datetime,
+                compact_records=True
+            )
+        ], trimmed_history)
+
+    def _run_stages(self, stages, value):
+        """Starts each pass with the result of the previous one
+
+        :param stages: Functions which start a pass and return its Future
+        :type stages: list(function)
+        :param value: The input to the first pass
+        :return: A Future of the last pass's result. Cancelling it cancels the running pass.
+        :rtype: asyncio.Future
+        """
+        result = self._create_future()
+        state = dict(current=None)
+
+        def run(index, value):
+            if index == len(stages):
+                result.set_result(value)
+                return
+
+            stage = stages[index](value)
+            state['current'] = stage
+
+            def on_done(_):
+                if result.done():
+                    return
+                elif stage.cancelled():
+                    result.cancel()
+                elif stage.exception() is not None:
+                    result.set_exception(stage.exception())
+                else:
+                    run(index + 1, stage.result())
+
+            stage.add_done_callback(on_done)
+
+        def on_cancel(_):
+            if result.cancelled() and state['current'] is not None:
+                state['current'].cancel()
+
+        result.add_done_callback(on_cancel)
+        run(0, value)
+
+        return result
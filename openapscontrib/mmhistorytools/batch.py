@@ -0,0 +1,270 @@
+"""
+Runs `prepare` and `resolve_reservoir` for many patients' histories on a process pool
+
+Usage:
+
+    $ python -m openapscontrib.mmhistorytools.batch manifest.json --output-dir prepared [--processes 4]
+
+The manifest is a JSON list with an entry for each patient. Relative paths are resolved against the
+manifest's directory:
+
+    [
+      {
+        "name": "patient-1",
+        "history": "patient-1/pump_history.json",
+        "basal_profile": "patient-1/basal.json",
+        "dose": "patient-1/enacted_dose.json",
+        "clock": "patient-1/clock.json",
+        "duration": 24,
+        "reservoir": "patient-1/reservoir_history.json"
+      }
+    ]
+
+An entry with a `history` file is prepared, after appending any `dose`, with the window ending at the
+`clock` time. An entry with a `reservoir` file is resolved to temp basals. Each output is written by
+its worker to `<output-dir>/<name>/prepared_history.json` or `resolved_reservoir.json` as soon as it
+is ready, in the format written by openaps.
+
+A line is written to stderr as each output completes, followed by a summary. The exit status is
+non-zero if any input failed.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from .service import serialize
+
+
+PREPARE = 'prepare'
+RESOLVE_RESERVOIR = 'resolve_reservoir'
+
+OUTPUT_FILENAMES = {
+    PREPARE: 'prepared_history.json',
+    RESOLVE_RESERVOIR: 'resolved_reservoir.json'
+}
+
+
+def _load_json(path):
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+
+def _prepare(entry):
+    from .historytools import AppendDoseToHistory, CleanHistory, NormalizeRecords
+    from .historytools import ReconcileHistory, ResolveHistory
+    from .timestamps import parse_timestamp
+
+    history = _load_json(entry['history'])
+
+    if entry.get('dose'):
+        history = AppendDoseToHistory(history, _load_json(entry['dose'])).appended_history
+
+    # The passes are chained as by the `prepare` command
+    clean_history = CleanHistory(
+        history,
+        end_datetime=parse_timestamp(_load_json(entry['clock'])) if entry.get('clock') else None,
+        duration_hours=float(entry['duration']) if entry.get('duration') else None
+    ).clean_history
+    resolved_records = ResolveHistory(
+        ReconcileHistory(clean_history).reconciled_history,
+        compact_records=True
+    ).resolved_records
+
+    return len(history), NormalizeRecords(
+        resolved_records,
+        basal_schedule=_load_json(entry['basal_profile']) if entry.get('basal_profile') else None,
+        compact_records=True,
+        sweep_line=True
+    ).normalized_records
+
+
+def _resolve_reservoir(entry):
+    from .historytools import convert_reservoir_history_to_temp_basal
+
+    history = _load_json(entry['reservoir'])
+
+    return len(history), convert_reservoir_history_to_temp_basal(history)
+
+
+COMMANDS = {
+    PREPARE: _prepare,
+    RESOLVE_RESERVOIR: _resolve_reservoir
+}
+
+
+def tasks(manifest, output_directory):
+    """Returns the commands to run for each manifest entry
+
+    :param manifest: The manifest entries, with paths already resolved
+    :type manifest: list(dict)
+    :param output_directory: The directory in which to write each patient's outputs
+    :type output_directory: basestring
+    :return: A list of task dictionaries, each naming an entry, a command and an output path
+    :rtype: list(dict)
+    """
+    results = []
+
+    for entry in manifest:
+        for command, input_key in ((PREPARE, 'history'), (RESOLVE_RESERVOIR, 'reservoir')):
+            if entry.get(input_key):
+                results.append(dict(
+                    entry=entry,
+                    command=command,
+                    output_path=os.path.join(output_directory, entry['name'], OUTPUT_FILENAMES[command])
+                ))
+
+    return results
+
+
+def run_task(task):
+    """Runs a command for one manifest entry and writes its output
+
+    Failures are reported in the result rather than raised, so one bad input doesn't stop the batch.
+
+    :param task: A task returned by `tasks`
+    :type task: dict
+    :return: The task result, with the number of input events, the seconds taken and any error
+    :rtype: dict
+    """
+    start = time.time()
+    result = dict(name=task['entry']['name'], command=task['command'], output_path=task['output_path'])
+
+    try:
+        events, output = COMMANDS[task['command']](task['entry'])
+
+        directory = os.path.dirname(task['output_path'])
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Created by another worker
+                if not os.path.isdir(directory):
+                    raise
+
+        with open(task['output_path'], 'w') as fp:
+            fp.write(serialize(output))
+
+        result.update(events=events, records=len(output), error=None)
+    except Exception as e:
+        result.update(
+            events=0,
+            records=0,
+            error='{}: {}'.format(e.__class__.__name__, e),
+            traceback=traceback.format_exc()
+        )
+
+    result['seconds'] = time.time() - start
+
+    return result
+
+
+def load_manifest(path):
+    """Reads a manifest, resolving its paths against the manifest's directory
+
+    :param path: The path to the manifest
+    :type path: basestring
+    :return: The manifest entries
+    :rtype: list(dict)
+
+    :raises ValueError: An entry has no name, or a name is repeated
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    manifest = _load_json(path)
+    names = set()
+
+    for entry in manifest:
+        if not entry.get('name'):
+            raise ValueError('Manifest entry has no name: {!r}'.format(entry))
+        elif entry['name'] in names:
+            raise ValueError('Manifest entry name is repeated: {}'.format(entry['name']))
+
+        names.add(entry['name'])
+
+        for key in ('history', 'basal_profile', 'dose', 'clock', 'reservoir'):
+            if entry.get(key):
+                entry[key] = os.path.join(directory, entry[key])
+
+    return manifest
+
+
+def run(manifest, output_directory, processes=None, stream=None):
+    """Runs every task for a manifest on a process pool
+
+    :param manifest: The manifest entries, with paths already resolved
+    :type manifest: list(dict)
+    :param output_directory: The directory in which to write each patient's outputs
+    :type output_directory: basestring
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :type processes: int|NoneType
+    :param stream: The file to which to write progress. Defaults to stderr.
+    :type stream: file
+    :return: The summary, including each task's result in order of completion
+    :rtype: dict
+    """
+    stream = stream or sys.stderr
+    start = time.time()
+    results = []
+
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        for result in pool.imap_unordered(run_task, tasks(manifest, output_directory)):
+            results.append(result)
+
+            if result['error'] is None:
+                stream.write('{name:<24}{command:<20}{events:>8} events{records:>8} records{seconds:>9.3f}s\n'.format(
+                    **result
+                ))
+            else:
+                stream.write('{name:<24}{command:<20}failed: {error}\n'.format(**result))
+    finally:
+        pool.close()
+        pool.join()
+
+    seconds = time.time() - start
+    events = sum(result['events'] for result in results)
+    failures = [result for result in results if result['error'] is not None]
+
+    summary = dict(
+        tasks=len(results),
+        failures=len(failures),
+        events=events,
+        seconds=seconds,
+        events_per_second=events / seconds if seconds > 0 else None,
+        results=results
+    )
+
+    stream.write('{} tasks, {} failed, {} events in {:.3f}s ({:.0f} events/s)\n'.format(
+        summary['tasks'],
+        summary['failures'],
+        events,
+        seconds,
+        summary['events_per_second'] or 0
+    ))
+
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('manifest', help='A JSON file listing the input files for each patient')
+    parser.add_argument('--output-dir', required=True, help='The directory in which to write outputs')
+    parser.add_argument('--processes', type=int, default=None, help='The number of worker processes')
+    parser.add_argument('--report', default=None, help='A file in which to write the summary as JSON')
+    args = parser.parse_args(argv)
+
+    summary = run(load_manifest(args.manifest), args.output_dir, processes=args.processes)
+
+    if args.report:
+        with open(args.report, 'w') as fp:
+            fp.write(json.dumps(summary, indent=2) + '\n')
+
+    return 1 if summary['failures'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+A bounded on-disk cache of command output, keyed by the command's parameters and input files
+"""
+import hashlib
+import json
+import os
+
+
+# Set to a directory to cache the output of every command
+CACHE_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_CACHE'
+
+# Set to the number of outputs to keep in the cache
+CACHE_ENTRIES_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_CACHE_ENTRIES'
+
+
+def _date_handler(obj):
+    # Serialized the same way as by openaps
+    return obj.isoformat() if hasattr(obj, 'isoformat') else obj
+
+
+def cache_key(command, params, ignored_params=(), timestamp_params=()):
+    """Returns a digest of a command and its parameters, including the contents of any files they name
+
+    :param command: The command name
+    :type command: basestring
+    :param params: The command parameters
+    :type params: dict
+    :param ignored_params: The parameters which don't change the output
+    :type ignored_params: tuple(str)
+    :param timestamp_params: The parameters which can be timestamps. These are hashed as the time
+    they describe when parsed, since a partial timestamp like "12:00" changes with the current date.
+    :type timestamp_params: tuple(str)
+    :return: A hex digest, or None if the input is read from stdin and can't be hashed
+    :rtype: str|NoneType
+    """
+    from .version import __version__
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([__version__, command]).encode('utf-8'))
+
+    for name, value in sorted(params.items()):
+        if name in ignored_params:
+            continue
+
+        if value == '-':
+            return None
+
+        if isinstance(value, basestring) and os.path.isfile(value):
+            digest.update(json.dumps([name, value]).encode('utf-8'))
+
+            with open(value, 'rb') as fp:
+                digest.update(fp.read())
+        else:
+            if name in timestamp_params and isinstance(value, basestring):
+                value = _resolve_timestamp(value)
+
+            digest.update(json.dumps([name, value]).encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def _resolve_timestamp(value):
+    from .timestamps import parse_timestamp
+
+    try:
+        return parse_timestamp(value).isoformat()
+    except (ValueError, OverflowError):
+        # The command will report the invalid value when it runs
+        return value
+
+
+class OutputCache(object):
+    """A directory of command outputs, each stored as a JSON file named by its key
+
+    Reading an entry marks it as recently used by updating its modification time, and the least
+    recently used entries are removed once there are more than `max_entries`.
+    """
+    def __init__(self, directory, max_entries=64):
+        """Initializes a cache, creating its directory if needed
+
+        :param directory: The directory in which to store outputs
+        :type directory: basestring
+        :param max_entries: The number of outputs to keep
+        :type max_entries: int
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @classmethod
+    def from_environment(cls, directory=None):
+        """Creates a cache in the directory given, or else by environment variables
+
+        :param directory: The cache directory from the command arguments
+        :type directory: basestring|NoneType
+        :return: A new cache, or None if caching wasn't requested
+        :rtype: OutputCache|NoneType
+        """
+        directory = directory or os.environ.get(CACHE_ENVIRONMENT_VARIABLE) or None
+
+        if directory is None:
+            return None
+
+        max_entries = os.environ.get(CACHE_ENTRIES_ENVIRONMENT_VARIABLE)
+
+        if max_entries:
+            return cls(directory, max_entries=int(max_entries))
+
+        return cls(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        """Returns the output stored for a key
+
+        :param key: The key returned by `cache_key`
+        :type key: str
+        :return: The decoded output, or None if it isn't cached
+        :rtype: list|dict|NoneType
+        """
+        path = self._path(key)
+
+        try:
+            with open(path, 'r') as fp:
+                output = json.load(fp)
+
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return output
+
+    def set(self, key, output):
+        """Stores the output for a key, evicting the least recently used entries
+
+        :param key: The key returned by `cache_key`
+        :type key: str
+        :param output: The command output. Datetimes are stored as ISO-8601 strings, as by openaps.
+        :type output: list|dict
+        """
+        path = self._path(key)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        with open(temporary_path, 'w') as fp:
+            fp.write(json.dumps(output, default=_date_handler))
+
+        os.rename(temporary_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries beyond `max_entries`"""
+        entries = []
+
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    # Removed by another process
+                    pass
+
+        entries.sort()
+
+        for _, path in entries[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
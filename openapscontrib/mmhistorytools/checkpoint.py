@@ -0,0 +1,268 @@
+"""
+Checkpoints of the `prepare` passes, so each loop cycle processes only the history added since the last
+"""
+from datetime import timedelta
+import hashlib
+import json
+import os
+
+from .historytools import CleanHistory, PrepareHistory
+from .timestamps import parse_timestamp
+
+
+def _event_datetime(event):
+    return parse_timestamp(event["timestamp"])
+
+
+def _event_type(event):
+    return event["_type"].lower()
+
+
+class PrepareCheckpoint(object):
+    """The state of the prepare passes at a boundary in pump history, persisted as a JSON file
+
+    Each call to `prepare` reads only the events at or after the boundary, continues the passes from
+    their saved state, and splices the new records onto the records already prepared. Records of
+    events older than the oldest event in the history are dropped, so the output follows the window
+    of history it is given.
+
+    The boundary is moved forward only as far as later history can no longer change the events
+    before it:
+    - Events are sometimes recorded a few minutes out of order, so the newest `reprocess_margin` of
+      history is processed again on the next call
+    - A PumpSuspend without a PumpResume is completed with a generated PumpResume, so the boundary
+      stays before it until its PumpResume is read
+    - Later BolusWizard events replace duplicates recorded up to `bolus_wizard_margin` earlier
+
+    History is processed in full when there is no checkpoint, when the basal schedule or zero time
+    has changed since it was saved, when the history no longer reaches back to the boundary, or when
+    it begins while the pump is suspended.
+    """
+    version = 1
+
+    reprocess_margin = timedelta(minutes=5)
+    bolus_wizard_margin = timedelta(minutes=1)
+
+    def __init__(self, path=None):
+        """Initializes a checkpoint, loading the state already saved to its file
+
+        :param path: The path of the file in which to persist the state, or None to keep it in memory
+        :type path: basestring|NoneType
+        """
+        self.path = path
+        self.state = None
+
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, 'r') as fp:
+                    self.state = json.load(fp)
+            except ValueError:
+                # A checkpoint which can't be read is replaced by a full run
+                self.state = None
+
+    @staticmethod
+    def key(basal_schedule, zero_datetime):
+        """Returns a digest of the arguments which change every prepared record
+
+        :param basal_schedule: A list of basal rates scheduled by time in chronological order
+        :type basal_schedule: list(dict)
+        :param zero_datetime: The timestamp by which to center the relative times
+        :type zero_datetime: datetime
+        :rtype: str
+        """
+        return hashlib.sha1(json.dumps(
+            [basal_schedule, zero_datetime.isoformat() if zero_datetime is not None else None],
+            sort_keys=True
+        ).encode('utf-8')).hexdigest()
+
+    def prepare(
+            self,
+            trimmed_history,
+            basal_schedule=None,
+            zero_datetime=None,
+            start_datetime=None,
+            end_datetime=None,
+            duration_hours=None
+    ):
+        """Prepares pump history for use in prediction and dosing, and saves the new checkpoint
+
+        The arguments are the same as PrepareHistory, whose output this returns.
+
+        :param trimmed_history: A list of pump history events, in reverse-chronological order
+        :type trimmed_history: list(dict)
+        :return: The prepared records, in reverse-chronological order
+        :rtype: list(dict)
+        """
+        key = self.key(basal_schedule, zero_datetime)
+        state = None
+        boundary = None
+        events = trimmed_history
+
+        if (
+            self.state is not None and
+            self.state.get("version") == self.version and
+            self.state.get("key") == key and
+            self.state.get("boundary") is not None
+        ):
+            boundary = parse_timestamp(self.state["boundary"])
+            events = self._events_since(trimmed_history, boundary)
+
+            if events is None:
+                boundary = None
+                events = trimmed_history
+            else:
+                state = self.state["passes"]
+
+        clean_history = CleanHistory(
+            events,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime,
+            duration_hours=duration_hours
+        ).clean_history
+
+        parser = PrepareHistory.from_state(state, basal_schedule=basal_schedule, zero_datetime=zero_datetime)
+
+        if state is not None and len(trimmed_history) > 0:
+            parser.drop_records_before(_event_datetime(trimmed_history[-1]))
+
+        # Continue the passes up to the new boundary, save their state, then finish the window
+        boundary = self._next_boundary(events, boundary)
+        split = len(clean_history)
+
+        if boundary is not None:
+            for index, event in enumerate(clean_history):
+                if _event_datetime(event) < boundary:
+                    split = index
+                    break
+
+        parser.add_clean_history(clean_history[split:])
+        passes = parser.get_state()
+        parser.add_clean_history(clean_history[:split])
+
+        self.state = dict(
+            version=self.version,
+            key=key,
+            boundary=boundary.isoformat() if boundary is not None else None,
+            passes=passes
+        )
+        self.save()
+
+        return parser.finish()
+
+    def _events_since(self, history, boundary):
+        """Returns the events at or after the boundary, or None if they can't continue the checkpoint
+
+        The history is read newest-first, stopping once it is older than the boundary by more than
+        the reprocessing margin.
+        """
+        if len(history) == 0 or _event_datetime(history[-1]) > boundary:
+            return None
+
+        events = []
+        stop_datetime = boundary - self.reprocess_margin
+
+        for event in history:
+            event_datetime = _event_datetime(event)
+
+            if event_datetime >= boundary:
+                events.append(event)
+            elif event_datetime < stop_datetime:
+                break
+
+        # CleanHistory generates a PumpSuspend for a PumpResume without one, which can't be matched
+        # if the PumpSuspend was before the boundary, or was already dropped from the history
+        if self._begins_suspended(events) or self._begins_suspended(history):
+            return None
+
+        return events
+
+    @staticmethod
+    def _begins_suspended(history):
+        for event in reversed(history):
+            event_type = _event_type(event)
+
+            if event_type == "pumpresume":
+                return True
+            elif event_type == "pumpsuspend":
+                return False
+
+        return False
+
+    def _next_boundary(self, events, boundary):
+        """Returns the latest time before which later history can't change the events
+
+        Events at or after the boundary must form a prefix of the reverse-chronological history,
+        with no PumpResume older than every PumpSuspend in that prefix.
+
+        :param events: The events being processed, in reverse-chronological order
+        :type events: list(dict)
+        :param boundary: The current boundary, returned if it can't be moved forward
+        :type boundary: datetime|NoneType
+        :rtype: datetime|NoneType
+        """
+        if len(events) == 0:
+            return boundary
+
+        datetimes = [_event_datetime(event) for event in events]
+        latest_datetime = max(datetimes)
+
+        # The newest events of each later suffix, and the newest BolusWizard event of each
+        suffix_latest = [None] * (len(events) + 1)
+        suffix_latest_boluswizard = [None] * (len(events) + 1)
+
+        for index in range(len(events) - 1, -1, -1):
+            event_datetime = datetimes[index]
+
+            suffix_latest[index] = max(event_datetime, suffix_latest[index + 1] or event_datetime)
+            suffix_latest_boluswizard[index] = suffix_latest_boluswizard[index + 1]
+
+            if _event_type(events[index]) == "boluswizard":
+                suffix_latest_boluswizard[index] = max(
+                    event_datetime,
+                    suffix_latest_boluswizard[index] or event_datetime
+                )
+
+        candidate = latest_datetime - self.reprocess_margin
+
+        # A PumpSuspend newer than any PumpResume is still open, and stays after the boundary
+        for index, event in enumerate(events):
+            event_type = _event_type(event)
+
+            if event_type == "pumpsuspend":
+                candidate = min(candidate, datetimes[index])
+                break
+            elif event_type == "pumpresume":
+                break
+
+        prefix_earliest = None
+        oldest_suspend_or_resume = None
+
+        for index, event in enumerate(events[:-1]):
+            event_type = _event_type(event)
+
+            if event_type in ("pumpsuspend", "pumpresume"):
+                oldest_suspend_or_resume = event_type
+
+            prefix_earliest = min(datetimes[index], prefix_earliest or datetimes[index])
+            boluswizard_datetime = suffix_latest_boluswizard[index + 1]
+
+            if (
+                prefix_earliest <= candidate and
+                prefix_earliest > suffix_latest[index + 1] and
+                oldest_suspend_or_resume != "pumpresume" and
+                (boluswizard_datetime is None or
+                    boluswizard_datetime < prefix_earliest - self.bolus_wizard_margin)
+            ):
+                return prefix_earliest
+
+        return boundary
+
+    def save(self):
+        """Writes the state to the file, replacing it at once"""
+        if self.path is not None:
+            temporary_path = self.path + '.tmp'
+
+            with open(temporary_path, 'w') as fp:
+                fp.write(json.dumps(self.state))
+
+            os.rename(temporary_path, self.path)
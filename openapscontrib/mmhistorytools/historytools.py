@@ -2,18 +2,180 @@ from collections import defaultdict
 from copy import copy
 from datetime import datetime
 from datetime import timedelta
-from datetime import time
-from dateutil import parser
+import json
 
-from .models import Bolus, Meal, TempBasal, Exercise, Unit
+from .models import Bolus, Meal, TempBasal, Exercise, Unit, CompactRecord
+from .schedules import BasalSchedule, get_basal_schedule
+from .timestamps import parse_timestamp
 
 
-class ParseHistory(object):
+def _history_window(start_datetime, end_datetime, duration_hours):
+    """Completes a history window boundary from the other boundary and a duration
+
+    :param start_datetime: The start of the window, if known
+    :type start_datetime: datetime|NoneType
+    :param end_datetime: The end of the window, if known
+    :type end_datetime: datetime|NoneType
+    :param duration_hours: The length of the window, in hours
+    :type duration_hours: float|NoneType
+    :return: The start and end of the window, either of which may still be unknown
+    :rtype: tuple(datetime|NoneType, datetime|NoneType)
+    """
+    if start_datetime is None and end_datetime is not None and duration_hours is not None:
+        start_datetime = end_datetime - timedelta(hours=duration_hours)
+    elif start_datetime is not None and end_datetime is None and duration_hours is not None:
+        end_datetime = start_datetime + timedelta(hours=duration_hours)
+
+    return start_datetime, end_datetime
+
+
+def _first_index_before(events, get_datetime, value, inclusive):
+    """Returns the index at which a reverse-chronological list of events passes a time
+
+    :param events: The events, ordered by `get_datetime` from newest to oldest
+    :type events: list(dict)
+    :param get_datetime: A function returning the datetime of an event
+    :type get_datetime: callable
+    :param value: The time to search for
+    :type value: datetime
+    :param inclusive: Whether an event at exactly `value` counts as earlier
+    :type inclusive: bool
+    :return: An index whose event is earlier than `value`, or `len(events)`, such that the event
+    before it, if any, is not
+    :rtype: int
+
+    :raises ValueError: A probed event has no parseable timestamp
+    """
+    lo, hi = 0, len(events)
+
+    while lo < hi:
+        mid = (lo + hi) // 2
+        event_datetime = get_datetime(events[mid])
+
+        if event_datetime < value or (inclusive and event_datetime == value):
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return lo
+
+
+def _is_reverse_chronological(events, get_datetime, tolerance):
+    """Returns whether no event is newer than an event before it by more than a tolerance
+
+    :raises ValueError: An event has no parseable timestamp
+    """
+    earliest_datetime = None
+
+    for event in events:
+        event_datetime = get_datetime(event)
+
+        if earliest_datetime is None or event_datetime < earliest_datetime:
+            earliest_datetime = event_datetime
+        elif event_datetime - earliest_datetime > tolerance:
+            return False
+
+    return True
+
+
+def _record_constructor(record_class, compact_records):
+    """Returns the constructor for either dict-based or compact records of a type
+
+    :param record_class: The record type
+    :type record_class: type
+    :param compact_records: Whether to construct compact records
+    :type compact_records: bool
+    :return: A callable accepting the record keyword arguments
+    :rtype: callable
+    """
+    return record_class.compact if compact_records else record_class
+
+
+def _record_datetime(value):
+    """Returns the datetime of a record timestamp, which may already be a datetime"""
+    if isinstance(value, datetime):
+        return value
+    else:
+        return parse_timestamp(value)
+
+
+class DecoderRegistry(object):
+    """Dispatches events to decoder methods by their type
+
+    Methods named `_decode_<type>` decode events whose type, lowercased, is `<type>`. They are
+    collected into a table the first time a class decodes an event, so dispatch is a single
+    dictionary lookup. Decoders for other types can be added to a class and its subclasses with
+    `register_decoder`.
+    """
+    # The event key containing the type
+    EVENT_TYPE_KEY = "_type"
+
+    @classmethod
+    def register_decoder(cls, event_type, decoder):
+        """Registers a function to decode events of a type, replacing any existing decoder
+
+        :param event_type: The event type, e.g. "JournalEntryPumpLowReservoir"
+        :type event_type: basestring
+        :param decoder: A function accepting the parser and the event, and returning the decoded
+        events in the same form as the parser's own decoders
+        :type decoder: callable
+        """
+        if '_registered_decoders' not in cls.__dict__:
+            cls._registered_decoders = {}
+
+        cls._registered_decoders[event_type.lower()] = decoder
+
+        def invalidate(klass):
+            if '_decoders_by_type' in klass.__dict__:
+                del klass._decoders_by_type
+
+            for subclass in klass.__subclasses__():
+                invalidate(subclass)
+
+        invalidate(cls)
+
+    @classmethod
+    def _build_decoders(cls):
+        decoders = {}
+
+        for klass in reversed(cls.__mro__):
+            for name, value in klass.__dict__.items():
+                if name.startswith('_decode_') and name != '_decode_history_event' and callable(value):
+                    decoders[name[len('_decode_'):]] = value
+
+            decoders.update(klass.__dict__.get('_registered_decoders', {}))
+
+        cls._decoders_by_type = decoders
+
+        return decoders
+
+    def _decoder(self, event):
+        """Returns the function decoding an event, or None if its type has no decoder"""
+        event_type = event[self.EVENT_TYPE_KEY]
+
+        try:
+            decoders = type(self).__dict__['_decoders_by_type']
+        except KeyError:
+            decoders = type(self)._build_decoders()
+
+        try:
+            return decoders[event_type]
+        except KeyError:
+            # Types are matched case-insensitively; remember the result for this spelling
+            decoder = decoders[event_type] = decoders.get(event_type.lower())
+
+            return decoder
+
+
+class ParseHistory(DecoderRegistry):
     DURATION_IN_MINUTES_KEY = "duration (min)"
 
+    # Whether resolved records are constructed as CompactRecord objects instead of dicts
+    compact_records = False
+
     @staticmethod
     def _event_datetime(event):
-        return parser.parse(event["timestamp"])
+        return parse_timestamp(event["timestamp"])
 
     def _resolve_tempbasal(self, event, duration):
         start_at = self._event_datetime(event)
@@ -23,7 +185,7 @@ class ParseHistory(object):
             amount = event["rate"]
             unit = Unit.percent_of_basal if event["temp"] == "percent" else Unit.units_per_hour
 
-            return TempBasal(
+            return _record_constructor(TempBasal, self.compact_records)(
                 start_at=start_at,
                 end_at=end_at,
                 amount=amount,
@@ -37,15 +199,43 @@ class ParseHistory(object):
 
 
 class TrimHistory(ParseHistory):
-    """Trims a list of historical entries to a specified time window"""
-    def __init__(self, history, start_datetime=None, end_datetime=None, duration_hours=None):
+    """Trims a list of historical entries to a specified time window
+
+    Every event is checked against the window unless `sorted_history` is set, in which case the window
+    edges are found by bisection and only the events between them are checked. Pump history is
+    written in reverse-chronological order, but events are occasionally logged slightly out of
+    place; bisection still finds the same events as long as no event is newer than an event before
+    it by more than `sorted_tolerance`. With `validate_sorted`, this is checked first and every
+    event is checked if it doesn't hold.
+    """
+    # The default for how much newer an event can be than an event before it in sorted history
+    sorted_tolerance = timedelta(hours=1)
+
+    def __init__(self, history, start_datetime=None, end_datetime=None, duration_hours=None,
+                 sorted_history=False, validate_sorted=False, sorted_tolerance=None):
+        """Initializes a new instance of the history parser
+
+        :param history: A list of pump history events in reverse-chronological order
+        :type history: list(dict)
+        :param start_datetime: The initial timestamp of the window to return
+        :type start_datetime: datetime
+        :param end_datetime: The final timestamp of the window to return
+        :type end_datetime: datetime
+        :param duration_hours: The length of the window to return, in hours
+        :type duration_hours: float
+        :param sorted_history: Whether to assume the history is sorted and bisect to the window edges
+        :type sorted_history: bool
+        :param validate_sorted: Whether to confirm the history is sorted before bisecting
+        :type validate_sorted: bool
+        :param sorted_tolerance: How far out of order sorted history can be
+        :type sorted_tolerance: timedelta
+        """
         super(TrimHistory, self).__init__()
 
         if len(history) > 0:
-            if start_datetime is None and end_datetime is not None and duration_hours is not None:
-                start_datetime = end_datetime - timedelta(hours=duration_hours)
-            elif start_datetime is not None and end_datetime is None and duration_hours is not None:
-                end_datetime = start_datetime + timedelta(hours=duration_hours)
+            start_datetime, end_datetime = _history_window(
+                start_datetime, end_datetime, duration_hours
+            )
 
             if start_datetime is None:
                 start_datetime = self._event_datetime(history[-1], 'start_at')
@@ -57,7 +247,13 @@ class TrimHistory(ParseHistory):
         self.start_datetime = start_datetime
         self.end_datetime = end_datetime
 
-        self.trimmed_history.extend(self._filter_events_in_range(history))
+        if sorted_tolerance is not None:
+            self.sorted_tolerance = sorted_tolerance
+
+        if sorted_history and len(history) > 0:
+            history = self._sorted_events_in_range(history, validate_sorted)
+
+        self.trimmed_history.extend(self._iter_events_in_range(history))
 
     @staticmethod
     def _event_datetime(event, *args):
@@ -65,13 +261,45 @@ class TrimHistory(ParseHistory):
             value = event.get(key)
             if value:
                 try:
-                    return parser.parse(value)
+                    return parse_timestamp(value)
                 except ValueError:
                     pass
 
         raise ValueError
 
-    def _filter_events_in_range(self, events):
+    def _sorted_events_in_range(self, events, validate_sorted):
+        """Returns the slice of a sorted history between the window edges, widened by the tolerance
+
+        If a timestamp needed for the bisection can't be parsed, or validation finds the history
+        out of order, the full history is returned instead.
+        """
+        tolerance = self.sorted_tolerance
+
+        def start_at(event):
+            return self._event_datetime(event, 'start_at')
+
+        def end_at(event):
+            return self._event_datetime(event, 'end_at')
+
+        try:
+            if validate_sorted and not (
+                _is_reverse_chronological(events, start_at, tolerance) and
+                _is_reverse_chronological(events, end_at, tolerance)
+            ):
+                return events
+
+            first_index = _first_index_before(
+                events, start_at, self.end_datetime + tolerance, inclusive=True
+            )
+            last_index = _first_index_before(
+                events, end_at, self.start_datetime - tolerance, inclusive=False
+            )
+        except ValueError:
+            return events
+
+        return events[first_index:last_index]
+
+    def _iter_events_in_range(self, events):
         start_datetime = self.start_datetime
         end_datetime = self.end_datetime
 
@@ -87,7 +315,9 @@ class TrimHistory(ParseHistory):
                         return True
             return False
 
-        return filter(timestamp_in_range, events)
+        for event in events:
+            if timestamp_in_range(event):
+                yield event
 
 
 class CleanHistory(ParseHistory):
@@ -110,10 +340,9 @@ class CleanHistory(ParseHistory):
         :type end_datetime: datetime
         """
         if len(trimmed_history) > 0:
-            if start_datetime is None and end_datetime is not None and duration_hours is not None:
-                start_datetime = end_datetime - timedelta(hours=duration_hours)
-            elif start_datetime is not None and end_datetime is None and duration_hours is not None:
-                end_datetime = start_datetime + timedelta(hours=duration_hours)
+            start_datetime, end_datetime = _history_window(
+                start_datetime, end_datetime, duration_hours
+            )
 
             if start_datetime is None:
                 start_datetime = self._event_datetime(trimmed_history[-1])
@@ -130,23 +359,43 @@ class CleanHistory(ParseHistory):
         self._last_resume_event = None
         self._last_temp_basal_duration_event = None
 
-        for event in trimmed_history:
-            self.add_history_event(event)
+        self.clean_history.extend(self._iter_clean_events(trimmed_history))
+
+    def add_history_event(self, event):
+        self.clean_history.extend(self._decode_history_event(event))
+
+    def _decode_history_event(self, event):
+        decoder = self._decoder(event)
+
+        if decoder is None:
+            return [event]
+
+        return decoder(self, event) or []
+
+    def _iter_clean_events(self, events):
+        """Yields the cleaned events as each history event is decoded
+
+        Window boundaries which weren't specified are taken from the first and last events.
+        """
+        event = None
+
+        for event in events:
+            if self.end_datetime is None:
+                self.end_datetime = self._event_datetime(event)
+
+            for decoded_event in self._decode_history_event(event):
+                yield decoded_event
 
         # The pump was suspended before the history window began
         if self._last_resume_event is not None:
-            self.add_history_event({
+            if self.start_datetime is None:
+                self.start_datetime = self._event_datetime(event)
+
+            for decoded_event in self._decode_history_event({
                 "_type": "PumpSuspend",
                 "timestamp": self.start_datetime.isoformat()
-            })
-
-    def add_history_event(self, event):
-        try:
-            decoded = getattr(self, "_decode_{}".format(event["_type"].lower()))(event)
-        except AttributeError:
-            decoded = [event]
-
-        self.clean_history.extend(decoded or [])
+            }):
+                yield decoded_event
 
     def _decode_boluswizard(self, event):
         event_datetime = self._event_datetime(event)
@@ -214,18 +463,24 @@ class ReconcileHistory(ParseHistory):
         self._last_temp_basal_event = None
         self._last_temp_basal_duration_event = None
 
+        # Events are decoded in chronological order, so collect them before reversing once
         for event in reversed(clean_history):
-            self.add_history_event(event)
+            self.reconciled_history.extend(self._decode_history_event(event))
 
-    def add_history_event(self, event):
-        try:
-            decoded = getattr(self, "_decode_{}".format(event["_type"].lower()))(event)
-        except AttributeError:
-            decoded = [event]
+        self.reconciled_history.reverse()
 
-        for decoded_event in decoded:
+    def add_history_event(self, event):
+        for decoded_event in self._decode_history_event(event):
             self.reconciled_history.insert(0, decoded_event)
 
+    def _decode_history_event(self, event):
+        decoder = self._decoder(event)
+
+        if decoder is None:
+            return [event]
+
+        return decoder(self, event)
+
     def _basal_event_datetimes(self, basal_event):
         basal_start_datetime = self._event_datetime(basal_event)
         basal_end_datetime = basal_start_datetime + timedelta(
@@ -275,6 +530,10 @@ class ReconcileHistory(ParseHistory):
                 events.append(new_basal_rate_event)
                 events.append(new_basal_duration_event)
 
+                # The restarted temp basal is the one which later events cancel or replace
+                self._last_temp_basal_event = new_basal_rate_event
+                self._last_temp_basal_duration_event = new_basal_duration_event
+
         return events
 
     def _decode_pumpsuspend(self, event):
@@ -317,7 +576,7 @@ class ResolveHistory(ParseHistory):
 
     Events that are not related to the record types or seem to have no effect are dropped.
     """
-    def __init__(self, reconciled_history):
+    def __init__(self, reconciled_history, compact_records=False):
         """Initializes a new instance of the history parser
 
         The input history is expected to have no open-ended suspend windows, which can be resolved
@@ -325,25 +584,60 @@ class ResolveHistory(ParseHistory):
 
         :param reconciled_history: A list of pump history events in reverse-chronological order
         :type reconciled_history: list(dict)
+        :param compact_records: Whether to resolve CompactRecord objects instead of dicts, to pass
+        to NormalizeRecords without serializing their timestamps
+        :type compact_records: bool
         """
         self.resolved_records = []
+        self.compact_records = compact_records
 
         # Temporary parsing state
         self._resume_datetime = None
         self._suspend_datetime = None
         self._temp_basal_duration = None
 
-        for event in reconciled_history:
-            self.add_history_event(event)
+        self.resolved_records.extend(self._iter_resolved_records(reconciled_history))
 
     def add_history_event(self, event):
-        try:
-            decoded = getattr(self, "_decode_{}".format(event["_type"].lower()))(event)
-        except AttributeError:
-            pass
-        else:
+        decoded = self._decode_history_event(event)
+
+        if decoded is not None:
+            self.resolved_records.append(decoded)
+
+    def to_table(self):
+        """Returns the resolved records as a columnar table. Requires numpy.
+
+        :rtype: .tables.RecordTable
+        """
+        from .tables import RecordTable
+
+        return RecordTable.from_records(self.resolved_records)
+
+    def to_interval_index(self, record_type=None):
+        """Returns the resolved records indexed by their time ranges, for overlap queries
+
+        Suspend windows are indexed as TempBasal records of 0% of the scheduled basal.
+
+        :param record_type: The record type name to index, e.g. "TempBasal". Defaults to all records.
+        :type record_type: str
+        :rtype: .intervals.IntervalIndex
+        """
+        from .intervals import IntervalIndex
+
+        return IntervalIndex.from_records(self.resolved_records, record_type=record_type)
+
+    def _iter_resolved_records(self, events):
+        for event in events:
+            decoded = self._decode_history_event(event)
+
             if decoded is not None:
-                self.resolved_records.append(decoded)
+                yield decoded
+
+    def _decode_history_event(self, event):
+        decoder = self._decoder(event)
+
+        if decoder is not None:
+            return decoder(self, event)
 
     def _decode_bolus(self, event):
         start_at = self._event_datetime(event)
@@ -363,7 +657,7 @@ class ResolveHistory(ParseHistory):
                     end_at = start_at + timedelta(minutes=duration)
                     programmed = delivered
 
-                return Bolus(
+                return _record_constructor(Bolus, self.compact_records)(
                     start_at=start_at,
                     end_at=end_at,
                     amount=rate,
@@ -372,7 +666,7 @@ class ResolveHistory(ParseHistory):
                 )
 
             else:
-                return Bolus(
+                return _record_constructor(Bolus, self.compact_records)(
                     start_at=start_at,
                     end_at=start_at,
                     amount=delivered,
@@ -388,7 +682,7 @@ class ResolveHistory(ParseHistory):
         start_at = self._event_datetime(event)
 
         if carb_input:
-            return Meal(
+            return _record_constructor(Meal, self.compact_records)(
                 start_at=start_at,
                 end_at=start_at,
                 amount=carb_input,
@@ -400,7 +694,7 @@ class ResolveHistory(ParseHistory):
         num_events = 1
         start_at = self._event_datetime(event)
 
-        return Exercise(
+        return _record_constructor(Exercise, self.compact_records)(
             start_at=start_at,
             end_at=start_at,
             amount=num_events,
@@ -421,7 +715,7 @@ class ResolveHistory(ParseHistory):
         self._suspend_datetime = start_at
 
         if end_at > start_at:
-            return TempBasal(
+            return _record_constructor(TempBasal, self.compact_records)(
                 start_at=self._event_datetime(event),
                 end_at=end_at,
                 amount=0,
@@ -438,7 +732,7 @@ class ResolveHistory(ParseHistory):
         self._temp_basal_duration = event[self.DURATION_IN_MINUTES_KEY]
 
 
-class NormalizeRecords(object):
+class NormalizeRecords(DecoderRegistry):
     """Adjusts the time and basal amounts of records relative to a basal schedule and a timestamp
 
     If a `basal_schedule` is provided, the TempBasal `amount` is replaced with a relative dose in
@@ -447,8 +741,21 @@ class NormalizeRecords(object):
 
     If a `zero_datetime` is provided, the values for the `start_at` and `end_at` keys are
     replaced with signed integers representing the number of minutes from zero.
+
+    With `sweep_line`, the scheduled basal rates for every TempBasal record are found in one sweep
+    over the basal schedule before any record is normalized, rather than by a search for each
+    record. The output is the same.
     """
-    def __init__(self, resolved_records, basal_schedule=None, zero_datetime=None):
+    EVENT_TYPE_KEY = "type"
+
+    def __init__(
+            self,
+            resolved_records,
+            basal_schedule=None,
+            zero_datetime=None,
+            compact_records=False,
+            sweep_line=False
+    ):
         """Initializes a new instance of the record parser
 
         The record input is expected to be in the format returned by the ResolveHistory class.
@@ -457,33 +764,163 @@ class NormalizeRecords(object):
         made.
 
         :param resolved_records: A list of pump records in reverse-chronological order
-        :type resolved_records: list(.models.BaseRecord)
+        :type resolved_records: list(.models.BaseRecord|.models.CompactRecord)
         :param basal_schedule: A list of basal rates scheduled by time in chronological order
         :type basal_schedule: list(dict)
         :param zero_datetime: The timestamp by which to center the relative times
         :type zero_datetime: datetime
+        :param compact_records: Whether to split TempBasal records into CompactRecord objects,
+        which are serialized to dicts only once normalized
+        :type compact_records: bool
+        :param sweep_line: Whether to find the basal rates for all TempBasal records in one sweep
+        :type sweep_line: bool
         """
         self.normalized_records = []
+        self.compact_records = compact_records
+
+        if basal_schedule is not None and not isinstance(basal_schedule, BasalSchedule):
+            basal_schedule = get_basal_schedule(basal_schedule)
 
         self.basal_schedule = basal_schedule
+        self.zero_datetime = zero_datetime
+
+        # Basal rates found by the sweep, by the id of their TempBasal record
+        self._basal_rates_by_record = {}
 
-        for event in resolved_records:
-            self.add_history_event(event)
+        if sweep_line and basal_schedule is not None:
+            resolved_records = list(resolved_records)
+            self._sweep_basal_rates(resolved_records)
 
-        if zero_datetime is not None:
-            for event in self.normalized_records:
-                for key in [key for key in event.iterkeys() if key.endswith("_at")]:
-                    event[key] = int(round((
-                        parser.parse(event[key]) - zero_datetime
-                    ).total_seconds() / 60))
+        self.normalized_records.extend(self._iter_normalized_records(resolved_records))
 
     def add_history_event(self, event):
-        try:
-            decoded = getattr(self, "_decode_{}".format(event["type"].lower()))(event)
-        except AttributeError:
-            decoded = [event]
+        self.normalized_records.extend(self._decode_history_event(event))
+
+    def to_table(self):
+        """Returns the normalized records as a columnar table. Requires numpy.
+
+        If a `zero_datetime` was provided, the table times are seconds relative to it.
+
+        :rtype: .tables.RecordTable
+        """
+        from .tables import RecordTable
+
+        return RecordTable.from_records(self.normalized_records)
+
+    def to_interval_index(self, record_type=None):
+        """Returns the normalized records indexed by their time ranges, for overlap queries
 
-        self.normalized_records.extend(decoded or [])
+        If a `zero_datetime` was provided, the index times are minutes relative to it.
+
+        :param record_type: The record type name to index, e.g. "TempBasal". Defaults to all records.
+        :type record_type: str
+        :rtype: .intervals.IntervalIndex
+        """
+        from .intervals import IntervalIndex
+
+        return IntervalIndex.from_records(self.normalized_records, record_type=record_type)
+
+    def _iter_normalized_records(self, records):
+        for record in records:
+            for normalized_record in self._normalize_record(record):
+                yield normalized_record
+
+    def _normalize_record(self, record):
+        """Returns the normalized records for a single resolved record
+
+        :param record: A resolved record
+        :type record: dict
+        :return: A list of normalized records
+        :rtype: list(dict)
+        """
+        records = self._decode_history_event(record)
+
+        for index, normalized_record in enumerate(records):
+            if isinstance(normalized_record, CompactRecord):
+                records[index] = normalized_record.to_dict(self.zero_datetime)
+            elif self.zero_datetime is not None:
+                self._center_event_datetimes(normalized_record)
+
+        return records
+
+    def _decode_history_event(self, event):
+        decoder = self._decoder(event)
+
+        if decoder is None:
+            return [event]
+
+        return decoder(self, event) or []
+
+    def _center_event_datetimes(self, event):
+        """Replaces the record timestamps with the signed number of minutes from `zero_datetime`
+
+        :param event: The normalized record to modify
+        :type event: dict
+        """
+        for key in [key for key in event.iterkeys() if key.endswith("_at")]:
+            event[key] = int(round((
+                parse_timestamp(event[key]) - self.zero_datetime
+            ).total_seconds() / 60))
+
+    def net_basal_timeline(self):
+        """Returns the net basal rate over the normalized TempBasal records, as a step function
+
+        Each step is a dictionary with `start_at`, `end_at` and `amount` keys, in chronological
+        order, from the start of the earliest TempBasal record to the end of the latest. The amount
+        is the normalized TempBasal amount, or 0 where the scheduled basal was delivered. Where
+        TempBasal records overlap, the later record replaces the earlier one from its start, as a
+        new temp basal does on the pump.
+
+        :return: The steps, in chronological order
+        :rtype: list(dict)
+
+        :raises AssertionError: No basal schedule was provided, so the amounts aren't relative
+        """
+        assert self.basal_schedule is not None, "A basal schedule is required for net basal rates"
+
+        # Records starting together stay in chronological order, so the later one is kept
+        temp_basals = sorted(
+            (record for record in reversed(self.normalized_records) if record["type"] == "TempBasal"),
+            key=lambda record: record["start_at"]
+        )
+        steps = []
+
+        for index, record in enumerate(temp_basals):
+            end_at = record["end_at"]
+
+            if index + 1 < len(temp_basals):
+                end_at = min(end_at, temp_basals[index + 1]["start_at"])
+
+            if end_at <= record["start_at"]:
+                continue
+
+            if len(steps) > 0 and steps[-1]["end_at"] < record["start_at"]:
+                steps.append(dict(start_at=steps[-1]["end_at"], end_at=record["start_at"], amount=0))
+
+            steps.append(dict(start_at=record["start_at"], end_at=end_at, amount=record["amount"]))
+
+        return steps
+
+    def _sweep_basal_rates(self, records):
+        """Finds the basal rates for every TempBasal record to be split, in one sweep
+
+        :param records: The resolved records, which must stay in memory until they're normalized
+        :type records: list(.models.BaseRecord|.models.CompactRecord)
+        """
+        temp_basals = []
+        ranges = []
+
+        for record in records:
+            if record[self.EVENT_TYPE_KEY] == "TempBasal":
+                start_datetime = _record_datetime(record["start_at"])
+                end_datetime = _record_datetime(record["end_at"])
+
+                if end_datetime > start_datetime:
+                    temp_basals.append(record)
+                    ranges.append((start_datetime, end_datetime))
+
+        for record, basal_rates in zip(temp_basals, self.basal_schedule.rates_in_ranges(ranges)):
+            self._basal_rates_by_record[id(record)] = basal_rates
 
     def _basal_rates_in_range(self, start_datetime, end_datetime):
         """Returns a list of the current basal rates effective between the specified times
@@ -497,30 +934,7 @@ class NormalizeRecords(object):
 
         :raises AssertionError: The argument values are invalid
         """
-        assert (start_datetime <= end_datetime)
-
-        max_datetime = datetime.combine(start_datetime.date() + timedelta(days=1), time.min)
-
-        if end_datetime > max_datetime:
-            return self._basal_rates_in_range(start_datetime, max_datetime) + self._basal_rates_in_range(max_datetime, end_datetime)
-
-        start_date = start_datetime.date()
-
-        start_index = 0
-        end_index = len(self.basal_schedule)
-
-        for index, basal_rate in enumerate(self.basal_schedule):
-            basal_start = datetime.combine(start_date, parser.parse(basal_rate["start"]).time())
-            if start_datetime >= basal_start:
-                start_index = index
-            if end_datetime < basal_start:
-                end_index = index
-                break
-
-        return map(lambda x: {
-            "start": datetime.combine(start_datetime.date(), parser.parse(x["start"]).time()),
-            "rate": x["rate"]
-        }, self.basal_schedule[start_index:end_index])
+        return self.basal_schedule.rates_in_range(start_datetime, end_datetime)
 
     def _basal_adjustments_in_range(
             self,
@@ -528,7 +942,8 @@ class NormalizeRecords(object):
             end_datetime,
             percent=None,
             absolute=None,
-            description=""
+            description="",
+            basal_rates=None
     ):
         """Returns a list of TempBasal objects representing the specified adjustment to basal rate
 
@@ -542,6 +957,8 @@ class NormalizeRecords(object):
         :type absolute: float
         :param description: A description to attach to each new event
         :type description: basestring
+        :param basal_rates: The basal rates effective between the times, if already found
+        :type basal_rates: list(dict)
 
         :return: A list of TempBasal objects
         :rtype: list(TempBasal)
@@ -553,7 +970,9 @@ class NormalizeRecords(object):
         assert (percent is not None or absolute is not None)
 
         temp_basal_events = []
-        basal_rates = self._basal_rates_in_range(start_datetime, end_datetime)
+
+        if basal_rates is None:
+            basal_rates = self._basal_rates_in_range(start_datetime, end_datetime)
 
         for index, basal_rate in enumerate(basal_rates):
             # Find the delta of the new rate
@@ -574,7 +993,7 @@ class NormalizeRecords(object):
                 t1 = basal_rates[index + 1]["start"]
 
             if t1 - t0 > timedelta(minutes=0):
-                temp_basal_events.insert(0, TempBasal(
+                temp_basal_events.insert(0, _record_constructor(TempBasal, self.compact_records)(
                     start_at=t0,
                     end_at=t1,
                     amount=amount,
@@ -586,8 +1005,8 @@ class NormalizeRecords(object):
 
     def _decode_tempbasal(self, event):
         if self.basal_schedule is not None:
-            start_datetime = parser.parse(event["start_at"])
-            end_datetime = parser.parse(event["end_at"])
+            start_datetime = _record_datetime(event["start_at"])
+            end_datetime = _record_datetime(event["end_at"])
 
             if end_datetime - start_datetime > timedelta(minutes=0):
                 adjustment = "percent" if event["unit"] == Unit.percent_of_basal else "absolute"
@@ -596,18 +1015,329 @@ class NormalizeRecords(object):
                     start_datetime,
                     end_datetime,
                     description=event.get("description"),
+                    basal_rates=self._basal_rates_by_record.pop(id(event), None),
                     **{adjustment: event["amount"]}
                 )
 
                 return events
 
 
+class PrepareHistory(ParseHistory):
+    """Prepares Medtronic pump history for use in prediction and dosing, one event at a time
+
+    The output is identical to chaining the CleanHistory, ReconcileHistory, ResolveHistory and
+    NormalizeRecords classes. Its parsing state can be saved and continued with later history, as
+    by PrepareCheckpoint; a single call is no faster than chaining the passes.
+
+    Reconciliation must walk history in chronological order while the other passes walk it in
+    reverse, so after cleaning, the remaining three passes run together over one chronological
+    traversal. Each record is resolved and normalized as soon as no later event can change it:
+    - TempBasal events wait for their duration to stop being trimmed by later events
+    - Square Bolus events wait for the next PumpSuspend event, which could have interrupted them
+    - PumpSuspend events wait for their PumpResume event
+    """
+    def __init__(
+            self,
+            trimmed_history,
+            basal_schedule=None,
+            zero_datetime=None,
+            start_datetime=None,
+            end_datetime=None,
+            duration_hours=None
+    ):
+        """Initializes a new instance of the history parser
+
+        :param trimmed_history: A list of pump history events, in reverse-chronological order
+        :type trimmed_history: list(dict)
+        :param basal_schedule: A list of basal rates scheduled by time in chronological order
+        :type basal_schedule: list(dict)
+        :param zero_datetime: The timestamp by which to center the relative times
+        :type zero_datetime: datetime
+        :param start_datetime: The start time of history events. If not provided, the oldest
+        record's timestamp is used
+        :type start_datetime: datetime
+        :param end_datetime: The end time of history events. If not provided, the latest record's
+        timestamp is used
+        :type end_datetime: datetime
+        :param duration_hours: The length of the history window, in hours
+        :type duration_hours: float
+        """
+        clean_history = CleanHistory(
+            trimmed_history,
+            start_datetime=start_datetime,
+            end_datetime=end_datetime,
+            duration_hours=duration_hours
+        ).clean_history
+
+        self._set_up(basal_schedule, zero_datetime)
+        self.add_clean_history(clean_history)
+
+        self.prepared_records = self.finish()
+
+    def _set_up(self, basal_schedule, zero_datetime):
+        self._reconciler = ReconcileHistory([])
+        self._resolver = ResolveHistory([], compact_records=True)
+        self._normalizer = NormalizeRecords(
+            [],
+            basal_schedule=basal_schedule,
+            zero_datetime=zero_datetime,
+            compact_records=True
+        )
+
+        # Normalized records for each reconciled event, in chronological order
+        self._record_slots = []
+        self._slot_timestamps = []
+
+        # Temporary parsing state
+        self._pending_suspends = []
+        self._pending_square_boluses = []
+        self._pending_temp_basals = []
+        self._temp_basals_by_duration_event = []
+
+    @classmethod
+    def from_state(cls, state, basal_schedule=None, zero_datetime=None):
+        """Creates a parser which continues from the state of an earlier one
+
+        :param state: The state returned by `get_state`, or None to start without any history
+        :type state: dict|NoneType
+        :param basal_schedule: A list of basal rates scheduled by time in chronological order
+        :type basal_schedule: list(dict)
+        :param zero_datetime: The timestamp by which to center the relative times
+        :type zero_datetime: datetime
+        :return: A new parser. Further history is added with `add_clean_history`.
+        :rtype: PrepareHistory
+        """
+        parser = cls.__new__(cls)
+        parser._set_up(basal_schedule, zero_datetime)
+
+        if state is not None:
+            parser._record_slots = state["record_slots"]
+            parser._slot_timestamps = state["slot_timestamps"]
+            parser._pending_suspends = state["pending_suspends"]
+            parser._pending_square_boluses = state["pending_square_boluses"]
+            parser._pending_temp_basals = state["pending_temp_basals"]
+            parser._temp_basals_by_duration_event = state["temp_basals_by_duration_event"]
+
+            reconciler = parser._reconciler
+            reconciler._last_suspend_event = state["last_suspend_event"]
+            reconciler._last_temp_basal_event = state["last_temp_basal_event"]
+            reconciler._last_temp_basal_duration_event = state["last_temp_basal_duration_event"]
+
+            # Serializing the state copied the duration event which later events can still trim
+            for duration_event, _ in parser._temp_basals_by_duration_event:
+                if duration_event == reconciler._last_temp_basal_duration_event:
+                    reconciler._last_temp_basal_duration_event = duration_event
+
+        return parser
+
+    def get_state(self):
+        """Returns a copy of the parsing state, from which `from_state` can continue
+
+        :return: The state, which can be serialized as JSON
+        :rtype: dict
+        """
+        reconciler = self._reconciler
+
+        # Copied by encoding, which is much faster than deepcopy for plain JSON values
+        return json.loads(json.dumps(dict(
+            record_slots=self._record_slots,
+            slot_timestamps=self._slot_timestamps,
+            pending_suspends=self._pending_suspends,
+            pending_square_boluses=self._pending_square_boluses,
+            pending_temp_basals=self._pending_temp_basals,
+            temp_basals_by_duration_event=self._temp_basals_by_duration_event,
+            last_suspend_event=reconciler._last_suspend_event,
+            last_temp_basal_event=reconciler._last_temp_basal_event,
+            last_temp_basal_duration_event=reconciler._last_temp_basal_duration_event
+        )))
+
+    def add_clean_history(self, clean_history):
+        """Reconciles, resolves and normalizes cleaned history later than any already added
+
+        :param clean_history: A list of pump history events from CleanHistory, in
+        reverse-chronological order
+        :type clean_history: list(dict)
+        """
+        for event in reversed(clean_history):
+            last_duration_event = self._reconciler._last_temp_basal_duration_event
+
+            for reconciled_event in self._reconciler._decode_history_event(event):
+                self.add_history_event(reconciled_event)
+
+                if reconciled_event is not event:
+                    # A temp basal restarted after a PumpResume lasts only as long as the original
+                    self._slot_timestamps[-1] = last_duration_event["timestamp"]
+
+            self._resolve_trimmed_temp_basals()
+
+    def drop_records_before(self, start_datetime):
+        """Discards the records and parsing state of the events before a time
+
+        This continues as if the history had begun at that time, except that a PumpSuspend event
+        before it isn't replaced by one at the start of the history.
+
+        :param start_datetime: The time of the earliest event to keep
+        :type start_datetime: datetime
+        """
+        reconciler = self._reconciler
+
+        def is_before_start(event):
+            return event is not None and self._event_datetime(event) < start_datetime
+
+        # Pump timestamps are ISO-8601 strings in a single format, which sort chronologically
+        start_at = start_datetime.isoformat()
+        dropped = set(
+            slot for slot, timestamp in enumerate(self._slot_timestamps) if timestamp < start_at
+        )
+
+        if dropped:
+            # The slots are removed up to the first kept one, and emptied after it
+            count = 0
+
+            while count in dropped:
+                count += 1
+
+            for slot in dropped:
+                if slot >= count:
+                    self._record_slots[slot] = None
+
+            del self._record_slots[:count]
+            del self._slot_timestamps[:count]
+
+            def rebase(pending):
+                return [(slot - count, event) for slot, event in pending if slot not in dropped]
+
+            self._pending_suspends = rebase(self._pending_suspends)
+            self._pending_square_boluses = rebase(self._pending_square_boluses)
+            self._pending_temp_basals = rebase(self._pending_temp_basals)
+            temp_basals_by_duration_event = []
+
+            for duration_event, temp_basals in self._temp_basals_by_duration_event:
+                kept_temp_basals = rebase(temp_basals)
+
+                if kept_temp_basals:
+                    temp_basals_by_duration_event.append((duration_event, kept_temp_basals))
+                elif duration_event is reconciler._last_temp_basal_duration_event:
+                    # It can no longer be trimmed or restarted by later events
+                    reconciler._last_temp_basal_event = None
+                    reconciler._last_temp_basal_duration_event = None
+
+            self._temp_basals_by_duration_event = temp_basals_by_duration_event
+
+        if is_before_start(reconciler._last_suspend_event):
+            reconciler._last_suspend_event = None
+
+        if is_before_start(reconciler._last_temp_basal_duration_event):
+            reconciler._last_temp_basal_event = None
+            reconciler._last_temp_basal_duration_event = None
+
+    def finish(self):
+        """Resolves the events still waiting on later history, and returns all prepared records
+
+        :return: The prepared records, in reverse-chronological order
+        :rtype: list(dict)
+        """
+        self._resolve_pending_events()
+
+        prepared_records = []
+
+        for records in reversed(self._record_slots):
+            if records:
+                prepared_records.extend(records)
+
+        return prepared_records
+
+    def add_history_event(self, event):
+        """Resolves a single reconciled event, deferring it if later events can still change it
+
+        :param event: A reconciled pump history event, in chronological order
+        :type event: dict
+        """
+        slot = len(self._record_slots)
+        self._record_slots.append(None)
+        self._slot_timestamps.append(event["timestamp"])
+
+        event_type = event["_type"]
+
+        if event_type == "TempBasal":
+            self._pending_temp_basals.append((slot, event))
+        elif event_type == "TempBasalDuration":
+            # A temp basal is resolved with the duration of the nearest later duration event
+            if self._pending_temp_basals:
+                self._temp_basals_by_duration_event.append((event, self._pending_temp_basals))
+                self._pending_temp_basals = []
+        elif event_type == "PumpSuspend":
+            assert len(self._pending_suspends) == 0, "Unbalanced Suspend/Resume events found"
+
+            suspend_datetime = self._event_datetime(event)
+
+            for square_slot, square_event in self._pending_square_boluses:
+                self._resolver._suspend_datetime = suspend_datetime
+                self._add_resolved_record(square_slot, self._resolver._decode_bolus(square_event))
+
+            self._pending_square_boluses = []
+            self._pending_suspends.append((slot, event))
+        elif event_type == "PumpResume":
+            if self._pending_suspends:
+                suspend_slot, suspend_event = self._pending_suspends.pop()
+
+                self._resolver._resume_datetime = self._event_datetime(event)
+                self._add_resolved_record(
+                    suspend_slot,
+                    self._resolver._decode_pumpsuspend(suspend_event)
+                )
+        elif event_type == "Bolus" and event["type"] == "square":
+            self._pending_square_boluses.append((slot, event))
+        else:
+            self._add_resolved_record(slot, self._resolver._decode_history_event(event))
+
+    def _add_resolved_record(self, slot, record):
+        if record is not None:
+            self._record_slots[slot] = self._normalizer._normalize_record(record)
+
+    def _resolve_temp_basals(self, duration_event, temp_basals):
+        for slot, event in temp_basals:
+            self._resolver._temp_basal_duration = duration_event[self.DURATION_IN_MINUTES_KEY]
+            self._add_resolved_record(slot, self._resolver._decode_tempbasal(event))
+
+    def _resolve_trimmed_temp_basals(self):
+        """Resolves the temp basals whose duration can no longer be trimmed by later events"""
+        last_duration_event = self._reconciler._last_temp_basal_duration_event
+        pending = []
+
+        for duration_event, temp_basals in self._temp_basals_by_duration_event:
+            if duration_event is last_duration_event:
+                pending.append((duration_event, temp_basals))
+            else:
+                self._resolve_temp_basals(duration_event, temp_basals)
+
+        self._temp_basals_by_duration_event = pending
+
+    def _resolve_pending_events(self):
+        """Resolves the events still waiting on later history at the end of the window"""
+        assert len(self._pending_suspends) == 0, "Unbalanced Suspend/Resume events found"
+        assert len(self._pending_temp_basals) == 0, "Temp basal duration not found"
+
+        for duration_event, temp_basals in self._temp_basals_by_duration_event:
+            self._resolve_temp_basals(duration_event, temp_basals)
+
+        self._temp_basals_by_duration_event = []
+
+        for slot, event in self._pending_square_boluses:
+            self._resolver._suspend_datetime = None
+            self._add_resolved_record(slot, self._resolver._decode_bolus(event))
+
+        self._pending_square_boluses = []
+
+
 class AppendDoseToHistory(ParseHistory):
     """Append a dose record or records to a list of history records.
 
     The expected dose record format is a dictionary with a key named "recieved" (sic).
     If that key isn't present, or its value is false, the record is ignored.
     """
+    EVENT_TYPE_KEY = "type"
+
     def __init__(self, clean_history, doses, should_resolve_doses=False):
         """Initializes a new instance of the history parser
 
@@ -626,27 +1356,38 @@ class AppendDoseToHistory(ParseHistory):
         if isinstance(doses, dict):
             doses = [doses]
 
+        # Decoded doses in chronological order, prepended to the history all at once
+        appended_events = []
+
+        def latest_event():
+            if len(appended_events) > 0:
+                return appended_events[-1]
+            elif len(clean_history) > 0:
+                return clean_history[0]
+
         for event in doses:
             if self.was_event_received(event):
                 # Determine if the dose duration should be modified on append.
                 reconcile_with = None
                 if self.should_resolve and \
                         event['type'] == 'TempBasal' and \
-                        len(clean_history) > 0 and \
-                        clean_history[0].get('type') == 'TempBasal':
-                    reconcile_with = clean_history[0]
+                        latest_event() is not None and \
+                        latest_event().get('type') == 'TempBasal':
+                    reconcile_with = latest_event()
 
                     # Ignore out-of-date doses
                     if reconcile_with['start_at'] > event['timestamp']:
                         continue
 
-                self.add_history_event(event)
+                appended_events.extend(self._decode_history_event(event))
 
                 if reconcile_with is not None:
-                    decoded_event = self.appended_history[0]
+                    decoded_event = latest_event()
                     if decoded_event['start_at'] > reconcile_with['start_at']:
                         decoded_event['start_at'] = max(decoded_event['start_at'], reconcile_with.get('end_at'))
 
+        self.appended_history[0:0] = reversed(appended_events)
+
     @staticmethod
     def was_event_received(event):
         if event.get('recieved', False):
@@ -658,14 +1399,17 @@ class AppendDoseToHistory(ParseHistory):
                 return False
 
     def add_history_event(self, event):
-        try:
-            decoded = getattr(self, '_decode_{}'.format(event['type'].lower()))(event)
-        except AttributeError:
-            decoded = [event]
-
-        for decoded_event in decoded:
+        for decoded_event in self._decode_history_event(event):
             self.appended_history.insert(0, decoded_event)
 
+    def _decode_history_event(self, event):
+        decoder = self._decoder(event)
+
+        if decoder is None:
+            return [event]
+
+        return decoder(self, event)
+
     def _decode_tempbasal(self, event):
         amount_event = copy(event)
         amount_event['_type'] = amount_event.pop('type')
@@ -707,6 +1451,12 @@ def append_reservoir_entry_to_history(history, reservoir, date, lookback_hours=4
     return filter(lambda y: y['date'] >= start_at, history)
 
 
+# It takes a MM pump about 40s to deliver 1 Unit while bolusing
+# Source: http://www.healthline.com/diabetesmine/ask-dmine-speed-insulin-pumps#3
+# In addition, a basal rate of 30 U/hour would deliver 0.5 U/min
+MAX_RESERVOIR_DROP_PER_MINUTE = 2.0
+
+
 def convert_reservoir_history_to_temp_basal(history):
     """
 
@@ -715,22 +1465,18 @@ def convert_reservoir_history_to_temp_basal(history):
     :return: A list of resolved TempBasal doses
     :rtype: list(TempBasal)
     """
-    # It takes a MM pump about 40s to deliver 1 Unit while bolusing
-    # Source: http://www.healthline.com/diabetesmine/ask-dmine-speed-insulin-pumps#3
-    # In addition, a basal rate of 30 U/hour would deliver 0.5 U/min
-    max_drop_per_minute = 2.0
+    max_drop_per_minute = MAX_RESERVOIR_DROP_PER_MINUTE
     last_entry = history[0]
-    last_datetime = parser.parse(last_entry['date'])
+    last_datetime = parse_timestamp(last_entry['date'])
     doses = []
 
     for entry in history[1:]:
-        entry_datetime = parser.parse(entry['date'])
+        entry_datetime = parse_timestamp(entry['date'])
         volume_drop = last_entry['amount'] - entry['amount']
         minutes_elapsed = (entry_datetime - last_datetime).total_seconds() / 60.0
 
         if 0 <= volume_drop <= max_drop_per_minute * minutes_elapsed:
-            doses.insert(
-                0,
+            doses.append(
                 TempBasal(
                     start_at=last_datetime,
                     end_at=entry_datetime,
@@ -743,4 +1489,122 @@ def convert_reservoir_history_to_temp_basal(history):
         last_entry = entry
         last_datetime = entry_datetime
 
+    doses.reverse()
+
     return doses
+
+
+def iter_trim(history, start_datetime=None, end_datetime=None, duration_hours=None):
+    """Yields the history events within a time window, as they are read
+
+    See the TrimHistory class. If the window can't be determined from the arguments, its missing
+    boundaries are taken from the first and last events, and the history is read in full before
+    the first event is yielded.
+
+    :param history: An iterable of history events, in reverse-chronological order
+    :type history: iterable(dict)
+    :param start_datetime: The start of the window
+    :type start_datetime: datetime
+    :param end_datetime: The end of the window
+    :type end_datetime: datetime
+    :param duration_hours: The length of the window, in hours
+    :type duration_hours: float
+    :return: An iterator of history events, in reverse-chronological order
+    :rtype: iterator(dict)
+    """
+    start_datetime, end_datetime = _history_window(start_datetime, end_datetime, duration_hours)
+
+    if start_datetime is None or end_datetime is None:
+        history = list(history)
+        trim = TrimHistory([], start_datetime=start_datetime, end_datetime=end_datetime)
+
+        if len(history) > 0:
+            if trim.start_datetime is None:
+                trim.start_datetime = trim._event_datetime(history[-1], 'start_at')
+            if trim.end_datetime is None:
+                trim.end_datetime = trim._event_datetime(history[0], 'end_at')
+    else:
+        trim = TrimHistory([], start_datetime=start_datetime, end_datetime=end_datetime)
+
+    return trim._iter_events_in_range(history)
+
+
+def iter_clean(trimmed_history, start_datetime=None, end_datetime=None, duration_hours=None):
+    """Yields the cleaned history events, as they are read
+
+    See the CleanHistory class.
+
+    :param trimmed_history: An iterable of pump history events, in reverse-chronological order
+    :type trimmed_history: iterable(dict)
+    :param start_datetime: The start time of history events. If not provided, the oldest
+    record's timestamp is used
+    :type start_datetime: datetime
+    :param end_datetime: The end time of history events. If not provided, the latest record's
+    timestamp is used
+    :type end_datetime: datetime
+    :param duration_hours: The length of the history window, in hours
+    :type duration_hours: float
+    :return: An iterator of pump history events, in reverse-chronological order
+    :rtype: iterator(dict)
+    """
+    start_datetime, end_datetime = _history_window(start_datetime, end_datetime, duration_hours)
+
+    clean = CleanHistory([], start_datetime=start_datetime, end_datetime=end_datetime)
+
+    return clean._iter_clean_events(trimmed_history)
+
+
+def iter_reconcile(clean_history):
+    """Yields the reconciled history events
+
+    See the ReconcileHistory class. Reconciliation walks history in chronological order, so the
+    history is read in full before the first event is yielded.
+
+    :param clean_history: An iterable of pump history events, in reverse-chronological order
+    :type clean_history: iterable(dict)
+    :return: An iterator of pump history events, in reverse-chronological order
+    :rtype: iterator(dict)
+    """
+    return iter(ReconcileHistory(list(clean_history)).reconciled_history)
+
+
+def iter_resolve(reconciled_history, compact_records=False):
+    """Yields the resolved records, as the history events are read
+
+    See the ResolveHistory class.
+
+    :param reconciled_history: An iterable of pump history events, in reverse-chronological order
+    :type reconciled_history: iterable(dict)
+    :param compact_records: Whether to resolve CompactRecord objects instead of dicts
+    :type compact_records: bool
+    :return: An iterator of records, in reverse-chronological order
+    :rtype: iterator(.models.BaseRecord|.models.CompactRecord)
+    """
+    return ResolveHistory([], compact_records=compact_records)._iter_resolved_records(reconciled_history)
+
+
+def iter_normalize(resolved_records, basal_schedule=None, zero_datetime=None, compact_records=False):
+    """Yields the normalized records, as the resolved records are read
+
+    See the NormalizeRecords class.
+
+    :param resolved_records: An iterable of records, in reverse-chronological order
+    :type resolved_records: iterable(.models.BaseRecord|.models.CompactRecord)
+    :param basal_schedule: A list of basal rates scheduled by time in chronological order
+    :type basal_schedule: list(dict)
+    :param zero_datetime: The timestamp by which to center the relative times
+    :type zero_datetime: datetime
+    :param compact_records: Whether to split TempBasal records into CompactRecord objects before
+    they are serialized
+    :type compact_records: bool
+    :return: An iterator of records, in reverse-chronological order
+    :rtype: iterator(dict)
+    """
+    normalize = NormalizeRecords(
+        [],
+        basal_schedule=basal_schedule,
+        zero_datetime=zero_datetime,
+        compact_records=compact_records
+    )
+
+    return normalize._iter_normalized_records(resolved_records)
@@ -0,0 +1,111 @@
+"""
+Overlap queries over the time ranges of records, such as suspend windows and temp basals
+"""
+from bisect import bisect_left, bisect_right
+
+
+class IntervalIndex(object):
+    """Intervals sorted by start, with the latest end of each prefix, searched by bisection
+
+    Each interval covers its start up to, but not including, its end. An interval of zero length,
+    such as a normal bolus, covers only its start.
+
+    A query takes O(log n) time to find the intervals which might overlap, then checks each of them.
+    Those are all returned when the intervals don't overlap each other, as for suspend windows or
+    reconciled temp basals. An interval longer than those which follow it, such as a square bolus,
+    widens the search of later queries until they start after its end.
+
+    Times can be of any type which can be compared, as long as the index and its queries agree: the
+    datetimes or ISO-8601 strings of resolved records, or the minutes of normalized records.
+    """
+    def __init__(self, intervals):
+        """Initializes a new index
+
+        :param intervals: An iterable of (start, end, value) tuples, in any order
+        :type intervals: iterable(tuple)
+        """
+        intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.values = [interval[2] for interval in intervals]
+
+        # The latest end of the intervals up to each index, which never decreases
+        self.max_ends = []
+
+        for end in self.ends:
+            self.max_ends.append(max(end, self.max_ends[-1]) if self.max_ends else end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_records(cls, records, record_type=None):
+        """Creates an index of resolved or normalized records by their time ranges
+
+        :param records: A list of records, as returned by ResolveHistory or NormalizeRecords
+        :type records: list(dict|.models.CompactRecord)
+        :param record_type: The record type name to index, e.g. "TempBasal". Defaults to all records.
+        :type record_type: str
+        :return: A new index, whose values are the records
+        :rtype: IntervalIndex
+        """
+        return cls(
+            (record["start_at"], record["end_at"], record)
+            for record in records
+            if record_type is None or record["type"] == record_type
+        )
+
+    def _candidates(self, start, end_index):
+        """Returns the index range outside which no interval can cover `start` or any later time"""
+        # Intervals ending at or before the start only matter if they have no length
+        first_index = min(bisect_right(self.max_ends, start), bisect_left(self.starts, start))
+
+        return range(first_index, end_index)
+
+    def overlapping(self, start, end):
+        """Returns the values of the intervals which overlap a time range
+
+        :param start: The start of the range
+        :param end: The end of the range, which isn't included
+        :return: The values, in order of their interval starts
+        :rtype: list
+        """
+        values = []
+
+        for index in self._candidates(start, bisect_left(self.starts, end)):
+            interval_start = self.starts[index]
+            interval_end = self.ends[index]
+
+            if interval_end > start or (interval_end == interval_start and interval_start >= start):
+                values.append(self.values[index])
+
+        return values
+
+    def containing(self, time):
+        """Returns the values of the intervals which cover a time
+
+        :param time: The time
+        :return: The values, in order of their interval starts
+        :rtype: list
+        """
+        values = []
+
+        for index in self._candidates(time, bisect_right(self.starts, time)):
+            interval_end = self.ends[index]
+
+            if interval_end > time or (interval_end == self.starts[index] == time):
+                values.append(self.values[index])
+
+        return values
+
+    def next_start(self, time):
+        """Returns the value of the earliest interval starting at or after a time
+
+        :param time: The time
+        :return: The value, or None if no interval starts at or after the time
+        """
+        index = bisect_left(self.starts, time)
+
+        if index < len(self.starts):
+            return self.values[index]
@@ -0,0 +1,166 @@
+"""
+Incremental decoding of JSON arrays, for reading large history files one event at a time
+
+The `ijson` package is used when it's installed, which can be done with the `stream` extra:
+
+    $ pip install openapscontrib.mmhistorytools[stream]
+
+Otherwise the standard library decoder is applied to one array element at a time.
+"""
+import argparse
+from decimal import Decimal
+import json
+
+try:
+    import ijson
+except Exception:
+    # Versions of ijson which don't support this interpreter fail to compile, rather than to import
+    ijson = None
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_NUMBER_CHARACTERS = '0123456789.eE+-'
+
+
+def iter_json_array(fp, chunk_size=DEFAULT_CHUNK_SIZE, use_ijson=None):
+    """Yields the elements of a JSON array as they are read from a file
+
+    :param fp: A file containing a JSON array
+    :type fp: file
+    :param chunk_size: The number of characters to read at a time
+    :type chunk_size: int
+    :param use_ijson: Whether to decode with ijson. Defaults to using ijson if it's installed.
+    :type use_ijson: bool|NoneType
+    :return: An iterator of the decoded array elements
+    :rtype: iterator
+
+    :raises ValueError: The file doesn't contain a valid JSON array
+    """
+    if use_ijson is None:
+        use_ijson = ijson is not None
+
+    if use_ijson:
+        try:
+            # Floats are decoded as Decimal by default, which the history passes don't expect
+            return ijson.items(fp, 'item', use_float=True)
+        except TypeError:
+            # Versions of ijson before 3.1, including those for Python 2, can't decode floats
+            return (_decimals_to_floats(item) for item in ijson.items(fp, 'item'))
+
+    return _iter_decoded_array(fp, chunk_size)
+
+
+def _decimals_to_floats(value):
+    if isinstance(value, Decimal):
+        return float(value)
+
+    if isinstance(value, dict):
+        return {key: _decimals_to_floats(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [_decimals_to_floats(item) for item in value]
+
+    return value
+
+
+class _ChunkedBuffer(object):
+    """The unread part of a file, read a chunk at a time"""
+    def __init__(self, fp, chunk_size):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+
+    def read_more(self):
+        """Appends the next chunk to the buffer, discarding what has been decoded
+
+        :return: False if the end of the file was reached
+        :rtype: bool
+        """
+        chunk = self.fp.read(self.chunk_size)
+
+        if not chunk:
+            return False
+
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+
+        return True
+
+    def peek(self):
+        """Returns the next character which isn't whitespace, or None at the end of the file"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            elif not self.read_more():
+                return None
+
+    def expect(self, characters):
+        """Reads the next character which isn't whitespace, which must be one of `characters`"""
+        character = self.peek()
+
+        if character is None or character not in characters:
+            raise ValueError('Expected one of "{}" but found {!r}'.format(characters, character))
+
+        self.position += 1
+
+        return character
+
+    def decode(self, decoder):
+        """Decodes the next JSON value"""
+        self.peek()
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                # The value may continue in the next chunk
+                if not self.read_more():
+                    raise
+            else:
+                # A number may also continue in the next chunk, even if its start is valid alone
+                if (
+                    end < len(self.buffer) and self.buffer[end] not in _NUMBER_CHARACTERS or
+                    not self.read_more()
+                ):
+                    self.position = end
+                    return value
+
+
+def _iter_decoded_array(fp, chunk_size):
+    decoder = json.JSONDecoder()
+    buffer = _ChunkedBuffer(fp, chunk_size)
+
+    buffer.expect('[')
+
+    if buffer.peek() == ']':
+        return
+
+    while True:
+        yield buffer.decode(decoder)
+
+        if buffer.expect(',]') == ']':
+            return
+
+
+def iter_json_file(filename, **kwargs):
+    """Yields the elements of a JSON array in a file as they are read
+
+    :param filename: The path to the file, or "-" for stdin
+    :type filename: basestring
+    :return: An iterator of the decoded array elements
+    :rtype: iterator
+    """
+    fp = argparse.FileType('r')(filename)
+
+    try:
+        for element in iter_json_array(fp, **kwargs):
+            yield element
+    finally:
+        if filename != '-':
+            fp.close()
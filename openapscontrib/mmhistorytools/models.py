@@ -28,6 +28,95 @@ class BaseRecord(dict):
 
         super(BaseRecord, self).__init__((), **kwargs)
 
+    @classmethod
+    def compact(cls, start_at=None, end_at=None, amount=None, unit=None, description=None):
+        """Constructs a compact record of this type
+
+        See `BaseRecord.__init__` for a description of the arguments.
+
+        :rtype: CompactRecord
+        """
+        return CompactRecord(cls.__name__, start_at, end_at, amount, unit, description)
+
+
+class CompactRecord(object):
+    """A record which stores its timestamps as datetimes, and is serialized only for output
+
+    Supports the read-only subset of the dict interface used by the history passes.
+    """
+    __slots__ = ("type", "start_at", "end_at", "amount", "unit", "description")
+
+    def __init__(self, type, start_at, end_at, amount=None, unit=None, description=None):
+        """Constructs a compact record
+
+        :param type: The record type name, e.g. "TempBasal"
+        :type type: str
+        :param start_at: The start of the record
+        :type start_at: datetime.datetime
+        :param end_at: The end time of the record
+        :type end_at: datetime.datetime
+        :param amount: The numeric description of the record
+        :type amount: int|float
+        :param unit: The unit describing `amount`
+        :type unit: str
+        :param description: A human summary of the record
+        :type description: basestring
+        """
+        self.type = type
+        self.start_at = start_at
+        self.end_at = end_at
+        self.amount = amount
+        self.unit = unit
+        self.description = description
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactRecord) and \
+            all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "CompactRecord({})".format(
+            ", ".join("{}={!r}".format(key, getattr(self, key)) for key in self.__slots__)
+        )
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self, zero_datetime=None):
+        """Serializes the record in the format of the equivalent BaseRecord
+
+        :param zero_datetime: If provided, timestamps are serialized as the signed number of minutes
+        from this time
+        :type zero_datetime: datetime.datetime
+        :return: A record dict
+        :rtype: dict
+        """
+        if zero_datetime is None:
+            return record_types[self.type](
+                start_at=self.start_at,
+                end_at=self.end_at,
+                amount=self.amount,
+                unit=self.unit,
+                description=self.description
+            )
+        else:
+            return {
+                "type": self.type,
+                "start_at": int(round((self.start_at - zero_datetime).total_seconds() / 60)),
+                "end_at": int(round((self.end_at - zero_datetime).total_seconds() / 60)),
+                "amount": self.amount,
+                "unit": self.unit,
+                "description": self.description
+            }
+
 
 class Bolus(BaseRecord):
     pass
@@ -45,6 +134,9 @@ class Exercise(BaseRecord):
     pass
 
 
+record_types = {record_class.__name__: record_class for record_class in (Bolus, Meal, TempBasal, Exercise)}
+
+
 class Unit(object):
     grams = "g"
     percent_of_basal = "percent"
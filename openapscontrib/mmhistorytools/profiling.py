@@ -0,0 +1,172 @@
+"""
+Timing of the stages of a command, for finding where a slow loop cycle spends its time
+"""
+from collections import OrderedDict
+import os
+import sys
+import time
+
+try:
+    from time import process_time as _cpu_time
+except ImportError:
+    from time import clock as _cpu_time
+
+
+# Set to a non-empty value other than "0" to profile every command
+PROFILE_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_PROFILE'
+
+# Set to a path to write cProfile statistics for every command
+PROFILE_OUTPUT_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_PROFILE_OUTPUT'
+
+
+class Stage(object):
+    """The measurements of one stage of a command"""
+    def __init__(self, name):
+        self.name = name
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.count = None
+
+
+class _Measurement(object):
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._wall_start = time.time()
+        self._cpu_start = _cpu_time()
+
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stage.wall_seconds += time.time() - self._wall_start
+        self.stage.cpu_seconds += _cpu_time() - self._cpu_start
+
+
+class _NoMeasurement(object):
+    def __init__(self, name):
+        self.stage = Stage(name)
+
+    def __enter__(self):
+        return self.stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class Profiler(object):
+    """Records the wall and CPU time, and the number of events produced, of each stage of a command
+
+    When disabled, stages are not measured. While enabled, the command can also be run under
+    cProfile, with the statistics written to `output_path`.
+    """
+    def __init__(self, enabled=False, output_path=None, stream=None):
+        """Initializes a new profiler
+
+        :param enabled: Whether to measure stages
+        :type enabled: bool
+        :param output_path: A path to which to write cProfile statistics, which also enables the profiler
+        :type output_path: basestring|NoneType
+        :param stream: The file to which to write the report. Defaults to stderr.
+        :type stream: file
+        """
+        self.enabled = enabled or output_path is not None
+        self.output_path = output_path
+        self.stream = stream or sys.stderr
+        self.stages = OrderedDict()
+
+        self._profile = None
+
+    @classmethod
+    def from_environment(cls, enabled=False, output_path=None):
+        """Creates a profiler, also enabling it if requested by environment variables
+
+        :param enabled: Whether profiling was requested by the command arguments
+        :type enabled: bool
+        :param output_path: The cProfile output path from the command arguments
+        :type output_path: basestring|NoneType
+        :return: A new profiler
+        :rtype: Profiler
+        """
+        enabled = enabled or os.environ.get(PROFILE_ENVIRONMENT_VARIABLE, '0') not in ('', '0')
+        output_path = output_path or os.environ.get(PROFILE_OUTPUT_ENVIRONMENT_VARIABLE) or None
+
+        return cls(enabled=enabled, output_path=output_path)
+
+    def __enter__(self):
+        if self.output_path is not None:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.output_path)
+            self._profile = None
+
+        if self.enabled and exc_type is None:
+            self.report()
+
+    def stage(self, name):
+        """Returns a context manager measuring a stage
+
+        The stage is yielded by the context manager, and its `count` can be set to the number of
+        events it produced. Measuring a stage name again adds to its totals.
+
+        :param name: The name of the stage
+        :type name: str
+        :return: A context manager
+        """
+        if not self.enabled:
+            return _NoMeasurement(name)
+
+        if name not in self.stages:
+            self.stages[name] = Stage(name)
+
+        return _Measurement(self.stages[name])
+
+    def call(self, name, func, *args, **kwargs):
+        """Calls a function as a stage, counting the items in its result
+
+        :param name: The name of the stage
+        :type name: str
+        :param func: The function to call
+        :type func: callable
+        :return: The function's result
+        """
+        with self.stage(name) as stage:
+            result = func(*args, **kwargs)
+
+        try:
+            stage.count = len(result)
+        except TypeError:
+            pass
+
+        return result
+
+    def report(self):
+        """Writes a table of the stage measurements to the report stream"""
+        write = self.stream.write
+
+        write('{:<16}{:>12}{:>12}{:>10}\n'.format('stage', 'wall ms', 'cpu ms', 'count'))
+
+        for stage in self.stages.values():
+            write('{:<16}{:>12.1f}{:>12.1f}{:>10}\n'.format(
+                stage.name,
+                stage.wall_seconds * 1000,
+                stage.cpu_seconds * 1000,
+                '' if stage.count is None else stage.count
+            ))
+
+        write('{:<16}{:>12.1f}{:>12.1f}\n'.format(
+            'total',
+            sum(stage.wall_seconds for stage in self.stages.values()) * 1000,
+            sum(stage.cpu_seconds for stage in self.stages.values()) * 1000
+        ))
+
+        if self.output_path is not None:
+            write('cProfile statistics written to {}\n'.format(self.output_path))
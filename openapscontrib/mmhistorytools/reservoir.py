@@ -0,0 +1,157 @@
+"""
+Persistent storage of recent reservoir values
+"""
+from collections import deque
+from datetime import timedelta
+import json
+import os
+
+from .models import Unit
+from .timestamps import parse_timestamp
+
+
+class ReservoirStore(object):
+    """A rolling window of reservoir values persisted as an append-only file
+
+    Entries are kept in chronological order in a ring buffer. Appending a value writes a single line
+    of JSON to the end of the file and evicts only the entries that fell out of the window. The file
+    is rewritten with just the retained entries once expired lines outnumber them.
+
+    A file containing a JSON list of entries, such as the output of `append_reservoir`, is also
+    accepted and is converted to the line format on the next compaction.
+    """
+    # The minimum number of expired lines in the file before it is rewritten
+    min_compaction_lines = 64
+
+    def __init__(self, path=None, lookback_hours=4.0):
+        """Initializes a store, loading any entries already saved to its file
+
+        :param path: The path of the file in which to persist entries, or None to keep them in memory
+        :type path: basestring|NoneType
+        :param lookback_hours: The length of history to keep, in hours
+        :type lookback_hours: float
+        """
+        self.path = path
+        self.lookback_hours = lookback_hours
+        self.entries = deque()
+
+        # The number of entries in the file, including those already evicted
+        self._file_length = 0
+        self._file_is_lines = True
+
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def _load(self):
+        with open(self.path, 'r') as fp:
+            contents = fp.read()
+
+        if contents.lstrip().startswith('['):
+            entries = json.loads(contents)
+            self._file_is_lines = False
+        else:
+            entries = self._load_lines(contents)
+
+        self.entries.extend(entries)
+        self._file_length = len(entries)
+
+        # Lines written before the last compaction may have since expired
+        if entries:
+            latest_datetime = parse_timestamp(entries[-1]['date'])
+            self.evict((latest_datetime - timedelta(hours=self.lookback_hours)).isoformat())
+
+    def _load_lines(self, contents):
+        lines = contents.splitlines(True)
+        entries = []
+
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                if index < len(lines) - 1:
+                    raise
+
+                # The last append was interrupted, so the partial line is removed before the next
+                with open(self.path, 'r+') as fp:
+                    fp.truncate(len(contents) - len(line))
+
+        return entries
+
+    def append(self, reservoir, date):
+        """Appends a reservoir value and clock time, evicting entries older than the window
+
+        :param reservoir: The new reservoir value
+        :type reservoir: float
+        :param date: The current date
+        :type date: datetime
+        :return: The appended entry
+        :rtype: dict
+        """
+        entry = {
+            'date': date.isoformat(),
+            'amount': reservoir,
+            'unit': Unit.units
+        }
+
+        self.entries.append(entry)
+        self.evict((date - timedelta(hours=self.lookback_hours)).isoformat())
+
+        if self.path is not None:
+            if self._should_compact():
+                self.compact()
+            else:
+                with open(self.path, 'a') as fp:
+                    fp.write(json.dumps(entry) + '\n')
+
+                self._file_length += 1
+
+        return entry
+
+    def evict(self, start_at):
+        """Removes the entries recorded before a timestamp
+
+        :param start_at: The ISO-8601 timestamp of the earliest entry to keep
+        :type start_at: basestring
+        """
+        entries = self.entries
+
+        while entries and entries[0]['date'] < start_at:
+            entries.popleft()
+
+    def _should_compact(self):
+        # The pending entry isn't in the file yet
+        expired_lines = self._file_length + 1 - len(self.entries)
+
+        return not self._file_is_lines or (
+            expired_lines >= self.min_compaction_lines and expired_lines > len(self.entries)
+        )
+
+    def compact(self):
+        """Rewrites the file to contain only the retained entries"""
+        temporary_path = self.path + '.tmp'
+
+        with open(temporary_path, 'w') as fp:
+            for entry in self.entries:
+                fp.write(json.dumps(entry) + '\n')
+
+        os.rename(temporary_path, self.path)
+
+        self._file_length = len(self.entries)
+        self._file_is_lines = True
+
+    def history(self):
+        """Returns the retained entries
+
+        :return: The historical reservoir values, in chronological order
+        :rtype: list(dict)
+        """
+        return list(self.entries)
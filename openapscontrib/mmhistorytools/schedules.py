@@ -0,0 +1,172 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timedelta
+from datetime import time
+import json
+import threading
+
+from .timestamps import parse_timestamp
+
+
+class BasalSchedule(object):
+    """A basal profile indexed by time of day
+
+    The profile entries are parsed once into offsets from midnight, sorted, and searched by bisection.
+    """
+    def __init__(self, basal_rates):
+        """Initializes a new schedule from a basal profile
+
+        :param basal_rates: A list of basal rates scheduled by time in chronological order, each a
+        dictionary with "start" (e.g. "04:00:00") and "rate" (in U/hour) keys
+        :type basal_rates: list(dict)
+        """
+        entries = []
+
+        for basal_rate in basal_rates:
+            start_time = parse_timestamp(basal_rate["start"]).time()
+            offset = datetime.combine(datetime.min.date(), start_time) - datetime.min
+
+            entries.append((offset, start_time, basal_rate["rate"]))
+
+        entries.sort(key=lambda entry: entry[0])
+
+        self.offsets = [entry[0] for entry in entries]
+        self.start_times = [entry[1] for entry in entries]
+        self.rates = [entry[2] for entry in entries]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def rates_in_range(self, start_datetime, end_datetime):
+        """Returns a list of the current basal rates effective between the specified times
+
+        :param start_datetime:
+        :type start_datetime: datetime
+        :param end_datetime:
+        :type end_datetime: datetime
+        :return: A list of basal rates, each a dictionary with "start" (datetime) and "rate" keys
+        :rtype: list(dict)
+
+        :raises AssertionError: The argument values are invalid
+        """
+        assert (start_datetime <= end_datetime)
+
+        basal_rates = []
+
+        while True:
+            max_datetime = datetime.combine(start_datetime.date() + timedelta(days=1), time.min)
+
+            if end_datetime > max_datetime:
+                basal_rates.extend(self._rates_in_day(start_datetime, max_datetime))
+                start_datetime = max_datetime
+            else:
+                basal_rates.extend(self._rates_in_day(start_datetime, end_datetime))
+                return basal_rates
+
+    def rates_in_ranges(self, ranges):
+        """Returns the basal rates effective within each of many time ranges, in a single sweep
+
+        The result for each range is the same as `rates_in_range`. Instead of searching the schedule
+        for each range, the ranges are sorted by start and swept against the schedule's boundaries
+        on every day they span, so the cost after sorting is O(ranges + boundaries) when the ranges
+        don't overlap.
+
+        :param ranges: A list of (start_datetime, end_datetime) tuples
+        :type ranges: list(tuple(datetime, datetime))
+        :return: A list of basal rates for each range, in the order given. The rate dictionaries
+        are shared between ranges.
+        :rtype: list(list(dict))
+
+        :raises AssertionError: The argument values are invalid
+        """
+        if len(ranges) == 0 or len(self) == 0:
+            return [[] for _ in ranges]
+
+        order = sorted(range(len(ranges)), key=lambda index: ranges[index][0])
+        first_date = ranges[order[0]][0].date()
+        last_date = max(end_datetime for _, end_datetime in ranges).date()
+
+        boundaries = []
+        day = first_date
+
+        while day <= last_date:
+            for start_time, rate in zip(self.start_times, self.rates):
+                boundaries.append({"start": datetime.combine(day, start_time), "rate": rate})
+
+            day += timedelta(days=1)
+
+        boundaries_start = [boundary["start"] for boundary in boundaries]
+        results = [None] * len(ranges)
+        cursor = 0
+
+        for index in order:
+            start_datetime, end_datetime = ranges[index]
+
+            assert (start_datetime <= end_datetime)
+
+            # The rate in effect at the start is found among the boundaries of its day, as by
+            # `_rates_in_day`. Before the day's first boundary, the range begins with that one.
+            cursor = max(cursor, (start_datetime.date() - first_date).days * len(self))
+
+            while cursor + 1 < len(boundaries) and boundaries_start[cursor + 1] <= start_datetime:
+                cursor += 1
+
+            # A range ending at midnight ends with the day before, as by `rates_in_range`
+            includes_end = end_datetime.time() != time.min or start_datetime == end_datetime
+            stop = cursor if boundaries_start[cursor] > start_datetime else cursor + 1
+
+            while stop < len(boundaries) and (
+                boundaries_start[stop] < end_datetime or
+                (includes_end and boundaries_start[stop] == end_datetime)
+            ):
+                stop += 1
+
+            results[index] = boundaries[cursor:stop]
+
+        return results
+
+    def _rates_in_day(self, start_datetime, end_datetime):
+        start_date = start_datetime.date()
+        midnight = datetime.combine(start_date, time.min)
+
+        start_index = max(0, bisect_right(self.offsets, start_datetime - midnight) - 1)
+        end_index = bisect_right(self.offsets, end_datetime - midnight)
+
+        return [
+            {
+                "start": datetime.combine(start_date, self.start_times[index]),
+                "rate": self.rates[index]
+            } for index in range(start_index, end_index)
+        ]
+
+
+# Schedules parsed from recently-used profiles, keyed by their contents
+_schedules_by_profile = OrderedDict()
+_max_cached_schedules = 8
+_schedules_lock = threading.Lock()
+
+
+def get_basal_schedule(basal_rates):
+    """Returns the schedule for a basal profile, reusing a previously-parsed schedule if possible
+
+    :param basal_rates: A list of basal rates scheduled by time in chronological order
+    :type basal_rates: list(dict)
+    :return: The basal schedule
+    :rtype: BasalSchedule
+    """
+    key = json.dumps(basal_rates, sort_keys=True)
+
+    # Passes on several threads may share the cache
+    with _schedules_lock:
+        try:
+            schedule = _schedules_by_profile.pop(key)
+        except KeyError:
+            schedule = BasalSchedule(basal_rates)
+
+            if len(_schedules_by_profile) >= _max_cached_schedules:
+                _schedules_by_profile.popitem(last=False)
+
+        _schedules_by_profile[key] = schedule
+
+    return schedule
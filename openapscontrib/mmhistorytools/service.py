@@ -0,0 +1,385 @@
+"""
+A resident process serving the mmhistorytools commands over a Unix socket
+
+Starting a command through openaps pays for interpreter startup and imports on every call. The
+service runs the commands in one long-lived process instead, so imports, parsed timestamps and
+basal schedules are reused between loop cycles.
+
+Start the service:
+
+    $ python -m openapscontrib.mmhistorytools.service serve
+
+Then run any command with the same arguments as `openaps use <device> <command>`:
+
+    $ python -m openapscontrib.mmhistorytools.service client prepare history.json --basal-profile basal.json
+
+The output is written to stdout as openaps would write it. If the command reads its input from
+stdin, the client's stdin is forwarded.
+
+Protocol: the client sends a single line of JSON containing the command name, its arguments and
+its working directory. If the command reads stdin, the service sends the line `{"stdin": true}`,
+and the client replies with the contents of its stdin and closes its side of the connection.
+Finally the service sends a line of JSON containing the exit code and anything the command wrote
+to stdout or stderr, followed by the serialized output if the command succeeded.
+
+The service runs one command at a time, so it stops waiting on a client which doesn't send its
+request or stdin within `request_timeout` seconds, and responds with an error. The client likewise
+gives up on a service which doesn't respond within its timeout.
+"""
+import argparse
+import errno
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import traceback
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+try:
+    from cStringIO import StringIO as _StringIO
+except ImportError:
+    from io import StringIO as _StringIO
+
+
+SOCKET_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_SOCKET'
+
+# The time in seconds the service waits for a client to send its request or stdin
+DEFAULT_REQUEST_TIMEOUT = 10.0
+
+# The time in seconds a client waits for the service, which includes running the command
+DEFAULT_CLIENT_TIMEOUT = 60.0
+
+
+def default_socket_path():
+    """Returns the socket path from the environment, or a per-user path in the temporary directory
+
+    :rtype: basestring
+    """
+    return os.environ.get(SOCKET_ENVIRONMENT_VARIABLE) or os.path.join(
+        tempfile.gettempdir(),
+        'mmhistorytools-{}.sock'.format(os.getuid())
+    )
+
+
+def _date_handler(obj):
+    return obj.isoformat() if hasattr(obj, 'isoformat') else obj
+
+
+def serialize(output):
+    """Serializes command output the same way as openaps
+
+    :param output: The command output
+    :return: A JSON string
+    :rtype: str
+    """
+    return json.dumps(output, indent=2, default=_date_handler)
+
+
+class CommandRunner(object):
+    """Runs the commands returned by `get_uses` within the current process"""
+    def __init__(self):
+        from . import get_uses
+
+        self.commands = {use_class.__name__: use_class for use_class in get_uses(None, None)}
+
+    def run(self, command, argv, cwd=None, stdin=None):
+        """Runs a command as if invoked from the command line
+
+        :param command: The command name, e.g. "prepare"
+        :type command: basestring
+        :param argv: The command arguments
+        :type argv: list(basestring)
+        :param cwd: The directory against which to resolve relative paths
+        :type cwd: basestring
+        :param stdin: The file to provide as stdin
+        :type stdin: file
+        :return: The command output
+        :rtype: list|dict
+
+        :raises ValueError: The command doesn't exist
+        :raises SystemExit: The arguments are invalid
+        """
+        try:
+            use_class = self.commands[command]
+        except KeyError:
+            raise ValueError('Unknown command "{}". Choose from: {}'.format(
+                command, ', '.join(sorted(self.commands))
+            ))
+
+        # The openaps device context isn't needed by these commands
+        use = use_class.__new__(use_class)
+        parser = argparse.ArgumentParser(prog=command, description=use_class.__doc__)
+        use.configure_app(None, parser)
+
+        original_cwd = os.getcwd()
+        original_stdin = sys.stdin
+
+        try:
+            if cwd is not None:
+                os.chdir(cwd)
+
+            if stdin is not None:
+                sys.stdin = stdin
+
+            return use.main(parser.parse_args(argv), None)
+        finally:
+            os.chdir(original_cwd)
+            sys.stdin = original_stdin
+
+
+class _ClientStdin(object):
+    """The client's stdin, requested when it's first read"""
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._contents = None
+
+    def _read_contents(self):
+        if self._contents is None:
+            self.wfile.write((json.dumps(dict(stdin=True)) + '\n').encode('utf-8'))
+            self.wfile.flush()
+            contents = self.rfile.read()
+
+            if not isinstance(contents, str):
+                contents = contents.decode('utf-8')
+
+            self._contents = _StringIO(contents)
+
+        return self._contents
+
+    def read(self, *args):
+        return self._read_contents().read(*args)
+
+    def readline(self, *args):
+        return self._read_contents().readline(*args)
+
+    def __iter__(self):
+        return iter(self._read_contents())
+
+    def close(self):
+        pass
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # Applied to the connection by StreamRequestHandler
+        self.timeout = self.server.request_timeout
+
+        socketserver.StreamRequestHandler.setup(self)
+
+    def _respond(self, exit_code, messages, payload=None):
+        response = dict(exit_code=exit_code, messages=messages, output=payload is not None)
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+        if payload is not None:
+            self.wfile.write(payload.encode('utf-8'))
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except socket.timeout:
+            self._respond(1, 'Timed out waiting for the request\n')
+            return
+
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self._respond(1, 'The request is not a line of JSON\n')
+            return
+
+        messages = _StringIO()
+        payload = None
+
+        # Messages written by the command, such as argument errors and profiling, go to the client
+        original_streams = sys.stdout, sys.stderr
+        sys.stdout = sys.stderr = messages
+
+        try:
+            output = self.server.runner.run(
+                request['command'],
+                request.get('argv', []),
+                cwd=request.get('cwd'),
+                stdin=_ClientStdin(self.rfile, self.wfile)
+            )
+            payload = serialize(output)
+        except socket.timeout:
+            messages.write('Timed out waiting for stdin\n')
+            exit_code = 1
+        except SystemExit as e:
+            if isinstance(e.code, int) or e.code is None:
+                exit_code = e.code or 0
+            else:
+                messages.write('{}\n'.format(e.code))
+                exit_code = 1
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        else:
+            exit_code = 0
+        finally:
+            sys.stdout, sys.stderr = original_streams
+
+        self._respond(exit_code, messages.getvalue(), payload)
+
+
+class HistoryService(socketserver.UnixStreamServer):
+    """A Unix socket server running one command at a time"""
+    def __init__(self, socket_path, request_timeout=DEFAULT_REQUEST_TIMEOUT):
+        """Binds a new service to a socket path, replacing a stale socket file
+
+        :param socket_path: The path of the socket to create
+        :type socket_path: basestring
+        :param request_timeout: The time in seconds to wait for a client to send its request or stdin
+        :type request_timeout: float
+        """
+        self.request_timeout = request_timeout
+
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+
+        self.runner = CommandRunner()
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def _remove_stale_socket(socket_path):
+    """Removes a socket file left by a service which is no longer running
+
+    :raises OSError: The path isn't a socket
+    :raises socket.error: A service is still listening on the socket
+    """
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise OSError(errno.EEXIST, 'Not a socket', socket_path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        probe.connect(socket_path)
+    except socket.error as e:
+        if e.errno != errno.ECONNREFUSED:
+            raise
+    else:
+        raise socket.error(errno.EADDRINUSE, 'A service is already listening at {}'.format(socket_path))
+    finally:
+        probe.close()
+
+    os.unlink(socket_path)
+
+
+def request(socket_path, command, argv, stdin=None, timeout=DEFAULT_CLIENT_TIMEOUT):
+    """Runs a command in the service
+
+    :param socket_path: The path of the service socket
+    :type socket_path: basestring
+    :param command: The command name
+    :type command: basestring
+    :param argv: The command arguments
+    :type argv: list(basestring)
+    :param stdin: The file to provide to the command as stdin, if it reads it
+    :type stdin: file|NoneType
+    :param timeout: The time in seconds to wait for the service, including running the command
+    :type timeout: float
+    :return: The response, containing the command's exit code and messages, and the serialized output
+    :rtype: tuple(dict, basestring)
+
+    :raises socket.timeout: The service didn't respond in time
+    :raises socket.error: The service isn't running
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+
+    try:
+        client.connect(socket_path)
+        client.sendall((json.dumps(dict(
+            command=command,
+            argv=argv,
+            cwd=os.getcwd()
+        )) + '\n').encode('utf-8'))
+
+        responses = client.makefile('rb')
+        response = json.loads(responses.readline().decode('utf-8'))
+
+        if response.get('stdin'):
+            contents = stdin.read() if stdin is not None else ''
+            client.sendall(contents.encode('utf-8') if not isinstance(contents, bytes) else contents)
+            client.shutdown(socket.SHUT_WR)
+
+            response = json.loads(responses.readline().decode('utf-8'))
+
+        payload = responses.read().decode('utf-8')
+        responses.close()
+    finally:
+        client.close()
+
+    return response, payload
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves the mmhistorytools commands over a Unix socket')
+    parser.add_argument('--socket', default=default_socket_path(), help='The path of the service socket')
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=None,
+        help='The time in seconds the service waits for a client to send its request, or the '
+             'client waits for the service to respond'
+    )
+    subparsers = parser.add_subparsers(dest='mode')
+
+    subparsers.add_parser('serve', help='Run the service until interrupted')
+
+    client_parser = subparsers.add_parser('client', help='Run a command in the service')
+    client_parser.add_argument('command', help='The command to run, e.g. prepare')
+    client_parser.add_argument('argv', nargs=argparse.REMAINDER, help='The command arguments')
+
+    args = parser.parse_args(argv)
+
+    if args.mode == 'serve':
+        service = HistoryService(args.socket, request_timeout=args.timeout or DEFAULT_REQUEST_TIMEOUT)
+
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.server_close()
+
+        return 0
+
+    try:
+        response, payload = request(
+            args.socket,
+            args.command,
+            args.argv,
+            stdin=sys.stdin,
+            timeout=args.timeout or DEFAULT_CLIENT_TIMEOUT
+        )
+    except socket.timeout:
+        sys.stderr.write('Timed out waiting for the service at {}\n'.format(args.socket))
+        return 1
+    except socket.error as e:
+        sys.stderr.write('Could not connect to the service at {}: {}\n'.format(args.socket, e))
+        return 1
+
+    sys.stderr.write(response['messages'])
+
+    if response['output']:
+        sys.stdout.write(payload + '\n')
+
+    return response['exit_code']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Runs `prepare` over a long history on a process pool, one shard of history per day
+
+Usage:
+
+    $ python -m openapscontrib.mmhistorytools.shards pump_history.json --basal-profile basal.json [--processes 4] > prepared_history.json
+
+The output is identical to `prepare`, in the format written by openaps.
+
+Reconciliation trims each temp basal by the events that follow it, and restarts it after a
+PumpResume, so cleaning and reconciling run over the whole history first. The reconciled history
+is then cut at midnight, and each day is resolved, normalized and serialized by a worker. The
+state which the resolve pass carries from newer to older events is computed for each cut and
+passed to its shard:
+- A PumpSuspend needs the time of its PumpResume, which may be after midnight
+- A square Bolus is shortened by the next PumpSuspend, which may be days later
+- A TempBasal takes the duration of its TempBasalDuration event
+"""
+import argparse
+import multiprocessing
+import sys
+
+from .historytools import CleanHistory, NormalizeRecords, ReconcileHistory, ResolveHistory
+from .service import serialize
+from .timestamps import parse_timestamp
+
+
+# Worker state, set once for each process
+_events = None
+_basal_schedule = None
+_zero_datetime = None
+
+
+# The shard lengths which divide a day evenly
+HOURS_PER_SHARD_CHOICES = (1, 2, 3, 4, 6, 8, 12, 24)
+
+
+def _check_hours_per_shard(hours_per_shard):
+    if hours_per_shard not in HOURS_PER_SHARD_CHOICES:
+        raise ValueError('hours_per_shard must be one of {}, not {!r}'.format(
+            ', '.join(str(hours) for hours in HOURS_PER_SHARD_CHOICES),
+            hours_per_shard
+        ))
+
+
+def _shard_key(event, hours_per_shard):
+    # Pump timestamps are ISO-8601 strings in a single format, so the date and hour can be sliced
+    timestamp = event["timestamp"]
+
+    return timestamp[:10], int(timestamp[11:13]) // hours_per_shard
+
+
+def shard_slices(reconciled_history, hours_per_shard=24):
+    """Returns the index ranges of the history shards, cut at midnight
+
+    An event recorded out of order stays in the shard it was read with.
+
+    :param reconciled_history: A list of pump history events, in reverse-chronological order
+    :type reconciled_history: list(dict)
+    :param hours_per_shard: The length of each shard, in hours from midnight. It must divide a day.
+    :type hours_per_shard: int
+    :return: A list of (start, stop) index pairs, newest first
+    :rtype: list(tuple(int, int))
+
+    :raises ValueError: The shard length is not one of HOURS_PER_SHARD_CHOICES
+    """
+    _check_hours_per_shard(hours_per_shard)
+
+    slices = []
+    start = 0
+    key = None
+
+    for index, event in enumerate(reconciled_history):
+        event_key = _shard_key(event, hours_per_shard)
+
+        if key is None:
+            key = event_key
+        elif event_key < key:
+            slices.append((start, index))
+            start = index
+            key = event_key
+
+    if start < len(reconciled_history):
+        slices.append((start, len(reconciled_history)))
+
+    return slices
+
+
+def resolve_states(reconciled_history, slices):
+    """Returns the state of the resolve pass as it begins each shard
+
+    :param reconciled_history: A list of pump history events, in reverse-chronological order
+    :type reconciled_history: list(dict)
+    :param slices: The index ranges returned by `shard_slices`
+    :type slices: list(tuple(int, int))
+    :return: A state dictionary for each shard
+    :rtype: list(dict)
+    """
+    states = []
+    state = dict(resume_datetime=None, suspend_datetime=None, temp_basal_duration=None)
+    index = 0
+
+    for start, _ in slices:
+        for event in reconciled_history[index:start]:
+            event_type = event["_type"]
+
+            if event_type == "TempBasalDuration":
+                state["temp_basal_duration"] = event[ResolveHistory.DURATION_IN_MINUTES_KEY]
+            elif event_type == "PumpResume":
+                state["resume_datetime"] = parse_timestamp(event["timestamp"])
+            elif event_type == "PumpSuspend":
+                state["resume_datetime"] = None
+                state["suspend_datetime"] = parse_timestamp(event["timestamp"])
+
+        states.append(dict(state))
+        index = start
+
+    return states
+
+
+def _set_up_worker(events, basal_schedule, zero_datetime):
+    global _events, _basal_schedule, _zero_datetime
+
+    _events = events
+    _basal_schedule = basal_schedule
+    _zero_datetime = zero_datetime
+
+
+def _prepare_shard(task):
+    """Resolves, normalizes and serializes a shard of reconciled history
+
+    :param task: The shard's index range and the resolve state as it begins
+    :type task: tuple(tuple(int, int), dict)
+    :return: The serialized records
+    :rtype: str
+    """
+    (start, stop), state = task
+
+    resolver = ResolveHistory([], compact_records=True)
+    resolver._resume_datetime = state["resume_datetime"]
+    resolver._suspend_datetime = state["suspend_datetime"]
+    resolver._temp_basal_duration = state["temp_basal_duration"]
+
+    return serialize(NormalizeRecords(
+        resolver._iter_resolved_records(_events[start:stop]),
+        basal_schedule=_basal_schedule,
+        zero_datetime=_zero_datetime,
+        compact_records=True
+    ).normalized_records)
+
+
+def _join_serialized(chunks):
+    """Joins serialized lists into the serialization of one list
+
+    :param chunks: Lists serialized by `serialize`
+    :type chunks: iterable(str)
+    :rtype: str
+    """
+    # The separator between list items differs between versions of the json module
+    empty_item = serialize([0, 0])
+    item_separator = empty_item[len('[\n  0'):-len('0\n]')]
+
+    items = [chunk[len('[\n  '):-len('\n]')] for chunk in chunks if chunk != '[]']
+
+    if len(items) == 0:
+        return '[]'
+
+    return '[\n  ' + item_separator.join(items) + '\n]'
+
+
+def prepare_serialized(
+        trimmed_history,
+        basal_schedule=None,
+        zero_datetime=None,
+        start_datetime=None,
+        end_datetime=None,
+        duration_hours=None,
+        processes=None,
+        hours_per_shard=24
+):
+    """Prepares pump history on a process pool, and returns it serialized as by openaps
+
+    The arguments are the same as PrepareHistory, and the output is identical to serializing its
+    records.
+
+    :param trimmed_history: A list of pump history events, in reverse-chronological order
+    :type trimmed_history: list(dict)
+    :param processes: The number of worker processes. Defaults to the number of CPUs.
+    :type processes: int|NoneType
+    :param hours_per_shard: The length of each shard, in hours from midnight. It must divide a day.
+    :type hours_per_shard: int
+    :return: A JSON string
+    :rtype: str
+
+    :raises ValueError: The shard length is not one of HOURS_PER_SHARD_CHOICES
+    """
+    _check_hours_per_shard(hours_per_shard)
+
+    reconciled_history = ReconcileHistory(CleanHistory(
+        trimmed_history,
+        start_datetime=start_datetime,
+        end_datetime=end_datetime,
+        duration_hours=duration_hours
+    ).clean_history).reconciled_history
+
+    slices = shard_slices(reconciled_history, hours_per_shard=hours_per_shard)
+    tasks = zip(slices, resolve_states(reconciled_history, slices))
+    worker_args = (reconciled_history, basal_schedule, zero_datetime)
+
+    if processes == 1 or len(tasks) < 2:
+        _set_up_worker(*worker_args)
+
+        try:
+            return _join_serialized([_prepare_shard(task) for task in tasks])
+        finally:
+            _set_up_worker(None, None, None)
+
+    # Forked workers inherit the history rather than receiving a copy of each shard
+    pool = multiprocessing.Pool(processes, initializer=_set_up_worker, initargs=worker_args)
+
+    try:
+        return _join_serialized(pool.imap(_prepare_shard, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    import json
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('infile', help='A JSON file of pump history, in reverse-chronological order')
+    parser.add_argument('--basal-profile', default=None, help='A file containing a basal profile')
+    parser.add_argument('--start', default=None, help='The initial timestamp of the history window')
+    parser.add_argument('--end', default=None, help='The final timestamp of the history window')
+    parser.add_argument('--duration', type=float, default=None, help='The length of the history window, in hours')
+    parser.add_argument('--processes', type=int, default=None, help='The number of worker processes')
+    parser.add_argument(
+        '--hours-per-shard',
+        type=int,
+        choices=HOURS_PER_SHARD_CHOICES,
+        default=24,
+        help='The length of each shard, in hours'
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.infile, 'r') as fp:
+        history = json.load(fp)
+
+    basal_schedule = None
+
+    if args.basal_profile:
+        with open(args.basal_profile, 'r') as fp:
+            basal_schedule = json.load(fp)
+
+    sys.stdout.write(prepare_serialized(
+        history,
+        basal_schedule=basal_schedule,
+        start_datetime=parse_timestamp(args.start) if args.start else None,
+        end_datetime=parse_timestamp(args.end) if args.end else None,
+        duration_hours=args.duration,
+        processes=args.processes,
+        hours_per_shard=args.hours_per_shard
+    ) + '\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""
+Columnar storage of records for analysis over long periods of history
+
+This module requires numpy, which can be installed with the `numpy` extra:
+
+    $ pip install openapscontrib.mmhistorytools[numpy]
+"""
+from datetime import datetime, timedelta
+from numbers import Number
+
+from dateutil.tz import tzutc
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .historytools import MAX_RESERVOIR_DROP_PER_MINUTE
+from .models import CompactRecord, TempBasal, Unit
+from .timestamps import parse_timestamp
+
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=tzutc())
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError(
+            "numpy is required for columnar records. "
+            "Install it with `pip install openapscontrib.mmhistorytools[numpy]`"
+        )
+
+
+def epoch_seconds(value):
+    """Returns the number of seconds represented by a record timestamp
+
+    :param value: A datetime, timestamp string, or the signed number of minutes from a zero time as
+    returned by NormalizeRecords
+    :type value: datetime|basestring|int
+    :return: Seconds since the Unix epoch, or since the zero time for relative timestamps.
+    Timezone-naive timestamps are treated as if they were UTC.
+    :rtype: float
+    """
+    if isinstance(value, Number):
+        return value * 60.0
+    elif not isinstance(value, datetime):
+        value = parse_timestamp(value)
+
+    if value.tzinfo is None:
+        return (value - EPOCH).total_seconds()
+    else:
+        return (value - EPOCH_UTC).total_seconds()
+
+
+class RecordTable(object):
+    """A table of records stored as one array per column
+
+    Columns:
+    - `start`, `end`: The record times, in seconds (see `epoch_seconds`)
+    - `amount`: The record amount
+    - `type_codes`, `unit_codes`: Indexes into `TYPES` and `UNITS`
+    """
+    TYPES = ("Bolus", "Meal", "TempBasal", "Exercise")
+    UNITS = (Unit.grams, Unit.percent_of_basal, Unit.units, Unit.units_per_hour, Unit.event)
+
+    def __init__(self, start, end, amount, type_codes, unit_codes):
+        """Initializes a new table from its columns
+
+        :param start: The record start times, in seconds
+        :type start: numpy.ndarray
+        :param end: The record end times, in seconds
+        :type end: numpy.ndarray
+        :param amount: The record amounts
+        :type amount: numpy.ndarray
+        :param type_codes: The record types, as indexes into `TYPES`
+        :type type_codes: numpy.ndarray
+        :param unit_codes: The record units, as indexes into `UNITS`
+        :type unit_codes: numpy.ndarray
+        """
+        _require_numpy()
+
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.amount = np.asarray(amount, dtype=np.float64)
+        self.type_codes = np.asarray(type_codes, dtype=np.int8)
+        self.unit_codes = np.asarray(unit_codes, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_records(cls, records):
+        """Creates a table from resolved or normalized records
+
+        :param records: A list of records, as returned by ResolveHistory or NormalizeRecords
+        :type records: list(dict|.models.CompactRecord)
+        :return: A new table
+        :rtype: RecordTable
+        """
+        _require_numpy()
+
+        count = len(records)
+        start = np.empty(count, dtype=np.float64)
+        end = np.empty(count, dtype=np.float64)
+        amount = np.empty(count, dtype=np.float64)
+        type_codes = np.empty(count, dtype=np.int8)
+        unit_codes = np.empty(count, dtype=np.int8)
+
+        type_index = {name: index for index, name in enumerate(cls.TYPES)}
+        unit_index = {name: index for index, name in enumerate(cls.UNITS)}
+
+        for index, record in enumerate(records):
+            if isinstance(record, CompactRecord):
+                record = record.to_dict()
+
+            start[index] = epoch_seconds(record["start_at"])
+            end[index] = epoch_seconds(record["end_at"])
+            amount[index] = record["amount"]
+            type_codes[index] = type_index[record["type"]]
+            unit_codes[index] = unit_index[record["unit"]]
+
+        return cls(start, end, amount, type_codes, unit_codes)
+
+    def mask(self, record_type=None, unit=None):
+        """Returns a boolean array selecting the records of a type and unit
+
+        :param record_type: The record type name to select, e.g. "Bolus"
+        :type record_type: str
+        :param unit: The unit to select, e.g. Unit.units
+        :type unit: str
+        :return: A boolean array
+        :rtype: numpy.ndarray
+        """
+        selected = np.ones(len(self), dtype=bool)
+
+        if record_type is not None:
+            selected &= self.type_codes == self.TYPES.index(record_type)
+        if unit is not None:
+            selected &= self.unit_codes == self.UNITS.index(unit)
+
+        return selected
+
+    def select(self, selected):
+        """Returns a new table of the records selected by a boolean array or index array"""
+        return RecordTable(
+            self.start[selected],
+            self.end[selected],
+            self.amount[selected],
+            self.type_codes[selected],
+            self.unit_codes[selected]
+        )
+
+    def insulin_in_intervals(self, edges):
+        """Returns the insulin delivered within each interval between consecutive edges
+
+        Records in Units are counted in the interval containing their start. Records in Units/hour
+        are spread evenly over their duration; for NormalizeRecords output with a basal schedule,
+        TempBasal amounts are relative to the scheduled basal. Records in Percent are ignored.
+
+        :param edges: The sorted interval boundaries, in seconds
+        :type edges: list(float)|numpy.ndarray
+        :return: An array of `len(edges) - 1` insulin amounts, in Units
+        :rtype: numpy.ndarray
+        """
+        edges = np.asarray(edges, dtype=np.float64)
+        origin = edges[0]
+
+        totals = self._sum_at_start_in_intervals(self.unit_codes == self.UNITS.index(Unit.units), edges)
+
+        rates = self.unit_codes == self.UNITS.index(Unit.units_per_hour)
+        delivered = _cumulative_rate_delivery(
+            self.start[rates] - origin,
+            self.end[rates] - origin,
+            self.amount[rates] / 3600.0,
+            edges - origin
+        )
+
+        return totals + np.diff(delivered)
+
+    def carbs_in_intervals(self, edges):
+        """Returns the carbohydrates entered within each interval between consecutive edges
+
+        Records in grams are counted in the interval containing their start.
+
+        :param edges: The sorted interval boundaries, in seconds
+        :type edges: list(float)|numpy.ndarray
+        :return: An array of `len(edges) - 1` carbohydrate amounts, in grams
+        :rtype: numpy.ndarray
+        """
+        return self._sum_at_start_in_intervals(
+            self.unit_codes == self.UNITS.index(Unit.grams),
+            np.asarray(edges, dtype=np.float64)
+        )
+
+    def _sum_at_start_in_intervals(self, selected, edges):
+        """Sums the amounts of the selected records by the interval containing their start"""
+        origin = edges[0]
+        start = self.start[selected] - origin
+        in_range = (start >= 0) & (start < edges[-1] - origin)
+        bins = np.searchsorted(edges - origin, start[in_range], side='right') - 1
+
+        # Without any weights, bincount counts in integers
+        return np.bincount(
+            bins,
+            weights=self.amount[selected][in_range],
+            minlength=len(edges) - 1
+        )[:len(edges) - 1].astype(np.float64)
+
+    def total_insulin(self, start=None, end=None):
+        """Returns the insulin delivered between two times
+
+        :param start: The start of the interval, in seconds. Defaults to the earliest record start.
+        :type start: float
+        :param end: The end of the interval, in seconds. Defaults to the latest record end.
+        :type end: float
+        :return: The insulin delivered, in Units
+        :rtype: float
+        """
+        if len(self) == 0:
+            return 0.0
+
+        if start is None:
+            start = self.start.min()
+        if end is None:
+            # Include boluses given at the final instant
+            end = np.nextafter(max(self.end.max(), self.start.max()), np.inf)
+
+        return float(self.insulin_in_intervals([start, end])[0])
+
+
+def _cumulative_rate_delivery(start, end, rate, times):
+    """Returns the total delivered by constant-rate records up to each time
+
+    Each record delivers `rate` per second between `start` and `end`, so its delivery up to `t` is
+    `rate * (t - start)` for starts before `t`, less `rate * (t - end)` for ends before `t`.
+    """
+    def integral(boundaries):
+        order = np.argsort(boundaries)
+        sorted_boundaries = boundaries[order]
+        rate_sums = np.concatenate(([0.0], np.cumsum(rate[order])))
+        weighted_sums = np.concatenate(([0.0], np.cumsum(rate[order] * sorted_boundaries)))
+        counts = np.searchsorted(sorted_boundaries, times, side='right')
+
+        return times * rate_sums[counts] - weighted_sums[counts]
+
+    return integral(start) - integral(end)
+
+
+def aggregate(records, bucket_minutes=5.0, hours=None):
+    """Sums the insulin and carbohydrates of normalized records into fixed-width time buckets
+
+    Bucket edges are multiples of the width from the epoch, or from the zero time of records
+    normalized with a `zero_datetime`. The buckets end after the latest record, and begin with the
+    earliest record, or `hours` before the end.
+
+    Insulin is counted as by `RecordTable.insulin_in_intervals`: boluses by their start, and square
+    boluses and TempBasal net rates spread evenly over their duration. TempBasal records are only
+    counted once normalized with a basal schedule. Meal carbohydrates are counted by their start.
+
+    :param records: A list of records, as returned by NormalizeRecords
+    :type records: list(dict)
+    :param bucket_minutes: The width of each bucket, in minutes
+    :type bucket_minutes: float
+    :param hours: The length of time to aggregate, in hours, or None to include every record
+    :type hours: float|NoneType
+    :return: The buckets in chronological order, each a dictionary with `start_at` and `end_at` in
+    the format of the record times, `insulin` in Units and `carbs` in grams
+    :rtype: list(dict)
+    """
+    _require_numpy()
+
+    if len(records) == 0:
+        return []
+
+    table = RecordTable.from_records(records)
+    width = bucket_minutes * 60.0
+
+    # The end is past the latest record, so a bolus at the latest time falls in the last bucket
+    end = (np.floor(max(table.end.max(), table.start.max()) / width) + 1) * width
+
+    if hours is None:
+        count = int(round((end - np.floor(table.start.min() / width) * width) / width))
+    else:
+        count = int(np.ceil(hours * 3600.0 / width))
+
+    edges = end - width * np.arange(count, -1, -1, dtype=np.float64)
+    format_time = _time_formatter(records[0]["start_at"])
+
+    return [
+        dict(start_at=format_time(start), end_at=format_time(stop), insulin=insulin, carbs=carbs)
+        for start, stop, insulin, carbs in zip(
+            edges[:-1].tolist(),
+            edges[1:].tolist(),
+            table.insulin_in_intervals(edges).tolist(),
+            table.carbs_in_intervals(edges).tolist()
+        )
+    ]
+
+
+def _time_formatter(value):
+    """Returns a function converting seconds from `epoch_seconds` back to the format of a record time"""
+    if isinstance(value, Number):
+        return _relative_minutes
+
+    if not isinstance(value, datetime):
+        value = parse_timestamp(value)
+
+    epoch = EPOCH if value.tzinfo is None else EPOCH_UTC
+
+    return lambda seconds: (epoch + timedelta(seconds=seconds)).isoformat()
+
+
+def _relative_minutes(seconds):
+    # Whole minutes are integers, as from NormalizeRecords, unless the bucket width is fractional
+    minutes = round(seconds / 60.0, 6)
+
+    return int(minutes) if minutes == int(minutes) else minutes
+
+
+def convert_reservoir_history_to_temp_basal(history, as_table=False):
+    """Converts a history of reservoir values to TempBasal records using array operations
+
+    The vectorized equivalent of `historytools.convert_reservoir_history_to_temp_basal`, applying
+    the same plausibility filter on the volume drop between readings.
+
+    :param history: The history of reservoir values, in chronological order
+    :type history: list(dict)
+    :param as_table: Whether to return a RecordTable instead of a list of TempBasal records
+    :type as_table: bool
+    :return: The resolved TempBasal doses, in reverse-chronological order
+    :rtype: list(.models.TempBasal)|RecordTable
+    """
+    _require_numpy()
+
+    datetimes = [parse_timestamp(entry['date']) for entry in history]
+
+    # Elapsed time is measured in whole microseconds, matching timedelta.total_seconds()
+    microseconds = np.array(
+        [_epoch_microseconds(entry_datetime) for entry_datetime in datetimes],
+        dtype=np.int64
+    )
+    amounts = np.array([entry['amount'] for entry in history], dtype=np.float64)
+
+    volume_drops = amounts[:-1] - amounts[1:]
+    minutes_elapsed = np.diff(microseconds) / 1e6 / 60.0
+
+    plausible = (volume_drops >= 0) & (volume_drops <= MAX_RESERVOIR_DROP_PER_MINUTE * minutes_elapsed)
+
+    if np.any(minutes_elapsed[plausible] == 0):
+        raise ZeroDivisionError("Reservoir history contains repeated timestamps")
+
+    indexes = np.flatnonzero(plausible)[::-1]
+    rates = volume_drops[indexes] * 60.0 / minutes_elapsed[indexes]
+
+    if as_table:
+        return RecordTable(
+            microseconds[indexes] / 1e6,
+            microseconds[indexes + 1] / 1e6,
+            rates,
+            np.full(len(indexes), RecordTable.TYPES.index("TempBasal"), dtype=np.int8),
+            np.full(len(indexes), RecordTable.UNITS.index(Unit.units_per_hour), dtype=np.int8)
+        )
+
+    return [
+        TempBasal(
+            start_at=datetimes[index],
+            end_at=datetimes[index + 1],
+            amount=float(rate),
+            unit=Unit.units_per_hour,
+            # Formatted from the original values, so integer amounts print as they do iteratively
+            description='Reservoir decreased {}U over {:.2f}min'.format(
+                history[index]['amount'] - history[index + 1]['amount'],
+                float(minutes_elapsed[index])
+            )
+        ) for index, rate in zip(indexes.tolist(), rates)
+    ]
+
+
+def _epoch_microseconds(value):
+    delta = value - (EPOCH if value.tzinfo is None else EPOCH_UTC)
+
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from datetime import datetime
+import re
+import threading
+
+from dateutil import parser
+
+
+ISO_8601_PATTERN = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?$'
+)
+
+
+def parse_iso_8601(value):
+    """Parses a strict, timezone-naive ISO-8601 timestamp without using dateutil
+
+    :param value: The timestamp string to parse, e.g. "2015-06-19T23:04:25"
+    :type value: basestring
+    :return: A datetime object, or None if the string isn't in the strict format
+    :rtype: datetime.datetime|NoneType
+
+    :raises ValueError: The string matches the format but describes an invalid date
+    """
+    match = ISO_8601_PATTERN.match(value)
+
+    if match is not None:
+        year, month, day, hour, minute, second, fraction = match.groups()
+
+        return datetime(
+            int(year),
+            int(month),
+            int(day),
+            int(hour),
+            int(minute),
+            int(second),
+            int(fraction.ljust(6, '0')) if fraction else 0
+        )
+
+
+# Two defaults differing in every date component, by which dateutil completes a partial timestamp.
+# The first is unlikely, so a complete timestamp rarely needs the second parse to tell it apart.
+_PARTIAL_DEFAULTS = (datetime(1904, 7, 3), datetime(2000, 1, 1))
+
+
+def _parse_with_dateutil(value):
+    """Parses a timestamp string with dateutil, detecting whether it omits part of its date
+
+    :param value: The timestamp string to parse
+    :type value: basestring
+    :return: The parsed datetime, and whether it depends on the current date
+    :rtype: tuple(datetime.datetime, bool)
+
+    :raises ValueError: The value could not be parsed as a timestamp
+    """
+    default = _PARTIAL_DEFAULTS[0]
+    parsed = parser.parse(value, default=default)
+
+    # Only a date component equal to the default's might have been filled from it
+    if parsed.year != default.year and parsed.month != default.month and parsed.day != default.day:
+        return parsed, False
+
+    if parsed == parser.parse(value, default=_PARTIAL_DEFAULTS[1]):
+        return parsed, False
+
+    return parser.parse(value), True
+
+
+def is_partial_timestamp(value):
+    """Returns whether a timestamp string omits part of its date
+
+    dateutil fills the missing parts of a timestamp like "12:00" or "June 19" from the current
+    date, so it describes a different time depending on the day it's parsed.
+
+    :param value: The timestamp string to check
+    :type value: basestring
+    :return: True if the value parses to a time which depends on the current date
+    :rtype: bool
+
+    :raises ValueError: The value could not be parsed as a timestamp
+    """
+    if ISO_8601_PATTERN.match(value) is not None:
+        return False
+
+    return _parse_with_dateutil(value)[1]
+
+
+class TimestampCache(object):
+    """A bounded, least-recently-used cache of parsed timestamp strings
+
+    History passes parse the same timestamps repeatedly, both within a pass and across the passes
+    chained by the `prepare` command. Strict ISO-8601 strings are parsed directly; anything else
+    falls back to `dateutil.parser.parse`. Only successful parses are cached, and not those of
+    partial timestamps, which a long-lived process would otherwise resolve against an earlier day.
+
+    The cache can be shared by passes running on several threads, such as those of an executor.
+    """
+    def __init__(self, maxsize=8192):
+        """Initializes a new, empty cache
+
+        :param maxsize: The maximum number of timestamps to retain
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._datetimes_by_value = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._datetimes_by_value)
+
+    def parse(self, value):
+        """Returns the datetime described by a timestamp string
+
+        :param value: The timestamp string to parse
+        :type value: basestring
+        :return: The parsed datetime
+        :rtype: datetime.datetime
+
+        :raises ValueError: The value could not be parsed as a timestamp
+        """
+        if not isinstance(value, basestring):
+            return parser.parse(value)
+
+        cache = self._datetimes_by_value
+
+        with self._lock:
+            try:
+                parsed = cache.pop(value)
+            except KeyError:
+                self.misses += 1
+            else:
+                self.hits += 1
+                cache[value] = parsed
+
+                return parsed
+
+        # Parsed outside the lock, so other threads can use the cache meanwhile
+        parsed = parse_iso_8601(value)
+        if parsed is None:
+            parsed, is_partial = _parse_with_dateutil(value)
+
+            if is_partial:
+                return parsed
+
+        with self._lock:
+            # Another thread might have parsed the same value
+            cache.pop(value, None)
+
+            if len(cache) >= self.maxsize:
+                cache.popitem(last=False)
+
+            cache[value] = parsed
+
+        return parsed
+
+    def info(self):
+        """Returns the cache statistics
+
+        :return: A dictionary of hit and miss counts and sizes
+        :rtype: dict
+        """
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            size=len(self),
+            maxsize=self.maxsize
+        )
+
+    def clear(self):
+        """Removes all cached timestamps and resets the statistics"""
+        with self._lock:
+            self._datetimes_by_value.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+# The cache shared by every history pass
+timestamp_cache = TimestampCache()
+
+
+def parse_timestamp(value):
+    """Parses a timestamp string using the shared cache
+
+    :param value: The timestamp string to parse
+    :type value: basestring
+    :return: The parsed datetime
+    :rtype: datetime.datetime
+
+    :raises ValueError: The value could not be parsed as a timestamp
+    """
+    return timestamp_cache.parse(value)
@@ -32,9 +32,15 @@ setup(
         'Topic :: Utilities',
     ],
     platforms='any',
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     include_package_data=True,
     install_requires=requires,
+    extras_require={
+        'numpy': ['numpy'],
+        # ijson 3 doesn't support Python 2, where ijson 2 is used instead
+        'stream': ['ijson>=3.1; python_version >= "3"', 'ijson<3; python_version < "3"'],
+        'asyncio:python_version < "3.4"': ['trollius']
+    },
     namespace_packages=['openapscontrib'],
     test_suite="tests"
 )
@@ -0,0 +1,160 @@
+from copy import deepcopy
+import json
+import os
+import sys
+import unittest
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+from .synthetic import SyntheticHistory
+from openapscontrib.mmhistorytools import aio
+from openapscontrib.mmhistorytools.aio import HistoryPipeline, StageTimeoutError
+from openapscontrib.mmhistorytools.historytools import PrepareHistory
+from openapscontrib.mmhistorytools.timestamps import timestamp_cache
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+@unittest.skipIf(aio.asyncio is None, "asyncio is not installed")
+class HistoryPipelineTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/basal.json")) as fp:
+            cls.basal_rate_schedule = json.load(fp)
+
+        cls.history = list(SyntheticHistory().iter_pump_history(hours=24 * 7))
+
+    def setUp(self):
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def prepare(self, **kwargs):
+        pipeline = HistoryPipeline(self.loop, **kwargs)
+
+        return pipeline.prepare(deepcopy(self.history), basal_schedule=self.basal_rate_schedule)
+
+    def test_prepare(self):
+        expected = PrepareHistory(
+            deepcopy(self.history),
+            basal_schedule=self.basal_rate_schedule
+        ).prepared_records
+
+        self.assertListEqual(expected, self.loop.run_until_complete(self.prepare()))
+        self.assertListEqual(expected, self.loop.run_until_complete(self.prepare(cooperative=True)))
+
+    def test_cooperative_passes_yield_to_the_loop(self):
+        ticks = []
+
+        def tick():
+            ticks.append(self.loop.time())
+
+            if not future.done():
+                self.loop.call_soon(tick)
+
+        future = self.prepare(cooperative=True, events_per_step=50)
+        self.loop.call_soon(tick)
+        self.loop.run_until_complete(future)
+
+        # The history is about 1,400 events
+        self.assertGreater(len(ticks), 50)
+
+    def test_timeout(self):
+        future = self.prepare(cooperative=True, events_per_step=1, timeouts={'normalize': 0.001})
+
+        with self.assertRaises(StageTimeoutError) as context:
+            self.loop.run_until_complete(future)
+
+        self.assertEqual('normalize', context.exception.stage)
+
+    def test_cancel(self):
+        future = self.prepare(cooperative=True, events_per_step=1)
+        self.loop.call_later(0.01, future.cancel)
+
+        with self.assertRaises(aio.asyncio.CancelledError):
+            self.loop.run_until_complete(future)
+
+    def test_read_history(self):
+        reader = aio.asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(json.dumps(self.history).encode('utf-8'))
+        reader.feed_eof()
+
+        for cooperative in (False, True):
+            pipeline = HistoryPipeline(self.loop, cooperative=cooperative)
+            history = self.loop.run_until_complete(pipeline.read_history(reader, chunk_size=4096))
+
+            self.assertListEqual(self.history, history)
+
+            reader = aio.asyncio.StreamReader(loop=self.loop)
+            reader.feed_data(json.dumps(self.history).encode('utf-8'))
+            reader.feed_eof()
+
+    def test_cooperative_read_yields_to_the_loop(self):
+        data = json.dumps(self.history).encode('utf-8')
+        reader = aio.asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(data)
+        reader.feed_eof()
+        ticks = []
+
+        def tick():
+            ticks.append(self.loop.time())
+
+            if not future.done():
+                self.loop.call_soon(tick)
+
+        # A single chunk, so that the ticks are while decoding rather than reading
+        future = HistoryPipeline(self.loop, cooperative=True, events_per_step=50).read_history(
+            reader, chunk_size=len(data)
+        )
+        self.loop.call_soon(tick)
+
+        self.assertListEqual(self.history, self.loop.run_until_complete(future))
+        self.assertGreater(len(ticks), len(self.history) // 50 - 5)
+
+    @unittest.skipIf(ThreadPoolExecutor is None, "concurrent.futures is not installed")
+    def test_concurrent_prepare(self):
+        histories = [list(SyntheticHistory(seed=seed).iter_pump_history(hours=24 * 3)) for seed in range(4)]
+        expected = [
+            PrepareHistory(deepcopy(history), basal_schedule=self.basal_rate_schedule).prepared_records
+            for history in histories
+        ]
+
+        # Switching threads often, with a small cache, makes any race on the shared caches likely
+        maxsize = timestamp_cache.maxsize
+        timestamp_cache.maxsize = 64
+        timestamp_cache.clear()
+
+        if hasattr(sys, 'getswitchinterval'):
+            interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+        else:
+            interval = sys.getcheckinterval()
+            sys.setcheckinterval(1)
+
+        executor = ThreadPoolExecutor(max_workers=len(histories))
+
+        try:
+            pipeline = HistoryPipeline(self.loop, executor=executor)
+            futures = [
+                pipeline.prepare(deepcopy(history), basal_schedule=self.basal_rate_schedule)
+                for history in histories
+            ]
+
+            results = self.loop.run_until_complete(aio.asyncio.gather(*futures))
+        finally:
+            executor.shutdown()
+            timestamp_cache.maxsize = maxsize
+
+            if hasattr(sys, 'setswitchinterval'):
+                sys.setswitchinterval(interval)
+            else:
+                sys.setcheckinterval(interval)
+
+        self.assertListEqual(expected, results)
+        self.assertEqual(len(timestamp_cache), len(list(timestamp_cache._datetimes_by_value)))
@@ -0,0 +1,85 @@
+from StringIO import StringIO
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.mmhistorytools.batch import load_manifest, run
+from openapscontrib.mmhistorytools.historytools import PrepareHistory
+from openapscontrib.mmhistorytools.historytools import convert_reservoir_history_to_temp_basal
+from openapscontrib.mmhistorytools.service import serialize
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+def load_fixture(path):
+    with open(get_file_at_path(path)) as fp:
+        return json.load(fp)
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_directory = os.path.join(self.directory, 'output')
+        self.manifest_path = os.path.join(self.directory, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_output(self, name, filename):
+        with open(os.path.join(self.output_directory, name, filename)) as fp:
+            return fp.read()
+
+    def test_run(self):
+        fixtures = os.path.relpath(get_file_at_path('fixtures'), self.directory)
+
+        with open(self.manifest_path, 'w') as fp:
+            json.dump([
+                dict(
+                    name='suspend',
+                    history=os.path.join(fixtures, 'temp_basal_suspend.json'),
+                    basal_profile=os.path.join(fixtures, 'basal.json')
+                ),
+                dict(
+                    name='reservoir',
+                    reservoir=os.path.join(fixtures, 'reservoir_history_with_rewind_and_prime_input.json')
+                ),
+                dict(
+                    name='missing',
+                    history=os.path.join(fixtures, 'missing.json')
+                )
+            ], fp)
+
+        stream = StringIO()
+        summary = run(load_manifest(self.manifest_path), self.output_directory, processes=2, stream=stream)
+
+        self.assertEqual(3, summary['tasks'])
+        self.assertEqual(1, summary['failures'])
+
+        failure, = [result for result in summary['results'] if result['error'] is not None]
+        self.assertEqual('missing', failure['name'])
+        self.assertIn('failed', stream.getvalue())
+
+        self.assertEqual(
+            serialize(PrepareHistory(
+                load_fixture('fixtures/temp_basal_suspend.json'),
+                basal_schedule=load_fixture('fixtures/basal.json')
+            ).prepared_records),
+            self.read_output('suspend', 'prepared_history.json')
+        )
+        self.assertEqual(
+            serialize(convert_reservoir_history_to_temp_basal(
+                load_fixture('fixtures/reservoir_history_with_rewind_and_prime_input.json')
+            )),
+            self.read_output('reservoir', 'resolved_reservoir.json')
+        )
+
+    def test_repeated_name(self):
+        with open(self.manifest_path, 'w') as fp:
+            json.dump([dict(name='a'), dict(name='a')], fp)
+
+        with self.assertRaises(ValueError):
+            load_manifest(self.manifest_path)
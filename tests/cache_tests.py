@@ -0,0 +1,94 @@
+from argparse import ArgumentParser
+from datetime import datetime, time, timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.mmhistorytools import normalize
+from openapscontrib.mmhistorytools.cache import OutputCache, cache_key
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class OutputCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_directory = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lru_eviction(self):
+        cache = OutputCache(self.cache_directory, max_entries=2)
+
+        cache.set('a', [1])
+        cache.set('b', [2])
+        os.utime(os.path.join(self.cache_directory, 'a.json'), (0, 0))
+        os.utime(os.path.join(self.cache_directory, 'b.json'), (1, 1))
+
+        # Reading marks an entry as recently used
+        self.assertListEqual([1], cache.get('a'))
+        cache.set('c', [3])
+
+        self.assertIsNone(cache.get('b'))
+        self.assertListEqual([1], cache.get('a'))
+        self.assertListEqual([3], cache.get('c'))
+
+    def test_key(self):
+        infile = os.path.join(self.directory, 'history.json')
+
+        with open(infile, 'w') as fp:
+            fp.write('[]')
+
+        key = cache_key('normalize', dict(infile=infile, profile=True), ignored_params=('profile',))
+
+        self.assertEqual(key, cache_key('normalize', dict(infile=infile), ignored_params=('profile',)))
+        self.assertNotEqual(key, cache_key('resolve', dict(infile=infile)))
+        self.assertNotEqual(key, cache_key('normalize', dict(infile=infile, zero_at='2015-01-01')))
+        self.assertIsNone(cache_key('normalize', dict(infile='-')))
+
+        with open(infile, 'w') as fp:
+            fp.write('[ ]')
+
+        self.assertNotEqual(key, cache_key('normalize', dict(infile=infile)))
+
+    def test_partial_timestamp_key(self):
+        infile = os.path.join(self.directory, 'history.json')
+
+        with open(infile, 'w') as fp:
+            fp.write('[]')
+
+        noon = datetime.combine(datetime.now().date(), time(12))
+
+        def key(zero_at):
+            return cache_key(
+                'normalize',
+                dict(infile=infile, zero_at=zero_at),
+                timestamp_params=('zero_at',)
+            )
+
+        self.assertEqual(key('12:00'), key(noon.isoformat()))
+        self.assertNotEqual(key('12:00'), key((noon - timedelta(days=1)).isoformat()))
+
+    def test_command_output(self):
+        use = normalize.__new__(normalize)
+        parser = ArgumentParser()
+        use.configure_app(None, parser)
+        args = parser.parse_args([
+            get_file_at_path('fixtures/normalize_edge_case_doses_input.json'),
+            '--basal-profile', get_file_at_path('fixtures/basal.json'),
+            '--cache', self.cache_directory
+        ])
+
+        output = use.main(args, None)
+        key = use.get_cache_key(use.get_params(args))
+
+        self.assertListEqual(output, OutputCache(self.cache_directory).get(key))
+
+        # A hit is returned without running the command
+        OutputCache(self.cache_directory).set(key, ['cached'])
+        self.assertListEqual(['cached'], use.main(args, None))
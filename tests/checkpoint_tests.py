@@ -0,0 +1,116 @@
+from copy import deepcopy
+from datetime import timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from .synthetic import SyntheticHistory
+from openapscontrib.mmhistorytools.checkpoint import PrepareCheckpoint
+from openapscontrib.mmhistorytools.historytools import PrepareHistory
+from openapscontrib.mmhistorytools.timestamps import parse_timestamp
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class PrepareCheckpointTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/basal.json")) as fp:
+            cls.basal_rate_schedule = json.load(fp)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertCyclesEqualFullRuns(self, history, cycle_ends, window=None, **kwargs):
+        for end_datetime in cycle_ends:
+            cycle_history = [
+                event for event in history
+                if parse_timestamp(event["timestamp"]) <= end_datetime and
+                (window is None or parse_timestamp(event["timestamp"]) > end_datetime - window)
+            ]
+
+            # Reconciliation modifies the history events, so each run needs its own copy
+            expected = PrepareHistory(
+                deepcopy(cycle_history),
+                basal_schedule=self.basal_rate_schedule,
+                **kwargs
+            ).prepared_records
+            actual = PrepareCheckpoint(self.path).prepare(
+                deepcopy(cycle_history),
+                basal_schedule=self.basal_rate_schedule,
+                **kwargs
+            )
+
+            self.assertListEqual(expected, actual, end_datetime)
+
+    def test_fixtures(self):
+        for fixture in (
+            "fixtures/bolus_wizard_duplicates.json",
+            "fixtures/square_bolus.json",
+            "fixtures/square_bolus_cancel.json",
+            "fixtures/temp_basal_cancel.json",
+            "fixtures/temp_basal_suspend.json",
+        ):
+            with open(get_file_at_path(fixture)) as fp:
+                history = json.load(fp)
+
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+            cycle_ends = sorted(set(parse_timestamp(event["timestamp"]) for event in history))
+
+            self.assertCyclesEqualFullRuns(history, cycle_ends)
+
+    def test_synthetic_history(self):
+        generator = SyntheticHistory(seed=3)
+        generator.suspend_probability = 0.02
+        generator.square_bolus_probability = 0.05
+        history = list(generator.iter_pump_history(hours=12))
+
+        start_datetime = generator.end_datetime - timedelta(hours=10)
+        cycle_ends = [start_datetime + timedelta(minutes=5 * cycle) for cycle in range(121)]
+
+        self.assertCyclesEqualFullRuns(history, cycle_ends)
+
+    def test_processes_only_new_events(self):
+        history = list(SyntheticHistory().iter_pump_history(hours=6))
+        checkpoint = PrepareCheckpoint(self.path)
+        checkpoint.prepare(deepcopy(history[10:]), basal_schedule=self.basal_rate_schedule)
+
+        boundary = parse_timestamp(checkpoint.state["boundary"])
+        self.assertGreater(boundary, parse_timestamp(history[-1]["timestamp"]))
+
+        events = PrepareCheckpoint(self.path)._events_since(history, boundary)
+        self.assertLess(len(events), 30)
+        self.assertListEqual(history[:len(events)], events)
+
+    def test_basal_schedule_change_runs_in_full(self):
+        history = list(SyntheticHistory().iter_pump_history(hours=6))
+        PrepareCheckpoint(self.path).prepare(deepcopy(history), basal_schedule=self.basal_rate_schedule)
+
+        basal_schedule = deepcopy(self.basal_rate_schedule)
+        basal_schedule[0]["rate"] += 0.5
+
+        self.assertListEqual(
+            PrepareHistory(deepcopy(history), basal_schedule=basal_schedule).prepared_records,
+            PrepareCheckpoint(self.path).prepare(deepcopy(history), basal_schedule=basal_schedule)
+        )
+
+    def test_moving_window(self):
+        generator = SyntheticHistory(seed=5)
+        generator.suspend_probability = 0.02
+        generator.square_bolus_probability = 0.05
+        history = list(generator.iter_pump_history(hours=12))
+
+        start_datetime = generator.end_datetime - timedelta(hours=6)
+        cycle_ends = [start_datetime + timedelta(minutes=5 * cycle) for cycle in range(73)]
+
+        self.assertCyclesEqualFullRuns(history, cycle_ends, window=timedelta(hours=4))
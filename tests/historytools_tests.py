@@ -1,3 +1,4 @@
+from copy import deepcopy
 from datetime import date, datetime, timedelta
 from dateutil import parser
 import json
@@ -7,11 +8,14 @@ import unittest
 from openapscontrib.mmhistorytools.historytools import AppendDoseToHistory
 from openapscontrib.mmhistorytools.historytools import CleanHistory
 from openapscontrib.mmhistorytools.historytools import NormalizeRecords
+from openapscontrib.mmhistorytools.historytools import PrepareHistory
 from openapscontrib.mmhistorytools.historytools import ReconcileHistory
 from openapscontrib.mmhistorytools.historytools import ResolveHistory
 from openapscontrib.mmhistorytools.historytools import TrimHistory
 from openapscontrib.mmhistorytools.historytools import convert_reservoir_history_to_temp_basal
-from openapscontrib.mmhistorytools.models import Bolus, Meal, TempBasal, Exercise
+from openapscontrib.mmhistorytools.historytools import iter_clean, iter_normalize, iter_reconcile
+from openapscontrib.mmhistorytools.historytools import iter_resolve, iter_trim
+from openapscontrib.mmhistorytools.models import Bolus, Meal, TempBasal, Exercise, CompactRecord
 
 
 def get_file_at_path(path):
@@ -230,6 +234,52 @@ class TrimHistoryTestCase(unittest.TestCase):
             [event['_description'] for event in h.trimmed_history]
         )
 
+    def test_trim_sorted_matches_full_scan(self):
+        with open(get_file_at_path('fixtures/temp_basal_suspend.json')) as fp:
+            pump_history = json.load(fp)
+
+        end_datetime = parser.parse(pump_history[0]['timestamp'])
+
+        for minutes in range(0, 24 * 60, 7):
+            window = dict(
+                start_datetime=end_datetime - timedelta(minutes=minutes + 60),
+                end_datetime=end_datetime - timedelta(minutes=minutes)
+            )
+
+            for validate_sorted in (False, True):
+                self.assertListEqual(
+                    TrimHistory(pump_history, **window).trimmed_history,
+                    TrimHistory(
+                        pump_history,
+                        sorted_history=True,
+                        validate_sorted=validate_sorted,
+                        **window
+                    ).trimmed_history
+                )
+
+    def test_trim_sorted_validation_fallback(self):
+        window = dict(
+            start_datetime=datetime(2015, 06, 19, 21, 32),
+            end_datetime=datetime(2015, 06, 19, 22),
+            sorted_tolerance=timedelta(0)
+        )
+
+        h = TrimHistory(self.pump_history, sorted_history=True, validate_sorted=True, **window)
+
+        self.assertListEqual(TrimHistory(self.pump_history, **window).trimmed_history, h.trimmed_history)
+
+    def test_trim_sorted_unparseable_fallback(self):
+        pump_history = self.pump_history[:4] + [{'_type': 'Unknown'}] + self.pump_history[4:]
+
+        h = TrimHistory(
+            pump_history,
+            start_datetime=datetime(2015, 06, 19, 23),
+            end_datetime=datetime(2015, 06, 20),
+            sorted_history=True
+        )
+
+        self.assertDictEqual({'_type': 'Unknown'}, h.trimmed_history[-1])
+
 
 class CleanHistoryTestCase(unittest.TestCase):
     def test_duplicate_bolus_wizard_carbs(self):
@@ -720,6 +770,45 @@ class ReconcileHistoryTestCase(unittest.TestCase):
                                                                            "PumpResume")]
         )
 
+    def test_suspended_temp_basal_replaced(self):
+        with open(get_file_at_path("fixtures/temp_basal_suspend.json")) as fp:
+            pump_history = json.load(fp)
+
+        # A new temp basal replaces the one restarted after the PumpResume at 15:00:02
+        pump_history[0:0] = [
+            {
+                "_type": "TempBasalDuration",
+                "duration (min)": 30,
+                "timestamp": "2015-06-13T15:10:00"
+            },
+            {
+                "_type": "TempBasal",
+                "temp": "percent",
+                "rate": 50,
+                "timestamp": "2015-06-13T15:10:00"
+            }
+        ]
+
+        h = ReconcileHistory(pump_history)
+        durations = [
+            (event["timestamp"], event["duration (min)"])
+            for event in h.reconciled_history if event["_type"] == "TempBasalDuration"
+        ]
+
+        self.assertEqual(("2015-06-13T15:10:00", 30), durations[0])
+        self.assertEqual("2015-06-13T15:00:02", durations[1][0])
+        self.assertAlmostEqual(598 / 60.0, durations[1][1])
+        self.assertEqual(("2015-06-13T14:37:58", 16.35), durations[2])
+
+        records = ResolveHistory(h.reconciled_history).resolved_records
+        temp_basals = sorted(
+            (record for record in records if record["type"] == "TempBasal"),
+            key=lambda record: record["start_at"]
+        )
+
+        for record, next_record in zip(temp_basals, temp_basals[1:]):
+            self.assertLessEqual(record["end_at"], next_record["start_at"])
+
 
 class ResolveHistoryTestCase(unittest.TestCase):
     def test_resolve(self):
@@ -1124,6 +1213,118 @@ class NormalizeRecordsTestCase(BasalScheduleTestCase):
 
         self.assertListEqual(expected_output, records)
 
+    def test_sweep_line(self):
+        for fixture in (
+            'fixtures/reservoir_history_with_rewind_and_prime_output.json',
+            'fixtures/normalize_edge_case_doses_input.json',
+        ):
+            with open(get_file_at_path(fixture)) as fp:
+                resolved_records = json.load(fp)
+
+            self.assertListEqual(
+                NormalizeRecords(deepcopy(resolved_records), self.basal_rate_schedule).normalized_records,
+                NormalizeRecords(
+                    deepcopy(resolved_records),
+                    self.basal_rate_schedule,
+                    sweep_line=True
+                ).normalized_records
+            )
+
+    def test_net_basal_timeline(self):
+        resolved_records = [
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 3, 30),
+                end_at=datetime(2015, 1, 1, 4, 30),
+                amount=1.5,
+                unit="U/hour"
+            ),
+            Bolus(
+                start_at=datetime(2015, 1, 1, 3),
+                end_at=datetime(2015, 1, 1, 3),
+                amount=1.0,
+                unit="U"
+            ),
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 2),
+                end_at=datetime(2015, 1, 1, 3),
+                amount=0,
+                unit="percent"
+            ),
+        ]
+
+        normalize = NormalizeRecords(resolved_records, self.basal_rate_schedule, sweep_line=True)
+
+        self.assertListEqual(
+            [
+                {"start_at": "2015-01-01T02:00:00", "end_at": "2015-01-01T03:00:00", "amount": -0.9},
+                {"start_at": "2015-01-01T03:00:00", "end_at": "2015-01-01T03:30:00", "amount": 0},
+                {"start_at": "2015-01-01T03:30:00", "end_at": "2015-01-01T04:00:00", "amount": 0.6},
+                {"start_at": "2015-01-01T04:00:00", "end_at": "2015-01-01T04:30:00", "amount": 0.575},
+            ],
+            normalize.net_basal_timeline()
+        )
+
+    def test_net_basal_timeline_overlapping_records(self):
+        # A temp basal resumed after a suspend, which a later temp basal replaces
+        resolved_records = [
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 3, 20),
+                end_at=datetime(2015, 1, 1, 3, 25),
+                amount=0.9,
+                unit="U/hour"
+            ),
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 3, 10),
+                end_at=datetime(2015, 1, 1, 3, 35),
+                amount=1.5,
+                unit="U/hour"
+            ),
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 3),
+                end_at=datetime(2015, 1, 1, 3, 10),
+                amount=0,
+                unit="percent"
+            ),
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 2, 50),
+                end_at=datetime(2015, 1, 1, 3, 0),
+                amount=1.5,
+                unit="U/hour"
+            ),
+        ]
+
+        normalize = NormalizeRecords(resolved_records, self.basal_rate_schedule, sweep_line=True)
+
+        self.assertListEqual(
+            [
+                {"start_at": "2015-01-01T02:50:00", "end_at": "2015-01-01T03:00:00", "amount": 0.6},
+                {"start_at": "2015-01-01T03:00:00", "end_at": "2015-01-01T03:10:00", "amount": -0.9},
+                {"start_at": "2015-01-01T03:10:00", "end_at": "2015-01-01T03:20:00", "amount": 0.6},
+                {"start_at": "2015-01-01T03:20:00", "end_at": "2015-01-01T03:25:00", "amount": 0.0},
+            ],
+            normalize.net_basal_timeline()
+        )
+
+    def test_net_basal_timeline_suspended_temp_basal_replaced(self):
+        with open(get_file_at_path("fixtures/temp_basal_suspend.json")) as fp:
+            pump_history = json.load(fp)
+
+        pump_history[0:0] = [
+            {"_type": "TempBasalDuration", "duration (min)": 30, "timestamp": "2015-06-13T15:10:00"},
+            {"_type": "TempBasal", "temp": "percent", "rate": 50, "timestamp": "2015-06-13T15:10:00"}
+        ]
+
+        steps = NormalizeRecords(
+            ResolveHistory(ReconcileHistory(pump_history).reconciled_history).resolved_records,
+            self.basal_rate_schedule
+        ).net_basal_timeline()
+
+        self.assertEqual("2015-06-13T15:40:00", steps[-1]["end_at"])
+
+        for step, next_step in zip(steps, steps[1:]):
+            self.assertLess(step["start_at"], step["end_at"])
+            self.assertEqual(step["end_at"], next_step["start_at"])
+
 
 class MungeFixturesTestCase(BasalScheduleTestCase):
     def test_bolus_wizard_duplicates(self):
@@ -1784,6 +1985,250 @@ class MungeFixturesTestCase(BasalScheduleTestCase):
         )
 
 
+class DecoderRegistryTestCase(unittest.TestCase):
+    def test_register_decoder(self):
+        class MarkingCleanHistory(CleanHistory):
+            pass
+
+        event = {"_type": "Prime", "timestamp": "2015-06-13T14:54:19"}
+
+        self.assertListEqual([event], MarkingCleanHistory([event]).clean_history)
+
+        MarkingCleanHistory.register_decoder("Prime", lambda parser, e: [dict(e, marked=True)])
+
+        self.assertListEqual(
+            [dict(event, marked=True)],
+            MarkingCleanHistory([event]).clean_history
+        )
+        self.assertListEqual([event], CleanHistory([event]).clean_history)
+
+    def test_unknown_types_are_passed_through(self):
+        events = [
+            {"_type": "Unknown", "timestamp": "2015-06-13T14:54:19"},
+            {"_type": "UNKNOWN", "timestamp": "2015-06-13T14:54:18"}
+        ]
+
+        self.assertListEqual(events, ReconcileHistory(list(events)).reconciled_history)
+        self.assertListEqual([], ResolveHistory(events).resolved_records)
+
+    def test_decoder_errors_are_raised(self):
+        class BrokenResolveHistory(ResolveHistory):
+            def _decode_prime(self, event):
+                return self.missing_attribute
+
+        with self.assertRaises(AttributeError):
+            BrokenResolveHistory([{"_type": "Prime", "timestamp": "2015-06-13T14:54:19"}])
+
+
+class CompactRecordsTestCase(BasalScheduleTestCase):
+    def test_compact_record_to_dict(self):
+        record = TempBasal.compact(
+            start_at=datetime(2015, 01, 01, 05),
+            end_at=datetime(2015, 01, 01, 06),
+            amount=0.925,
+            unit="U/hour",
+            description="Testing"
+        )
+
+        self.assertEqual(
+            CompactRecord(
+                "TempBasal",
+                datetime(2015, 01, 01, 05),
+                datetime(2015, 01, 01, 06),
+                0.925,
+                "U/hour",
+                "Testing"
+            ),
+            record
+        )
+        self.assertEqual("TempBasal", record["type"])
+
+        self.assertDictEqual(
+            TempBasal(
+                start_at=datetime(2015, 01, 01, 05),
+                end_at=datetime(2015, 01, 01, 06),
+                amount=0.925,
+                unit="U/hour",
+                description="Testing"
+            ),
+            record.to_dict()
+        )
+
+        self.assertDictEqual(
+            {
+                "type": "TempBasal",
+                "start_at": -420,
+                "end_at": -360,
+                "amount": 0.925,
+                "unit": "U/hour",
+                "description": "Testing"
+            },
+            record.to_dict(zero_datetime=datetime(2015, 01, 01, 12))
+        )
+
+    def test_compact_normalize_matches_dicts(self):
+        for fixture in (
+            "fixtures/square_bolus.json",
+            "fixtures/temp_basal_cancel.json",
+            "fixtures/temp_basal_suspend.json",
+            "fixtures/square_bolus_cancel.json"
+        ):
+            for zero_datetime in (None, datetime(2015, 06, 20)):
+                with open(get_file_at_path(fixture)) as fp:
+                    reconciled_history = ReconcileHistory(CleanHistory(json.load(fp)).clean_history).reconciled_history
+
+                self.assertListEqual(
+                    NormalizeRecords(
+                        ResolveHistory(reconciled_history).resolved_records,
+                        basal_schedule=self.basal_rate_schedule,
+                        zero_datetime=zero_datetime
+                    ).normalized_records,
+                    NormalizeRecords(
+                        ResolveHistory(reconciled_history, compact_records=True).resolved_records,
+                        basal_schedule=self.basal_rate_schedule,
+                        zero_datetime=zero_datetime,
+                        compact_records=True
+                    ).normalized_records
+                )
+
+
+class PrepareHistoryTestCase(BasalScheduleTestCase):
+    def assertPreparedEqualsChained(self, fixture, zero_datetime=None, **kwargs):
+        with open(get_file_at_path(fixture)) as fp:
+            pump_history = json.load(fp)
+
+        chained = NormalizeRecords(
+            ResolveHistory(
+                ReconcileHistory(
+                    CleanHistory(
+                        pump_history,
+                        **kwargs
+                    ).clean_history
+                ).reconciled_history
+            ).resolved_records,
+            basal_schedule=self.basal_rate_schedule,
+            zero_datetime=zero_datetime
+        ).normalized_records
+
+        # Reconciliation modifies the history events, so PrepareHistory needs its own copy
+        with open(get_file_at_path(fixture)) as fp:
+            pump_history = json.load(fp)
+
+        prepared = PrepareHistory(
+            pump_history,
+            basal_schedule=self.basal_rate_schedule,
+            zero_datetime=zero_datetime,
+            **kwargs
+        ).prepared_records
+
+        self.assertListEqual(chained, prepared)
+
+    def test_munge_fixtures(self):
+        for fixture, zero_at in (
+            ("fixtures/bolus_wizard_duplicates.json", "2015-06-05T19:08:00"),
+            ("fixtures/square_bolus.json", "2015-06-19T23:04:25"),
+            ("fixtures/temp_basal_cancel.json", "2015-06-06T21:10:00"),
+            ("fixtures/temp_basal_suspend.json", "2015-06-13T15:10:00"),
+            ("fixtures/square_bolus_cancel.json", "2015-06-22T21:30:00"),
+            ("fixtures/exercise_marker.json", None),
+        ):
+            self.assertPreparedEqualsChained(
+                fixture,
+                zero_datetime=parser.parse(zero_at) if zero_at else None
+            )
+
+    def test_suspend_without_resume(self):
+        self.assertPreparedEqualsChained(
+            "fixtures/temp_basal_suspend.json",
+            end_datetime=parser.parse("2015-06-13T15:30:00"),
+            duration_hours=4.0
+        )
+
+    def test_empty_history(self):
+        self.assertListEqual([], PrepareHistory([], self.basal_rate_schedule).prepared_records)
+
+
+class StreamingHistoryTestCase(BasalScheduleTestCase):
+    def load_fixture(self, path):
+        with open(get_file_at_path(path)) as fp:
+            return json.load(fp)
+
+    def test_iter_trim(self):
+        pump_history = self.load_fixture('fixtures/square_bolus.json')
+
+        for kwargs in (
+            dict(),
+            dict(start_datetime=datetime(2015, 06, 19, 21, 30), end_datetime=datetime(2015, 06, 19, 22)),
+            dict(start_datetime=datetime(2015, 06, 19, 22), duration_hours=6.0),
+            dict(end_datetime=datetime(2015, 06, 19, 22))
+        ):
+            self.assertListEqual(
+                TrimHistory(pump_history, **kwargs).trimmed_history,
+                list(iter_trim(iter(pump_history), **kwargs))
+            )
+
+    def test_iter_clean(self):
+        pump_history = self.load_fixture('fixtures/temp_basal_suspend.json')
+
+        for kwargs in (
+            dict(),
+            dict(end_datetime=parser.parse('2015-06-13T15:30:00'), duration_hours=4.0)
+        ):
+            for trimmed_history in (pump_history[:4], pump_history[4:], pump_history):
+                self.assertListEqual(
+                    CleanHistory(trimmed_history, **kwargs).clean_history,
+                    list(iter_clean(iter(trimmed_history), **kwargs))
+                )
+
+    def test_iter_clean_is_incremental(self):
+        pump_history = self.load_fixture('fixtures/bolus_wizard_duplicates.json')
+
+        consumed = []
+
+        def read_history():
+            for event in pump_history:
+                consumed.append(event)
+                yield event
+
+        self.assertIs(pump_history[0], next(iter_clean(read_history())))
+        self.assertEqual(1, len(consumed))
+
+    def test_pipeline(self):
+        for fixture in (
+            'fixtures/bolus_wizard_duplicates.json',
+            'fixtures/square_bolus.json',
+            'fixtures/temp_basal_cancel.json',
+            'fixtures/temp_basal_suspend.json',
+            'fixtures/square_bolus_cancel.json'
+        ):
+            records = NormalizeRecords(
+                ResolveHistory(
+                    ReconcileHistory(
+                        CleanHistory(
+                            self.load_fixture(fixture)
+                        ).clean_history
+                    ).reconciled_history
+                ).resolved_records,
+                basal_schedule=self.basal_rate_schedule,
+                zero_datetime=datetime(2015, 06, 20)
+            ).normalized_records
+
+            self.assertListEqual(
+                records,
+                list(iter_normalize(
+                    iter_resolve(
+                        iter_reconcile(
+                            iter_clean(
+                                iter(self.load_fixture(fixture))
+                            )
+                        )
+                    ),
+                    basal_schedule=self.basal_rate_schedule,
+                    zero_datetime=datetime(2015, 06, 20)
+                ))
+            )
+
+
 class AppendDoseToHistoryTestCase(unittest.TestCase):
     def test_append_single_dose(self):
         with open(get_file_at_path('fixtures/set_dose.json')) as fp:
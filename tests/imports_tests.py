@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+
+# The time allowed for importing the plugin module, in milliseconds. Slower boards can raise it.
+IMPORT_BUDGET_ENVIRONMENT_VARIABLE = 'MMHISTORYTOOLS_IMPORT_BUDGET_MS'
+DEFAULT_IMPORT_BUDGET_MS = 30.0
+
+# Imports the plugin module in a fresh interpreter, as openaps does to list devices and render help.
+# openaps and the shared openapscontrib namespace are imported first, so that only the cost of this
+# package is measured.
+IMPORT_SCRIPT = """
+import json
+import sys
+import timeit
+
+import openaps.uses.use
+import openapscontrib
+
+start = timeit.default_timer()
+import openapscontrib.mmhistorytools
+elapsed = timeit.default_timer() - start
+
+sys.stdout.write(json.dumps(dict(milliseconds=elapsed * 1000, modules=sorted(sys.modules))))
+"""
+
+
+def import_plugin():
+    """Imports the plugin module in a subprocess
+
+    :return: The import time in milliseconds, and the names of the modules loaded by the subprocess
+    :rtype: tuple(float, list(str))
+    """
+    root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else [])
+    )
+
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT], env=env)
+    result = json.loads(output.decode('utf-8'))
+
+    return result['milliseconds'], result['modules']
+
+
+class PluginImportTestCase(unittest.TestCase):
+    def test_history_passes_are_not_imported(self):
+        _, modules = import_plugin()
+
+        for name in (
+            'openapscontrib.mmhistorytools.historytools',
+            'openapscontrib.mmhistorytools.timestamps',
+            'dateutil'
+        ):
+            self.assertNotIn(name, modules)
+
+    def test_import_budget(self):
+        budget = float(os.environ.get(IMPORT_BUDGET_ENVIRONMENT_VARIABLE, DEFAULT_IMPORT_BUDGET_MS))
+
+        # The best of a few runs, so a busy machine doesn't fail the check
+        milliseconds = min(import_plugin()[0] for _ in range(3))
+
+        self.assertLess(milliseconds, budget)
+
+    def test_uses_implement_run(self):
+        import openapscontrib.mmhistorytools as mmhistorytools
+
+        self.assertIn('run', mmhistorytools.BaseUse.__abstractmethods__)
+
+        for use in mmhistorytools.get_uses(None, None):
+            self.assertEqual(frozenset(), use.__abstractmethods__)
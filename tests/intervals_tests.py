@@ -0,0 +1,72 @@
+from datetime import timedelta
+import unittest
+
+from .synthetic import SyntheticHistory
+from openapscontrib.mmhistorytools.historytools import CleanHistory, ReconcileHistory, ResolveHistory
+from openapscontrib.mmhistorytools.intervals import IntervalIndex
+
+
+class IntervalIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = IntervalIndex([
+            (10, 20, 'a'),
+            (0, 100, 'long'),
+            (30, 30, 'point'),
+            (20, 25, 'b'),
+            (40, 50, 'c'),
+        ])
+
+    def test_overlapping(self):
+        self.assertListEqual(['long', 'a'], self.index.overlapping(15, 20))
+        self.assertListEqual(['long', 'b', 'point'], self.index.overlapping(20, 31))
+        self.assertListEqual(['long', 'point'], self.index.overlapping(30, 40))
+        self.assertListEqual(['long'], self.index.overlapping(25, 30))
+        self.assertListEqual([], self.index.overlapping(100, 200))
+
+    def test_containing(self):
+        self.assertListEqual(['long', 'b'], self.index.containing(20))
+        self.assertListEqual(['long', 'point'], self.index.containing(30))
+        self.assertListEqual([], self.index.containing(-1))
+
+    def test_next_start(self):
+        self.assertEqual('a', self.index.next_start(1))
+        self.assertEqual('point', self.index.next_start(30))
+        self.assertIsNone(self.index.next_start(41))
+
+    def test_empty(self):
+        index = IntervalIndex([])
+
+        self.assertEqual(0, len(index))
+        self.assertListEqual([], index.overlapping(0, 1))
+        self.assertListEqual([], index.containing(0))
+        self.assertIsNone(index.next_start(0))
+
+    def test_resolved_records(self):
+        generator = SyntheticHistory(seed=2)
+        generator.suspend_probability = 0.02
+        generator.square_bolus_probability = 0.05
+        history = list(generator.iter_pump_history(hours=48))
+
+        records = ResolveHistory(
+            ReconcileHistory(CleanHistory(history).clean_history).reconciled_history,
+            compact_records=True
+        ).resolved_records
+        index = ResolveHistory([]).to_interval_index()
+        self.assertEqual(0, len(index))
+
+        index = IntervalIndex.from_records(records)
+        self.assertEqual(len(records), len(index))
+
+        for minutes in range(0, 48 * 60, 17):
+            start_at = generator.end_datetime - timedelta(minutes=minutes)
+            end_at = start_at + timedelta(minutes=45)
+
+            expected = sorted((
+                record for record in records
+                if record["start_at"] < end_at and (
+                    record["end_at"] > start_at or
+                    start_at <= record["start_at"] == record["end_at"]
+                )
+            ), key=lambda record: (record["start_at"], record["end_at"]))
+
+            self.assertListEqual(expected, index.overlapping(start_at, end_at))
@@ -0,0 +1,50 @@
+from StringIO import StringIO
+import json
+import os
+import unittest
+
+from openapscontrib.mmhistorytools import jsonstream
+from openapscontrib.mmhistorytools.jsonstream import iter_json_array
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class IterJSONArrayTestCase(unittest.TestCase):
+    def assertDecodesLikeLoad(self, contents, **kwargs):
+        for chunk_size in (1, 2, 7, 64, 4096):
+            self.assertListEqual(
+                json.loads(contents),
+                list(iter_json_array(StringIO(contents), chunk_size=chunk_size, use_ijson=False, **kwargs))
+            )
+
+    def test_fixtures(self):
+        for name in ('temp_basal_suspend.json', 'reservoir_history_with_rewind_and_prime_input.json'):
+            with open(get_file_at_path('fixtures/' + name)) as fp:
+                self.assertDecodesLikeLoad(fp.read())
+
+    def test_scalars_and_whitespace(self):
+        self.assertDecodesLikeLoad('[]')
+        self.assertDecodesLikeLoad(' [ ] ')
+        self.assertDecodesLikeLoad('[12345, -0.25 ,1e3,"a,]b",\n null, true, [1, [2]], {"c": 3}]\n')
+        self.assertDecodesLikeLoad(u'[{"description": "\u00b5g"}]')
+
+    def test_invalid(self):
+        for contents in ('', '{}', '[1', '[1 2]', '[1,]', '[{"a": 1]'):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(StringIO(contents), chunk_size=2, use_ijson=False))
+
+    @unittest.skipIf(jsonstream.ijson is None, "ijson is not installed")
+    def test_ijson(self):
+        with open(get_file_at_path('fixtures/temp_basal_suspend.json')) as fp:
+            contents = fp.read()
+
+        self.assertListEqual(json.loads(contents), list(iter_json_array(StringIO(contents), use_ijson=True)))
+
+        contents = '[{"amount": 0.25, "rates": [1, 1.5], "nested": {"rate": 0.1}}]'
+        decoded = list(iter_json_array(StringIO(contents), use_ijson=True))
+
+        self.assertListEqual(json.loads(contents), decoded)
+        self.assertIsInstance(decoded[0]["amount"], float)
+        self.assertIsInstance(decoded[0]["nested"]["rate"], float)
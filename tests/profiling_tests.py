@@ -0,0 +1,48 @@
+from StringIO import StringIO
+import os
+import unittest
+
+from openapscontrib.mmhistorytools.profiling import Profiler
+from openapscontrib.mmhistorytools.profiling import PROFILE_ENVIRONMENT_VARIABLE
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def test_stages(self):
+        stream = StringIO()
+
+        with Profiler(enabled=True, stream=stream) as profiler:
+            with profiler.stage('load') as stage:
+                stage.count = 3
+
+            self.assertListEqual([1, 2], profiler.call('pass', lambda: [1, 2]))
+            profiler.call('pass', lambda: [1, 2])
+
+        self.assertListEqual(['load', 'pass'], list(profiler.stages))
+        self.assertEqual(3, profiler.stages['load'].count)
+        self.assertEqual(2, profiler.stages['pass'].count)
+        self.assertGreaterEqual(profiler.stages['pass'].wall_seconds, 0)
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(4, len(lines))
+        self.assertTrue(lines[1].startswith('load'))
+        self.assertTrue(lines[-1].startswith('total'))
+
+    def test_disabled(self):
+        stream = StringIO()
+
+        with Profiler(stream=stream) as profiler:
+            self.assertEqual(4, profiler.call('pass', lambda: 4))
+
+        self.assertEqual(0, len(profiler.stages))
+        self.assertEqual('', stream.getvalue())
+
+    def test_environment(self):
+        os.environ[PROFILE_ENVIRONMENT_VARIABLE] = '1'
+
+        try:
+            self.assertTrue(Profiler.from_environment().enabled)
+        finally:
+            del os.environ[PROFILE_ENVIRONMENT_VARIABLE]
+
+        self.assertFalse(Profiler.from_environment().enabled)
+        self.assertTrue(Profiler.from_environment(enabled=True).enabled)
@@ -0,0 +1,87 @@
+from datetime import datetime
+from datetime import timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from openapscontrib.mmhistorytools.historytools import append_reservoir_entry_to_history
+from openapscontrib.mmhistorytools.reservoir import ReservoirStore
+
+
+class ReservoirStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'reservoir.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_lines(self):
+        with open(self.path) as fp:
+            return fp.read().splitlines()
+
+    def test_matches_append_reservoir_entry_to_history(self):
+        store = ReservoirStore(self.path, lookback_hours=1)
+        history = []
+        date = datetime(2015, 6, 19, 23, 0)
+
+        for minute in range(0, 180, 5):
+            entry_date = date + timedelta(minutes=minute)
+            history = append_reservoir_entry_to_history(history, 100 - minute / 10.0, entry_date, lookback_hours=1)
+            store.append(100 - minute / 10.0, entry_date)
+
+            self.assertListEqual(history, store.history())
+            self.assertListEqual(history, ReservoirStore(self.path, lookback_hours=1).history())
+
+    def test_appends_one_line(self):
+        store = ReservoirStore(self.path)
+        store.append(100.0, datetime(2015, 6, 19, 23, 0))
+        store.append(99.5, datetime(2015, 6, 19, 23, 5))
+
+        self.assertEqual(2, len(self.read_lines()))
+        self.assertEqual(
+            {'date': '2015-06-19T23:05:00', 'amount': 99.5, 'unit': 'U'},
+            json.loads(self.read_lines()[-1])
+        )
+
+    def test_compaction(self):
+        store = ReservoirStore(self.path, lookback_hours=0.5)
+        date = datetime(2015, 6, 19, 23, 0)
+
+        for minute in range(0, 600, 5):
+            store.append(100.0, date + timedelta(minutes=minute))
+            self.assertLessEqual(len(self.read_lines()), ReservoirStore.min_compaction_lines + len(store) + 1)
+
+        self.assertEqual(7, len(store))
+
+    def test_loads_json_list(self):
+        history = [
+            {'date': '2015-06-19T23:00:00', 'amount': 100.0, 'unit': 'U'},
+            {'date': '2015-06-19T23:05:00', 'amount': 99.5, 'unit': 'U'}
+        ]
+
+        with open(self.path, 'w') as fp:
+            json.dump(history, fp)
+
+        store = ReservoirStore(self.path)
+        store.append(99.0, datetime(2015, 6, 19, 23, 10))
+
+        self.assertEqual(3, len(self.read_lines()))
+        self.assertListEqual(history, store.history()[:2])
+
+    def test_truncated_last_line(self):
+        store = ReservoirStore(self.path)
+        store.append(100.0, datetime(2015, 6, 19, 23, 0))
+
+        with open(self.path, 'a') as fp:
+            fp.write('{"date": "2015-06-19T23:05:00", "amo')
+
+        store = ReservoirStore(self.path)
+        self.assertEqual(1, len(store))
+
+        store.append(99.0, datetime(2015, 6, 19, 23, 10))
+
+        self.assertEqual(2, len(self.read_lines()))
+        self.assertEqual(2, len(ReservoirStore(self.path)))
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import json
+import os
+import unittest
+
+from openapscontrib.mmhistorytools.schedules import BasalSchedule, get_basal_schedule
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class BasalScheduleTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/basal.json")) as fp:
+            cls.basal_rate_schedule = json.load(fp)
+
+    def test_rates_in_range_across_midnight(self):
+        schedule = BasalSchedule(self.basal_rate_schedule)
+
+        self.assertListEqual(
+            [
+                {"start": datetime(2015, 1, 1, 22), "rate": 0.9},
+                {"start": datetime(2015, 1, 2), "rate": 0.9},
+                {"start": datetime(2015, 1, 2, 4), "rate": 0.925}
+            ],
+            schedule.rates_in_range(datetime(2015, 1, 1, 23), datetime(2015, 1, 2, 5))
+        )
+
+    def test_unsorted_profile(self):
+        schedule = BasalSchedule(list(reversed(self.basal_rate_schedule)))
+
+        self.assertListEqual(
+            BasalSchedule(self.basal_rate_schedule).rates_in_range(
+                datetime(2015, 1, 1), datetime(2015, 1, 1, 23, 59)
+            ),
+            schedule.rates_in_range(datetime(2015, 1, 1), datetime(2015, 1, 1, 23, 59))
+        )
+
+    def test_schedule_before_first_rate(self):
+        schedule = BasalSchedule([{"start": "04:00:00", "rate": 1.0}])
+
+        self.assertListEqual([], schedule.rates_in_range(datetime(2015, 1, 1, 1), datetime(2015, 1, 1, 2)))
+        self.assertListEqual(
+            [{"start": datetime(2015, 1, 1, 4), "rate": 1.0}],
+            schedule.rates_in_range(datetime(2015, 1, 1, 1), datetime(2015, 1, 1, 5))
+        )
+
+    def test_cached_by_contents(self):
+        schedule = get_basal_schedule(self.basal_rate_schedule)
+
+        self.assertIs(schedule, get_basal_schedule(json.loads(json.dumps(self.basal_rate_schedule))))
+        self.assertIsNot(schedule, get_basal_schedule(self.basal_rate_schedule[1:]))
+
+    def test_rates_in_ranges(self):
+        starts = [datetime(2015, 1, 1) + timedelta(minutes=13 * index) for index in range(300)]
+        starts.extend([datetime(2015, 1, 2), datetime(2015, 1, 2, 22), datetime(2015, 1, 1, 1)])
+        ranges = [(start, start + timedelta(minutes=7 * (index % 200))) for index, start in enumerate(starts)]
+        ranges.append((datetime(2015, 1, 1, 23), datetime(2015, 1, 2)))
+        ranges.append((datetime(2015, 1, 2), datetime(2015, 1, 2)))
+
+        for basal_rate_schedule in (
+            self.basal_rate_schedule,
+            [{"start": "04:00:00", "rate": 1.0}, {"start": "12:30:00", "rate": 1.5}],
+            []
+        ):
+            schedule = BasalSchedule(basal_rate_schedule)
+
+            self.assertListEqual(
+                [schedule.rates_in_range(start, end) for start, end in ranges],
+                schedule.rates_in_ranges(ranges)
+            )
@@ -0,0 +1,121 @@
+from datetime import datetime
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from openapscontrib.mmhistorytools.historytools import TrimHistory
+from openapscontrib.mmhistorytools.service import HistoryService, request, serialize
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class HistoryServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.directory, 'service.sock')
+
+        self.service = HistoryService(self.socket_path, request_timeout=0.2)
+        self.thread = threading.Thread(target=self.service.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.service.shutdown()
+        self.thread.join()
+        self.service.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_command(self):
+        with open(get_file_at_path('fixtures/square_bolus.json')) as fp:
+            history = json.load(fp)
+
+        response, payload = request(
+            self.socket_path,
+            'trim',
+            [get_file_at_path('fixtures/square_bolus.json'), '--start', '2015-06-19T21:30:00']
+        )
+
+        self.assertEqual(0, response['exit_code'])
+        self.assertEqual(
+            serialize(TrimHistory(history, start_datetime=datetime(2015, 6, 19, 21, 30)).trimmed_history),
+            payload
+        )
+
+    def test_stdin(self):
+        with open(get_file_at_path('fixtures/square_bolus.json')) as fp:
+            response, payload = request(self.socket_path, 'clean', [], stdin=fp)
+
+        self.assertEqual(0, response['exit_code'])
+        self.assertEqual(8, len(json.loads(payload)))
+
+    def test_invalid_arguments(self):
+        response, payload = request(self.socket_path, 'trim', ['--unknown'])
+
+        self.assertEqual(2, response['exit_code'])
+        self.assertFalse(response['output'])
+        self.assertIn('--unknown', response['messages'])
+
+    def test_errors_are_reported(self):
+        response, payload = request(self.socket_path, 'trim', [get_file_at_path('missing.json')])
+
+        self.assertEqual(1, response['exit_code'])
+        self.assertFalse(response['output'])
+        self.assertIn('missing.json', response['messages'])
+
+    def test_request_timeout(self):
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.settimeout(5)
+
+        try:
+            # Connects without sending a request
+            stalled.connect(self.socket_path)
+            response = json.loads(stalled.makefile('rb').readline().decode('utf-8'))
+        finally:
+            stalled.close()
+
+        self.assertEqual(1, response['exit_code'])
+        self.assertIn('Timed out', response['messages'])
+
+        # The service is available to the next client
+        response, _ = request(self.socket_path, 'clean', [get_file_at_path('fixtures/square_bolus.json')])
+        self.assertEqual(0, response['exit_code'])
+
+    def test_client_timeout(self):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(os.path.join(self.directory, 'unresponsive.sock'))
+        listener.listen(1)
+
+        try:
+            with self.assertRaises(socket.timeout):
+                request(listener.getsockname(), 'clean', [], timeout=0.1)
+        finally:
+            listener.close()
+
+    def test_existing_paths_are_kept(self):
+        # A live service's socket
+        with self.assertRaises(socket.error):
+            HistoryService(self.socket_path)
+
+        path = os.path.join(self.directory, 'history.json')
+
+        with open(path, 'w') as fp:
+            fp.write('[]')
+
+        with self.assertRaises(OSError):
+            HistoryService(path)
+
+        with open(path) as fp:
+            self.assertEqual('[]', fp.read())
+
+    def test_stale_socket_is_replaced(self):
+        path = os.path.join(self.directory, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+
+        HistoryService(path).server_close()
@@ -0,0 +1,87 @@
+from copy import deepcopy
+import json
+import os
+import unittest
+
+from .synthetic import SyntheticHistory
+from openapscontrib.mmhistorytools.historytools import PrepareHistory
+from openapscontrib.mmhistorytools.service import serialize
+from openapscontrib.mmhistorytools.shards import prepare_serialized, resolve_states, shard_slices
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+class ShardsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(get_file_at_path("fixtures/basal.json")) as fp:
+            cls.basal_rate_schedule = json.load(fp)
+
+    def assertShardedEqualsSequential(self, history, **kwargs):
+        # Reconciliation modifies the history events, so each run needs its own copy
+        expected = serialize(PrepareHistory(
+            deepcopy(history),
+            basal_schedule=self.basal_rate_schedule
+        ).prepared_records)
+        actual = prepare_serialized(deepcopy(history), basal_schedule=self.basal_rate_schedule, **kwargs)
+
+        self.assertEqual(expected, actual)
+
+    def test_fixtures(self):
+        for fixture in (
+            "fixtures/bolus_wizard_duplicates.json",
+            "fixtures/square_bolus.json",
+            "fixtures/square_bolus_cancel.json",
+            "fixtures/temp_basal_cancel.json",
+            "fixtures/temp_basal_suspend.json",
+        ):
+            with open(get_file_at_path(fixture)) as fp:
+                history = json.load(fp)
+
+            self.assertShardedEqualsSequential(history, processes=1, hours_per_shard=1)
+
+    def test_synthetic_history(self):
+        generator = SyntheticHistory(seed=7)
+        generator.suspend_probability = 0.02
+        generator.square_bolus_probability = 0.05
+        history = list(generator.iter_pump_history(hours=24 * 4))
+
+        self.assertShardedEqualsSequential(history, processes=2)
+
+        # Hourly shards cut through suspends, square boluses and temp basals
+        reconciled_history = list(reversed(sorted(history, key=lambda event: event["timestamp"])))
+        slices = shard_slices(reconciled_history, hours_per_shard=1)
+        states = resolve_states(reconciled_history, slices)
+
+        self.assertGreater(len(slices), 90)
+        self.assertTrue(any(state["resume_datetime"] is not None for state in states))
+        self.assertTrue(any(state["suspend_datetime"] is not None for state in states))
+
+        self.assertShardedEqualsSequential(history, processes=2, hours_per_shard=1)
+
+    def test_empty_history(self):
+        self.assertEqual('[]', prepare_serialized([], processes=1))
+
+    def test_shard_slices(self):
+        history = [
+            {"_type": "Bolus", "timestamp": "2016-01-02T00:10:00"},
+            {"_type": "Bolus", "timestamp": "2016-01-02T00:00:00"},
+            {"_type": "Bolus", "timestamp": "2016-01-01T23:50:00"},
+            # Recorded out of order
+            {"_type": "Bolus", "timestamp": "2016-01-02T00:05:00"},
+            {"_type": "Bolus", "timestamp": "2015-12-31T12:00:00"},
+        ]
+
+        self.assertListEqual([(0, 2), (2, 4), (4, 5)], shard_slices(history))
+
+    def test_invalid_hours_per_shard(self):
+        for hours_per_shard in (0, 5, 25, -24):
+            with self.assertRaises(ValueError):
+                shard_slices([], hours_per_shard=hours_per_shard)
+
+            with self.assertRaises(ValueError):
+                prepare_serialized([], hours_per_shard=hours_per_shard)
+
+        self.assertListEqual([], shard_slices([], hours_per_shard=6))
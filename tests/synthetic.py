@@ -0,0 +1,251 @@
+"""
+Seeded generator of synthetic pump and reservoir history for scale and soak testing
+
+The history is generated one 5-minute loop cycle at a time, so any length can be streamed in
+constant memory. The same seed and end time always produce the same events.
+
+Usage:
+    python -m tests.synthetic [--hours 2160] [--seed 0] [--reservoir]
+
+Writes a JSON list of events to stdout, one event per line.
+"""
+import argparse
+from datetime import datetime
+from datetime import timedelta
+import json
+import random
+import sys
+
+
+CYCLE = timedelta(minutes=5)
+
+
+def _round_to(value, increment):
+    return round(round(value / increment) * increment, 3)
+
+
+class SyntheticHistory(object):
+    """A generator of internally-consistent Medtronic pump history
+
+    Pump history is yielded in reverse-chronological order, as read from the pump:
+    - TempBasalDuration and TempBasal pairs, including cancelling temp basals of 0 minutes
+    - PumpResume and PumpSuspend pairs, with no deliveries while suspended
+    - Normal boluses with a BolusWizard record, some of which are duplicated within the same minute
+    - Square boluses, some of which are cancelled before their full amount is delivered
+    - Events which the history passes should ignore
+
+    The probabilities below are per loop cycle.
+    """
+    temp_basal_probability = 0.3
+    temp_basal_cancel_probability = 0.05
+    suspend_probability = 0.002
+    bolus_probability = 0.02
+    duplicate_bolus_wizard_probability = 0.3
+    square_bolus_probability = 0.005
+    other_event_probability = 0.05
+
+    def __init__(self, end_datetime=datetime(2016, 1, 1), seed=0):
+        """Initializes a new generator
+
+        :param end_datetime: The time of the newest event
+        :type end_datetime: datetime
+        :param seed: The seed for the random number generators
+        :type seed: int
+        """
+        self.end_datetime = end_datetime
+        self.seed = seed
+
+    def iter_pump_history(self, hours=None):
+        """Yields pump history events back in time from the end time
+
+        :param hours: The length of history to generate, or None to generate events indefinitely
+        :type hours: float|NoneType
+        :return: An iterator of history events, in reverse-chronological order
+        :rtype: iterator(dict)
+        """
+        rng = random.Random(self.seed)
+        start_datetime = None if hours is None else self.end_datetime - timedelta(hours=hours)
+        cycle_datetime = self.end_datetime
+        suspend_datetime = None
+
+        while start_datetime is None or cycle_datetime > start_datetime:
+            if suspend_datetime is not None:
+                if suspend_datetime > cycle_datetime - CYCLE:
+                    if start_datetime is None or suspend_datetime >= start_datetime:
+                        yield self._event("PumpSuspend", suspend_datetime)
+
+                    suspend_datetime = None
+            else:
+                event_datetime = cycle_datetime - timedelta(seconds=rng.randint(0, 30))
+
+                if rng.random() < self.suspend_probability:
+                    yield self._event("PumpResume", event_datetime)
+
+                    suspend_datetime = event_datetime - timedelta(
+                        minutes=rng.randint(5, 90),
+                        seconds=rng.randint(1, 59)
+                    )
+                else:
+                    for event in self._iter_cycle_events(rng, event_datetime):
+                        if start_datetime is None or event["timestamp"] >= start_datetime.isoformat():
+                            yield event
+
+            cycle_datetime -= CYCLE
+
+    def _iter_cycle_events(self, rng, event_datetime):
+        if rng.random() < self.other_event_probability:
+            yield self._event("BGReceived", event_datetime, amount=rng.randint(40, 400))
+            event_datetime -= timedelta(seconds=1)
+
+        if rng.random() < self.bolus_probability:
+            carb_input = rng.randint(5, 90)
+            carb_ratio = 10.0
+            bolus_estimate = _round_to(carb_input / carb_ratio, 0.1)
+            amount = _round_to(bolus_estimate * rng.uniform(0.5, 1.0), 0.05)
+            body = "{:02x}50003c285a{:04x}00000000{:04x}78".format(
+                carb_input, int(bolus_estimate * 10), int(amount * 10)
+            )
+
+            yield self._event(
+                "Bolus",
+                event_datetime,
+                type="normal",
+                amount=amount,
+                programmed=amount,
+                duration=0
+            )
+            yield self._bolus_wizard_event(event_datetime, body, carb_input, carb_ratio, bolus_estimate)
+
+            if rng.random() < self.duplicate_bolus_wizard_probability:
+                event_datetime -= timedelta(seconds=rng.randint(1, 30))
+                yield self._bolus_wizard_event(event_datetime, body, carb_input, carb_ratio, bolus_estimate)
+
+            event_datetime -= timedelta(seconds=1)
+
+        if rng.random() < self.square_bolus_probability:
+            programmed = _round_to(rng.uniform(0.5, 6.0), 0.05)
+            duration = rng.choice((30, 60, 90, 120, 240))
+
+            if rng.random() < 0.2:
+                amount = _round_to(programmed * rng.random(), 0.05)
+            else:
+                amount = programmed
+
+            yield self._event(
+                "Bolus",
+                event_datetime,
+                type="square",
+                amount=amount,
+                programmed=programmed,
+                duration=duration
+            )
+            event_datetime -= timedelta(seconds=1)
+
+        if rng.random() < self.temp_basal_probability:
+            if rng.random() < self.temp_basal_cancel_probability:
+                temp, rate, duration = "percent", 0, 0
+            elif rng.random() < 0.5:
+                temp, rate, duration = "percent", rng.choice((0, 50, 80, 120, 150, 200)), 30
+            else:
+                temp, rate, duration = "absolute", _round_to(rng.uniform(0, 3), 0.025), 30
+
+            yield self._event("TempBasalDuration", event_datetime, **{"duration (min)": duration})
+            yield self._event("TempBasal", event_datetime, temp=temp, rate=rate)
+
+    def _bolus_wizard_event(self, event_datetime, body, carb_input, carb_ratio, bolus_estimate):
+        return self._event(
+            "BolusWizard",
+            event_datetime,
+            _body=body,
+            bg=0,
+            carb_input=carb_input,
+            carb_ratio=carb_ratio,
+            bolus_estimate=bolus_estimate,
+            food_estimate=bolus_estimate,
+            correction_estimate=0.0,
+            unabsorbed_insulin_total=0.0
+        )
+
+    @staticmethod
+    def _event(event_type, event_datetime, **kwargs):
+        timestamp = event_datetime.isoformat()
+
+        event = {
+            "_type": event_type,
+            "_description": "{} {}".format(event_type, timestamp),
+            "_body": "",
+            "timestamp": timestamp
+        }
+        event.update(kwargs)
+
+        return event
+
+    def iter_reservoir_history(self, hours):
+        """Yields reservoir readings, one per loop cycle, up to the end time
+
+        The reservoir drains at a varying basal rate with occasional boluses, and is rewound and
+        primed when it runs low.
+
+        :param hours: The length of history to generate
+        :type hours: float
+        :return: An iterator of reservoir entries, in chronological order
+        :rtype: iterator(dict)
+        """
+        rng = random.Random(self.seed + 1)
+        reading_datetime = self.end_datetime - timedelta(hours=hours)
+        amount = 300.0
+
+        while reading_datetime <= self.end_datetime:
+            yield {
+                "date": (reading_datetime + timedelta(seconds=rng.randint(0, 2))).isoformat(),
+                "amount": amount,
+                "unit": "U"
+            }
+
+            if amount == 0.0:
+                # Rewound; the next reading follows the prime
+                amount = _round_to(300.0 - rng.uniform(2, 10), 0.05)
+            elif amount < 20.0:
+                amount = 0.0
+            else:
+                delivered = rng.uniform(0.5, 2.0) * CYCLE.total_seconds() / 3600.0
+
+                if rng.random() < self.bolus_probability:
+                    delivered += rng.uniform(0.5, 6.0)
+
+                amount = max(_round_to(amount - delivered, 0.05), 0.05)
+
+            reading_datetime += CYCLE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--hours', type=float, default=24.0, help='The length of history to generate')
+    parser.add_argument('--seed', type=int, default=0, help='The random seed')
+    parser.add_argument(
+        '--reservoir',
+        action='store_true',
+        help='Generate reservoir history instead of pump history'
+    )
+    args = parser.parse_args(argv)
+
+    history = SyntheticHistory(seed=args.seed)
+
+    if args.reservoir:
+        events = history.iter_reservoir_history(args.hours)
+    else:
+        events = history.iter_pump_history(args.hours)
+
+    sys.stdout.write('[')
+
+    for index, event in enumerate(events):
+        sys.stdout.write(',\n' if index > 0 else '\n')
+        sys.stdout.write(json.dumps(event, sort_keys=True))
+
+    sys.stdout.write('\n]\n')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
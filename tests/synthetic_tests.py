@@ -0,0 +1,59 @@
+from datetime import datetime
+from datetime import timedelta
+from itertools import islice
+import unittest
+
+from .synthetic import SyntheticHistory
+
+
+class SyntheticHistoryTestCase(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertListEqual(
+            list(SyntheticHistory(seed=3).iter_pump_history(hours=24)),
+            list(SyntheticHistory(seed=3).iter_pump_history(hours=24))
+        )
+        self.assertListEqual(
+            list(SyntheticHistory(seed=3).iter_reservoir_history(hours=24)),
+            list(SyntheticHistory(seed=3).iter_reservoir_history(hours=24))
+        )
+        self.assertNotEqual(
+            list(SyntheticHistory(seed=3).iter_pump_history(hours=24)),
+            list(SyntheticHistory(seed=4).iter_pump_history(hours=24))
+        )
+
+    def test_pump_history_order(self):
+        end_datetime = datetime(2016, 1, 1)
+        generator = SyntheticHistory(end_datetime=end_datetime, seed=1)
+        generator.suspend_probability = 0.05
+        history = list(generator.iter_pump_history(hours=48))
+        timestamps = [event["timestamp"] for event in history]
+
+        self.assertGreater(len(history), 0)
+        self.assertListEqual(sorted(timestamps, reverse=True), timestamps)
+        self.assertLessEqual(timestamps[0], end_datetime.isoformat())
+        self.assertGreaterEqual(timestamps[-1], (end_datetime - timedelta(hours=48)).isoformat())
+
+        # Every suspend is followed by its resume, newer in the history
+        types = [event["_type"] for event in history if event["_type"] in ("PumpSuspend", "PumpResume")]
+        self.assertGreater(len(types), 0)
+        self.assertNotIn("PumpSuspend", types[:1])
+        self.assertNotIn(("PumpSuspend", "PumpSuspend"), zip(types, types[1:]))
+        self.assertNotIn(("PumpResume", "PumpResume"), zip(types, types[1:]))
+
+    def test_indefinite_history(self):
+        generator = SyntheticHistory(seed=2)
+
+        self.assertListEqual(
+            list(generator.iter_pump_history(hours=24)),
+            [
+                event for event in islice(generator.iter_pump_history(), 2000)
+                if event["timestamp"] >= (generator.end_datetime - timedelta(hours=24)).isoformat()
+            ]
+        )
+
+    def test_reservoir_history_order(self):
+        history = list(SyntheticHistory(seed=5).iter_reservoir_history(hours=72))
+        dates = [entry["date"] for entry in history]
+
+        self.assertEqual(72 * 12 + 1, len(history))
+        self.assertListEqual(sorted(dates), dates)
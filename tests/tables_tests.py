@@ -0,0 +1,164 @@
+from datetime import datetime
+import json
+import os
+import unittest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from openapscontrib.mmhistorytools.historytools import CleanHistory, NormalizeRecords
+from openapscontrib.mmhistorytools.historytools import ReconcileHistory, ResolveHistory
+from openapscontrib.mmhistorytools.historytools import convert_reservoir_history_to_temp_basal
+from openapscontrib.mmhistorytools.models import Bolus, Meal, TempBasal
+from openapscontrib.mmhistorytools import tables
+from openapscontrib.mmhistorytools.tables import RecordTable, epoch_seconds
+
+
+def get_file_at_path(path):
+    return "{}/{}".format(os.path.dirname(os.path.realpath(__file__)), path)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class RecordTableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.records = [
+            Bolus(
+                start_at=datetime(2015, 1, 1, 12, 30),
+                end_at=datetime(2015, 1, 1, 12, 30),
+                amount=2.0,
+                unit="U",
+                description="Normal bolus: 2.0U"
+            ),
+            Meal(
+                start_at=datetime(2015, 1, 1, 12, 30),
+                end_at=datetime(2015, 1, 1, 12, 30),
+                amount=30,
+                unit="g",
+                description="BolusWizard: 30g"
+            ),
+            Bolus(
+                start_at=datetime(2015, 1, 1, 11),
+                end_at=datetime(2015, 1, 1, 13),
+                amount=1.5,
+                unit="U/hour",
+                description="Square bolus: 3.0U over 120min"
+            ),
+            TempBasal(
+                start_at=datetime(2015, 1, 1, 10),
+                end_at=datetime(2015, 1, 1, 11),
+                amount=150,
+                unit="percent",
+                description="TempBasal: 150% over 60min"
+            )
+        ]
+
+    def test_from_records(self):
+        table = RecordTable.from_records(self.records)
+
+        self.assertEqual(4, len(table))
+        self.assertListEqual([0, 1, 0, 2], table.type_codes.tolist())
+        self.assertListEqual([2.0, 30.0, 1.5, 150.0], table.amount.tolist())
+        self.assertEqual(epoch_seconds(datetime(2015, 1, 1, 11)), table.start[2])
+        self.assertListEqual([False, True, False, False], table.mask(record_type="Meal").tolist())
+
+    def test_insulin_in_intervals(self):
+        table = RecordTable.from_records(self.records)
+        edges = [epoch_seconds(datetime(2015, 1, 1, hour)) for hour in (10, 11, 12, 13, 14)]
+
+        np.testing.assert_allclose([0.0, 1.5, 3.5, 0.0], table.insulin_in_intervals(edges))
+        self.assertAlmostEqual(5.0, table.total_insulin())
+        self.assertAlmostEqual(
+            2.75,
+            table.total_insulin(
+                epoch_seconds(datetime(2015, 1, 1, 12, 30)),
+                epoch_seconds(datetime(2015, 1, 1, 13, 30))
+            )
+        )
+
+    def test_normalized_table(self):
+        with open(get_file_at_path("fixtures/basal.json")) as fp:
+            basal_schedule = json.load(fp)
+
+        with open(get_file_at_path("fixtures/temp_basal_cancel.json")) as fp:
+            resolved = ResolveHistory(ReconcileHistory(CleanHistory(json.load(fp)).clean_history).reconciled_history)
+
+        normalized = NormalizeRecords(
+            resolved.resolved_records,
+            basal_schedule=basal_schedule,
+            zero_datetime=datetime(2015, 6, 6, 21)
+        )
+
+        resolved_table = resolved.to_table()
+        normalized_table = normalized.to_table()
+
+        self.assertEqual(len(resolved.resolved_records), len(resolved_table))
+        self.assertEqual(len(normalized.normalized_records), len(normalized_table))
+
+        expected = sum(
+            record["amount"] if record["unit"] == "U" else
+            record["amount"] * (record["end_at"] - record["start_at"]) / 60.0
+            for record in normalized.normalized_records if record["unit"] in ("U", "U/hour")
+        )
+
+        self.assertAlmostEqual(expected, normalized_table.total_insulin())
+
+        buckets = tables.aggregate(normalized.normalized_records, bucket_minutes=5)
+
+        self.assertIsInstance(buckets[0]["start_at"], int)
+        self.assertEqual(0, buckets[0]["start_at"] % 5)
+        self.assertEqual(5, buckets[0]["end_at"] - buckets[0]["start_at"])
+        self.assertAlmostEqual(expected, sum(bucket["insulin"] for bucket in buckets))
+
+    def test_aggregate(self):
+        buckets = tables.aggregate(self.records, bucket_minutes=60, hours=3)
+
+        self.assertListEqual(
+            ["2015-01-01T11:00:00", "2015-01-01T12:00:00", "2015-01-01T13:00:00"],
+            [bucket["start_at"] for bucket in buckets]
+        )
+        self.assertEqual("2015-01-01T14:00:00", buckets[-1]["end_at"])
+        np.testing.assert_allclose([1.5, 3.5, 0.0], [bucket["insulin"] for bucket in buckets])
+        np.testing.assert_allclose([0.0, 30.0, 0.0], [bucket["carbs"] for bucket in buckets])
+
+        self.assertEqual(4, len(tables.aggregate(self.records, bucket_minutes=60)))
+        self.assertListEqual([], tables.aggregate([]))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ConvertReservoirHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(get_file_at_path("fixtures/reservoir_history_with_rewind_and_prime_input.json")) as fp:
+            self.reservoir_history = json.load(fp)
+
+    def test_matches_iterative_conversion(self):
+        self.assertListEqual(
+            convert_reservoir_history_to_temp_basal(self.reservoir_history),
+            tables.convert_reservoir_history_to_temp_basal(self.reservoir_history)
+        )
+
+    def test_as_table(self):
+        doses = convert_reservoir_history_to_temp_basal(self.reservoir_history)
+        table = tables.convert_reservoir_history_to_temp_basal(self.reservoir_history, as_table=True)
+
+        self.assertEqual(len(doses), len(table))
+        self.assertListEqual([dose["amount"] for dose in doses], table.amount.tolist())
+        self.assertListEqual([epoch_seconds(dose["start_at"]) for dose in doses], table.start.tolist())
+        self.assertTrue(np.all(table.mask(record_type="TempBasal", unit="U/hour")))
+
+    def test_integer_amounts(self):
+        history = [
+            {"date": "2015-01-01T12:00:00", "amount": 100},
+            {"date": "2015-01-01T12:05:00", "amount": 99},
+            {"date": "2015-01-01T12:10:00", "amount": 99},
+            {"date": "2015-01-01T12:15:00", "amount": 97}
+        ]
+
+        self.assertListEqual(
+            convert_reservoir_history_to_temp_basal(history),
+            tables.convert_reservoir_history_to_temp_basal(history)
+        )
+
+    def test_single_entry(self):
+        self.assertListEqual([], tables.convert_reservoir_history_to_temp_basal(self.reservoir_history[:1]))
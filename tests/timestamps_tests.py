@@ -0,0 +1,117 @@
+from datetime import datetime
+from dateutil import parser
+import unittest
+
+from openapscontrib.mmhistorytools import timestamps
+from openapscontrib.mmhistorytools.timestamps import TimestampCache
+from openapscontrib.mmhistorytools.timestamps import is_partial_timestamp
+from openapscontrib.mmhistorytools.timestamps import parse_iso_8601
+
+
+class ParseISO8601TestCase(unittest.TestCase):
+    def test_strict_format_matches_dateutil(self):
+        for value in (
+            "2015-06-19T23:04:25",
+            "2015-06-13T14:54:19.123456",
+            "2016-01-30T20:30:43.5",
+            "2015-01-01T00:00:00"
+        ):
+            self.assertEqual(parser.parse(value), parse_iso_8601(value))
+
+    def test_other_formats_are_not_matched(self):
+        for value in (
+            "2015-06-19 23:04:25",
+            "2015-06-19T23:04:25-07:00",
+            "2015-06-19T23:04:25Z",
+            "04:00:00",
+            "June 19, 2015"
+        ):
+            self.assertIsNone(parse_iso_8601(value))
+
+    def test_invalid_date(self):
+        with self.assertRaises(ValueError):
+            parse_iso_8601("2015-13-01T00:00:00")
+
+
+class TimestampCacheTestCase(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = TimestampCache()
+
+        self.assertEqual(datetime(2015, 6, 19, 23, 4, 25), cache.parse("2015-06-19T23:04:25"))
+        self.assertEqual(datetime(2015, 6, 19, 23, 4, 25), cache.parse("2015-06-19T23:04:25"))
+        self.assertEqual(
+            parser.parse("2015-06-19T23:04:25-07:00"),
+            cache.parse("2015-06-19T23:04:25-07:00")
+        )
+
+        self.assertDictEqual(dict(hits=1, misses=2, size=2, maxsize=8192), cache.info())
+
+        cache.clear()
+
+        self.assertDictEqual(dict(hits=0, misses=0, size=0, maxsize=8192), cache.info())
+
+    def test_least_recently_used_eviction(self):
+        cache = TimestampCache(maxsize=2)
+
+        cache.parse("2015-01-01T00:00:00")
+        cache.parse("2015-01-02T00:00:00")
+        cache.parse("2015-01-01T00:00:00")
+        cache.parse("2015-01-03T00:00:00")
+
+        self.assertEqual(2, len(cache))
+
+        cache.parse("2015-01-01T00:00:00")
+        self.assertEqual(2, cache.hits)
+
+        cache.parse("2015-01-02T00:00:00")
+        self.assertEqual(4, cache.misses)
+
+    def test_parse_failures_are_not_cached(self):
+        cache = TimestampCache()
+
+        with self.assertRaises(ValueError):
+            cache.parse("not a timestamp")
+
+        self.assertEqual(0, len(cache))
+        self.assertEqual(1, cache.misses)
+
+    def test_partial_timestamps_are_not_cached(self):
+        cache = TimestampCache()
+
+        self.assertTrue(is_partial_timestamp("12:00"))
+        self.assertTrue(is_partial_timestamp("June 19 12:00"))
+        self.assertFalse(is_partial_timestamp("2015-06-19 12:00"))
+        self.assertFalse(is_partial_timestamp("2015-06-19T12:00:00"))
+
+        self.assertEqual(parser.parse("12:00"), cache.parse("12:00"))
+        self.assertEqual(0, len(cache))
+
+        cache.parse("2015-06-19 12:00")
+        self.assertEqual(1, len(cache))
+
+    def test_dateutil_parses_per_miss(self):
+        calls = []
+
+        class CountingParser(object):
+            @staticmethod
+            def parse(value, **kwargs):
+                calls.append(value)
+
+                return parser.parse(value, **kwargs)
+
+        timestamps.parser = CountingParser
+
+        try:
+            cache = TimestampCache()
+
+            self.assertEqual(datetime(2015, 6, 19, 12), cache.parse("2015-06-19 12:00"))
+            self.assertEqual(1, len(calls))
+
+            # A date matching the first default needs a second parse to show it's complete
+            self.assertEqual(datetime(2015, 7, 3, 12), cache.parse("2015-07-03 12:00"))
+            self.assertEqual(3, len(calls))
+
+            cache.parse("2015-06-19 12:00")
+            self.assertEqual(3, len(calls))
+        finally:
+            timestamps.parser = parser